@@ -1,18 +1,72 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from pathlib import Path
+import asyncio
 import json
+import os
+import time
 
-from models.ollama_model import OllamaChatModel
-from models.openai_model import OpenAIChatModel
-from rag_service import LegalRAGService
-
-app = FastAPI()
+import metrics
+from models import http_pool
+from models.registry import default_registry
+from file_registry import DEFAULT_PUBLIC_BASE_URL, load_file_registry
+from rag_service import MANIFEST_PATH, LegalRAGService
+from scheduler import Overloaded, default_scheduler
 
 DOCS_DIR = Path("scraper/data")
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")
+# הכתובת שממנה הדפדפן מוריד את קבצי המקור בציטוטים (למשל מאחורי reverse proxy)
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", DEFAULT_PUBLIC_BASE_URL)
+MAX_BATCH_QUESTIONS = 1000
+MAX_BATCH_CONCURRENCY = 32
+# REQUEST_LOG_JSON=1 – שורת JSON אחת לכל בקשת /chat (זמני שלבים, טוקנים, cache)
+REQUEST_LOG_JSON = os.getenv("REQUEST_LOG_JSON", "").lower() in ("1", "true", "yes")
+
+
+def _load_service(app: FastAPI) -> None:
+    try:
+        service = LegalRAGService(
+            embedding_cache_dir=Path(EMBEDDING_CACHE_DIR) if EMBEDDING_CACHE_DIR else None,
+            file_registry=app.state.file_registry,
+        )
+        service.warmup()
+        app.state.rag_service = service
+    except Exception as e:
+        app.state.startup_error = str(e)
+        print(f"Failed to initialize RAG service: {e}")
+        return
+
+    # טעינת המודל המקומי ועיבוד ה-system prompt מראש, כדי שהשאלה הראשונה לא תשלם על זה
+    try:
+        app.state.model_registry.get("ollama").warmup(service.prompt_prefix())
+    except Exception as e:
+        print(f"Model warmup failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.rag_service = None
+    app.state.startup_error = None
+    app.state.model_registry = default_registry()
+    app.state.scheduler = default_scheduler()
+    app.state.file_registry = load_file_registry(MANIFEST_PATH, DOCS_DIR, PUBLIC_BASE_URL)
+
+    # החימום רץ ברקע – השרת עולה מיד, ו-/health מדווח not-ready עד שהמודל והאוסף טעונים
+    warmup_task = asyncio.create_task(asyncio.to_thread(_load_service, app))
+    yield
+    if not warmup_task.done():
+        warmup_task.cancel()
+    if app.state.rag_service is not None:
+        app.state.rag_service.close()
+    await http_pool.aclose_async_clients()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,52 +81,207 @@ class ChatRequest(BaseModel):
     model_type: str = "ollama"
     model_name: Optional[str] = None
 
+
+class BatchChatRequest(BaseModel):
+    questions: List[str] = Field(min_length=1, max_length=MAX_BATCH_QUESTIONS)
+    model_type: str = "ollama"
+    model_name: Optional[str] = None
+    concurrency: int = Field(default=4, ge=1, le=MAX_BATCH_CONCURRENCY)
+
+
+def get_service(request: Request) -> LegalRAGService:
+    service = request.app.state.rag_service
+    if service is None or not service.ready:
+        detail = request.app.state.startup_error or "Service is starting up, please retry shortly."
+        raise HTTPException(status_code=503, detail=detail)
+    return service
+
+
+def get_model(request: Request, model_type: str, model_name: Optional[str]):
+    try:
+        return request.app.state.model_registry.get(model_type, model_name)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown model type: {model_type}")
+    except RuntimeError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"OpenAI API key not configured: {str(e)}. Please set API_GPT or OPENAI_API_KEY environment variable."
+        )
+
+
+def overloaded_error(e: Overloaded) -> HTTPException:
+    # ה-backend עמוס – נכשלים מהר עם Retry-After במקום להצטרף לעוד timeout
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def _model_label(request: Request, model_type: str) -> str:
+    # סוג מודל לא מוכר לא נכנס כ-label, אחרת כל בקשה שגויה יוצרת סדרה חדשה ב-/metrics
+    return model_type if model_type in request.app.state.model_registry.model_types() else "unknown"
+
+
+def _finish_request(trace: metrics.RequestTrace, model_type: str, status: str) -> None:
+    trace.fields["status"] = status
+    path = trace.fields["path"]
+    metrics.REQUESTS.inc(path=path, model_type=model_type, status=status)
+    metrics.REQUEST_SECONDS.observe(trace.elapsed(), path=path, model_type=model_type)
+    for kind in ("prompt_words", "completion_tokens", "context_tokens", "context_tokens_dropped"):
+        if trace.counts.get(kind):
+            metrics.TOKENS.inc(trace.counts[kind], model_type=model_type, kind=kind)
+    if REQUEST_LOG_JSON:
+        metrics.log_trace(trace)
+
+
 @app.post("/chat")
-async def chat_endpoint(req: ChatRequest):
+async def chat_endpoint(req: ChatRequest, request: Request):
+    trace = metrics.start_trace(path="/chat", model_type=req.model_type, model_name=req.model_name)
+    model_label = _model_label(request, req.model_type)
+    model = None
+
     try:
-        if req.model_type == "openai":
-            try:
-                model = OpenAIChatModel(model_name=req.model_name or "gpt-4o-mini")
-            except RuntimeError as e:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"OpenAI API key not configured: {str(e)}. Please set API_GPT or OPENAI_API_KEY environment variable."
-                )
-        else:
-            model = OllamaChatModel(model_name=req.model_name or "llama3")
+        service = get_service(request)
 
-        service = LegalRAGService(chat_model=model)
+        # המקום אצל ה-backend נתפס בתוך astream_answer, רק כשהמודל באמת ירוץ: תשובה מה-cache או מהקטלוג
+        # לא נכנסת לתור, ועומס נדחה (429/503) לפני שה-stream התחיל
+        model = request.app.state.scheduler.wrap(get_model(request, req.model_type, req.model_name), req.model_type)
 
-        # ⬅️ במקום stream_answer – משתמשים ב-answer (עם ניקוי)
-        answer, citations = service.answer(req.question)
+        started = trace.started
+        stream, citations = await service.astream_answer(req.question, chat_model=model)
+        retrieval_done = time.perf_counter()
+        queue_seconds = getattr(model, "queue_seconds", 0.0)
 
         async def generator():
             # קודם שולחים ציטוטים
             yield json.dumps({"type": "citations", "data": citations}, ensure_ascii=False) + "\n"
-            # ואז את כל התשובה כמקטע אחד – אחרי _clean_answer
-            yield json.dumps({"type": "token", "data": answer}, ensure_ascii=False) + "\n"
 
-        return StreamingResponse(generator(), media_type="application/x-ndjson")
+            # ואז כל מקטע מהמודל ברגע שהגיע (אחרי ניקוי אינקרמנטלי של המשפטים)
+            first_token_at = None
+            chunks = 0
+            status = "stream_error"
+            try:
+                async for text in stream:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        metrics.FIRST_TOKEN_SECONDS.observe(first_token_at - started, model_type=model_label)
+                    chunks += 1
+                    yield json.dumps({"type": "token", "data": text}, ensure_ascii=False) + "\n"
+                status = "200"
+            finally:
+                model.cancel_reservation()
+                _finish_request(trace, model_label, status)
+
+            finished = time.perf_counter()
+            stats = {
+                "queue_ms": round(queue_seconds * 1000, 1),
+                "retrieval_ms": round((retrieval_done - started - queue_seconds) * 1000, 1),
+                "first_token_ms": round((first_token_at - started) * 1000, 1) if first_token_at else None,
+                "total_ms": round((finished - started) * 1000, 1),
+                "chunks": chunks,
+            }
+            yield json.dumps({"type": "done", "data": stats}, ensure_ascii=False) + "\n"
+
+        # גם אם ה-stream לא התחיל (הלקוח התנתק) המקום משתחרר; השחרור אידמפוטנטי
+        return StreamingResponse(
+            generator(), media_type="application/x-ndjson", background=BackgroundTask(model.cancel_reservation)
+        )
 
-    except HTTPException:
+    except Overloaded as e:
+        _finish_request(trace, model_label, str(e.status_code))
+        raise overloaded_error(e)
+    except HTTPException as e:
+        if model is not None:
+            model.cancel_reservation()
+        _finish_request(trace, model_label, str(e.status_code))
         raise
     except Exception as e:
+        if model is not None:
+            model.cancel_reservation()
+        _finish_request(trace, model_label, "500")
         import traceback
         error_detail = f"{str(e)}\n\n{traceback.format_exc()}"
         raise HTTPException(status_code=500, detail=error_detail)
 
+@app.post("/chat/batch")
+async def chat_batch_endpoint(req: BatchChatRequest, request: Request):
+    trace = metrics.start_trace(path="/chat/batch", model_type=req.model_type, questions=len(req.questions))
+    model_label = _model_label(request, req.model_type)
+
+    try:
+        service = get_service(request)
+        # שאלות ה-batch לא נדחות בעומס: ממתינות ל-Retry-After ומנסות שוב, ולא יותר ממספר היצירות
+        # המקבילות של ה-backend ממתינות בבת אחת – כך batch לא ממלא את התור של /chat
+        model = request.app.state.scheduler.wrap(
+            get_model(request, req.model_type, req.model_name), req.model_type, patient=True
+        )
+        limiter = request.app.state.scheduler.limiter(req.model_type)
+        concurrency = min(req.concurrency, limiter.max_concurrent) if limiter is not None else req.concurrency
+    except HTTPException as e:
+        _finish_request(trace, model_label, str(e.status_code))
+        raise
+
+    async def generator():
+        # שורה לכל שאלה לפי סדר הסיום; index מקשר אותה לשאלה ברשימה שנשלחה
+        answered = errors = 0
+        status = "stream_error"
+        try:
+            async for result in service.answer_many(req.questions, chat_model=model, concurrency=concurrency):
+                if "error" in result:
+                    errors += 1
+                    yield json.dumps({"type": "error", **result}, ensure_ascii=False) + "\n"
+                else:
+                    answered += 1
+                    yield json.dumps({"type": "result", **result}, ensure_ascii=False) + "\n"
+            status = "200"
+        except Exception as e:
+            yield json.dumps({"type": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            _finish_request(trace, model_label, status)
+
+        stats = {"answered": answered, "errors": errors, "total_ms": round(trace.elapsed() * 1000, 1)}
+        yield json.dumps({"type": "done", "data": stats}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(generator(), media_type="application/x-ndjson")
+
 @app.get("/api/files/{filename}")
-async def get_file(filename: str):
-    file_path = DOCS_DIR / filename
-    if not file_path.exists():
+async def get_file(filename: str, request: Request):
+    # רק קבצים שבאינדקס, לפי שם או file_id; גודל ו-ETag מה-registry (אחרי בדיקת stat), ו-Range נתמך ע"י FileResponse
+    registry = request.app.state.file_registry
+    record = registry.get(filename)
+    if record is not None:
+        record = registry.verify(record)
+    if record is None:
         raise HTTPException(status_code=404, detail="File not found")
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or record.etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers={"ETag": record.etag})
+
     return FileResponse(
-        path=str(file_path),
-        filename=filename,
-        media_type="application/octet-stream"
+        path=str(record.path),
+        filename=record.filename,
+        media_type="application/octet-stream",
+        headers={"ETag": record.etag},
+        stat_result=record.stat_result(),
     )
 
+@app.get("/cache/stats")
+def cache_stats(request: Request):
+    return get_service(request).cache_stats()
+
+@app.get("/metrics")
+def metrics_endpoint(request: Request):
+    service = request.app.state.rag_service
+    if service is not None and service.ready:
+        metrics.update_cache_metrics(service.cache_stats())
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
-def health():
-    return {"status": "ok"}
+def health(request: Request):
+    service = request.app.state.rag_service
+    if service is not None and service.ready:
+        return {"status": "ok", "ready": True}
 
+    error = request.app.state.startup_error
+    body = {"status": "error" if error else "starting", "ready": False}
+    if error:
+        body["detail"] = error
+    return JSONResponse(status_code=503, content=body)
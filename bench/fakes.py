@@ -0,0 +1,190 @@
+import hashlib
+import random
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterable, List
+from xml.sax.saxutils import escape
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from lexical_index import strip_prefix, tokenize
+from models.base import ChatModel, Message, estimate_tokens
+
+EMBEDDING_DIM = 384
+
+PARTIES = [
+    "רבוע כחול נדל\"ן", "שיכון ובינוי", "אלקטרה", "מגדל ביטוח", "הפניקס", "בנק הפועלים",
+    "בנק לאומי", "עיריית חיפה", "עיריית תל אביב", "משרד הבריאות", "רשות המסים", "כלל ביטוח",
+    "אפריקה ישראל", "תנובה", "שטראוס", "בזק", "פרטנר", "סלקום", "אל על", "חברת החשמל",
+]
+
+TOPICS = [
+    "הפרת חוזה", "רשלנות מקצועית", "פיצויי פיטורים", "ליקויי בנייה", "לשון הרע",
+    "זכויות יוצרים", "היטל השבחה", "ארנונה", "תאונת עבודה", "הגנת הצרכן",
+]
+
+CASE_KINDS = ["תא", "עא", "תצ", "עתמ", "סעש"]
+
+PARAGRAPHS = [
+    "בפני תביעה שהגישה {plaintiff} נגד {defendant} בעניין {topic}. לטענת התובעת, "
+    "הנתבעת לא עמדה בהתחייבויותיה ועל כן נגרם לה נזק כספי בסך של {amount} ש\"ח.",
+    "הנתבעת טוענת כי דין התביעה להידחות, שכן {topic} לא הוכח כנדרש וכי התובעת "
+    "לא הקטינה את נזקיה. עוד נטען כי חלה התיישנות על חלק מהרכיבים.",
+    "לאחר ששמעתי את העדים ועיינתי בראיות, מצאתי כי יש לקבל את התביעה בחלקה. "
+    "הוכח כי {defendant} הפרה את חובותיה בכל הנוגע ל{topic}.",
+    "אשר לגובה הנזק, חוות הדעת של המומחה מטעם בית המשפט מקובלת עליי, ולפיה הנזק "
+    "מסתכם ב-{amount} ש\"ח בצירוף הפרשי הצמדה וריבית מיום הגשת התביעה.",
+    "סוף דבר, הנתבעת תשלם לתובעת סך של {award} ש\"ח וכן הוצאות משפט ושכר טרחת עורך "
+    "דין בסך {fees} ש\"ח. ניתן היום, {day}.{month}.{year}, בהעדר הצדדים.",
+]
+
+
+def verdict_text(rng: random.Random, plaintiff: str, defendant: str, topic: str) -> List[str]:
+    amount = rng.randrange(50_000, 5_000_000, 1000)
+    values = {
+        "plaintiff": plaintiff,
+        "defendant": defendant,
+        "topic": topic,
+        "amount": f"{amount:,}",
+        "award": f"{amount // rng.randint(2, 5):,}",
+        "fees": f"{rng.randrange(5_000, 60_000, 500):,}",
+        "day": rng.randint(1, 28),
+        "month": rng.randint(1, 12),
+        "year": rng.randint(2015, 2024),
+    }
+
+    paragraphs = []
+    for template in PARAGRAPHS:
+        # חזרה על פסקאות מאריכה את המסמך כך שייווצרו כמה chunks לכל קובץ
+        for _ in range(rng.randint(1, 3)):
+            paragraphs.append(template.format(**values))
+    return paragraphs
+
+
+def write_docx(path: Path, paragraphs: Iterable[str]) -> None:
+    body = "".join(f"<w:p><w:r><w:t>{escape(p)}</w:t></w:r></w:p>" for p in paragraphs)
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}</w:body></w:document>"
+    )
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("word/document.xml", xml)
+
+
+def make_corpus(directory: Path, docs: int, seed: int = 0) -> List[dict]:
+    # קורפוס סינתטי ודטרמיניסטי (אותו seed -> אותם קבצים), בפורמט שמות הקבצים של ה-scraper
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    cases = []
+    for i in range(docs):
+        plaintiff, defendant = rng.sample(PARTIES, 2)
+        topic = rng.choice(TOPICS)
+        case_number = f"{rng.choice(CASE_KINDS)}_{rng.randint(1000, 99999)}-{rng.randint(1, 12):02d}-{rng.randint(15, 24)}"
+        path = directory / f"verdict_{i:04d}_{case_number}.docx"
+
+        write_docx(path, verdict_text(rng, plaintiff, defendant, topic))
+        cases.append({"path": path, "plaintiff": plaintiff, "defendant": defendant, "topic": topic})
+    return cases
+
+
+def make_questions(cases: List[dict], count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed + 1)
+    templates = [
+        "מה נפסק בעניין {plaintiff} נגד {defendant}?",
+        "מה נקבע לגבי {topic} בתביעה של {plaintiff}?",
+        "כמה פיצויים נפסקו נגד {defendant} בגין {topic}?",
+        "האם {defendant} הפרה את התחייבויותיה כלפי {plaintiff}?",
+    ]
+    general = ["איזה פסקי דין יש במאגר?", "מה פסק הדין האחרון מבחינת התאריך?"]
+
+    questions = []
+    seen = set()
+    attempts = 0
+    while len(questions) < count and attempts < count * 20:
+        attempts += 1
+        if rng.random() < 0.05:
+            question = rng.choice(general)
+        else:
+            question = rng.choice(templates).format(**rng.choice(cases))
+        # שאלות חוזרות היו פוגעות ב-cache של ה-embedding ומעוותות את המדידה
+        if question not in seen:
+            seen.add(question)
+            questions.append(question)
+    return questions
+
+
+class HashingEmbeddings(Embeddings):
+    # embedding דטרמיניסטי בלי מודל: כל מונח ממופה (לפי hash) לקואורדינטה ולסימן.
+    # מסמכים עם מילים משותפות קרובים זה לזה, וזה מספיק כדי למדוד את הצנרת
+    def __init__(self, *args, dim: int = EMBEDDING_DIM, **kwargs):
+        self.dim = dim
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            digest = hashlib.blake2b(strip_prefix(token).encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dim] += 1.0 if (value >> 32) & 1 else -1.0
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+class FakeChatModel(ChatModel):
+    # מודל דטרמיניסטי: עונה עם שמות המקורות שבהקשר, ומדמה זמן עד טוקן ראשון וקצב טוקנים.
+    # prefill_per_token מדמה עיבוד הפרומפט; כמו ב-Ollama, החלק שזהה לתחילת הפרומפט הקודם
+    # כבר נמצא ב-KV cache ולא מעובד שוב
+    def __init__(self, first_token_delay: float = 0.0, token_delay: float = 0.0, prefill_per_token: float = 0.0):
+        self.model_name = "fake"
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.prefill_per_token = prefill_per_token
+        self._cached_prompt = ""
+        self.prefill_tokens = 0
+        self.cached_tokens = 0
+
+    def _prefill(self, messages: List[Message]) -> float:
+        prompt = "".join(f"<{m['role']}>{m['content']}" for m in messages)
+        shared = 0
+        for a, b in zip(prompt, self._cached_prompt):
+            if a != b:
+                break
+            shared += 1
+        self._cached_prompt = prompt
+
+        cached = estimate_tokens(prompt[:shared])
+        self.cached_tokens += cached
+        self.prefill_tokens += estimate_tokens(prompt) - cached
+        return (estimate_tokens(prompt) - cached) * self.prefill_per_token
+
+    def _tokens(self, messages: List[Message]) -> List[str]:
+        user = messages[-1]["content"]
+        sources = [line[len("Source: "):] for line in user.splitlines() if line.startswith("Source: ")]
+        if not sources:
+            text = "לא נמצא מידע רלוונטי במאגר."
+        else:
+            text = " ".join(f"לפי המסמך [{i}] ({name}) התביעה התקבלה בחלקה." for i, name in enumerate(sources[:3], start=1))
+        words = text.split(" ")
+        return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+    def generate(self, messages: List[Message]) -> str:
+        return "".join(self.stream(messages))
+
+    def stream(self, messages: List[Message]) -> Iterable[str]:
+        time.sleep(self.first_token_delay + self._prefill(messages))
+        for i, token in enumerate(self._tokens(messages)):
+            if i and self.token_delay:
+                time.sleep(self.token_delay)
+            yield token
@@ -0,0 +1,339 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, List, Optional
+from unittest.mock import patch
+
+import numpy as np
+
+import build_index
+import rag_service
+from bench.fakes import FakeChatModel, HashingEmbeddings, make_corpus, make_questions
+from cache import write_index_version
+from catalog import CATALOG_FILENAME, Catalog
+from embedding_cache import EMBEDDING_MODEL_NAME, ENCODE_KWARGS, CachedEmbeddings
+from lexical_index import LexicalIndex
+from metrics import start_trace
+from models.base import ChatModel
+from models.ollama_model import OllamaChatModel
+from vector_index import VECTOR_BACKENDS
+
+RESULTS_DIR = Path(__file__).parent / "results"
+QUERY_STAGES = ["catalog", "embed", "vector_search", "lexical_search", "rerank", "context_build", "generation", "total"]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_indexing(
+    files: List[Path], embeddings: CachedEmbeddings, workers: int, batch_size: int, vector_backend: str = "chroma"
+) -> Dict:
+    # כל שלב נמדד בנפרד (ולכן נאסף לרשימה), בשונה מהצנרת הזורמת של build_index.main
+    started = time.perf_counter()
+    extracted = [
+        (path, pages)
+        for path, pages in build_index.iter_extracted(files, workers, build_index.DEFAULT_FILE_TIMEOUT)
+        if pages is not None
+    ]
+    extract_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    chunks = list(build_index.iter_chunks(extracted))
+    chunk_seconds = time.perf_counter() - started
+
+    vector_index = build_index.open_vector_index(vector_backend, embeddings)
+    stats = build_index.build_vector_store(chunks, vector_index, embeddings, batch_size=batch_size)
+    started = time.perf_counter()
+    vector_index.persist()
+    stats["seconds"] += time.perf_counter() - started
+
+    started = time.perf_counter()
+    lexicon = LexicalIndex.create(build_index.VECTOR_DB_DIR / LexicalIndex.FILENAME)
+    for chunk in chunks:
+        lexicon.add(chunk.metadata["chunk_id"], chunk.page_content)
+    lexicon.save()
+    lexicon.close()
+    lexical_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    catalog = Catalog()
+    for path, pages in extracted:
+        catalog.add(path.name, pages)
+    catalog.save(build_index.CATALOG_PATH)
+    catalog_seconds = time.perf_counter() - started
+
+    write_index_version(build_index.VECTOR_DB_DIR)
+
+    total_bytes = sum(p.stat().st_size for p in files)
+    total = extract_seconds + chunk_seconds + stats["seconds"] + lexical_seconds + catalog_seconds
+    return {
+        "files": len(files),
+        "bytes": total_bytes,
+        "chunks": len(chunks),
+        "extract_seconds": round(extract_seconds, 4),
+        "chunk_seconds": round(chunk_seconds, 4),
+        "embed_upsert_seconds": round(stats["seconds"], 4),
+        "lexical_seconds": round(lexical_seconds, 4),
+        "catalog_seconds": round(catalog_seconds, 4),
+        "total_seconds": round(total, 4),
+        "files_per_second": round(len(files) / total, 2) if total else 0.0,
+        "chunks_per_second": round(len(chunks) / total, 2) if total else 0.0,
+        "embed_chunks_per_second": round(stats["chunks_per_second"], 2),
+    }
+
+
+def bench_queries(service: rag_service.LegalRAGService, model: FakeChatModel, questions: List[str]) -> Dict:
+    # השלבים נמדדים ע"י ה-spans של השירות עצמו (metrics.py), בזמן "עצמי" בלי שלבים מקוננים
+    samples: Dict[str, List[float]] = {stage: [] for stage in QUERY_STAGES}
+    for question in questions:
+        trace = start_trace()
+        service.answer(question, model)
+        trace.stages["total"] = trace.elapsed()
+        for stage in QUERY_STAGES:
+            # שלב שלא רץ בבקשה הזו (למשל lexical_search בשאלה כללית) נספר כאפס
+            samples[stage].append(trace.stages.get(stage, 0.0))
+
+    return {stage: summarize(samples[stage]) for stage in QUERY_STAGES}
+
+
+def bench_ttft(service: rag_service.LegalRAGService, model: ChatModel, questions: List[str], reuse: bool) -> Dict:
+    # זמן עד הטקסט הראשון שהמשתמש רואה (אחרי AnswerCleaner), דרך stream_answer כמו ב-/chat
+    samples = []
+    with ExitStack() as stack:
+        if not reuse:
+            build = service._build_messages
+
+            def unique_prefix(*args, **kwargs):
+                # מזהה ייחודי בתחילת ה-system prompt שובר את התאמת התחילית בכל בקשה
+                messages = build(*args, **kwargs)
+                messages[0] = {**messages[0], "content": f"[{uuid.uuid4().hex}]\n" + messages[0]["content"]}
+                return messages
+
+            stack.enter_context(patch.object(service, "_build_messages", unique_prefix))
+
+        model.warmup(service.prompt_prefix())
+        for question in questions:
+            started = time.perf_counter()
+            stream, _ = service.stream_answer(question, model)
+            stream = iter(stream)
+            if next(stream, None) is not None:
+                samples.append(time.perf_counter() - started)
+            for _ in stream:
+                pass
+
+    return summarize(samples)
+
+
+def ttft_report(service: rag_service.LegalRAGService, make_model, questions: List[str]) -> Dict:
+    report = {}
+    simulated = False
+    for label, reuse in (("with_prefix_reuse", True), ("without_prefix_reuse", False)):
+        model = make_model()
+        report[label] = bench_ttft(service, model, questions, reuse)
+        if isinstance(model, FakeChatModel):
+            simulated = True
+            report[label]["prefill_tokens"] = model.prefill_tokens
+            report[label]["cached_tokens"] = model.cached_tokens
+
+    if simulated:
+        # במודל המדומה זמן ה-prefill נגזר מ-prefill_per_token, כך שההאצה נובעת מההגדרה ולא נמדדת;
+        # מה שכן נבדק הוא שהתחילית באמת משותפת (cached_tokens)
+        report["simulated"] = True
+        return report
+
+    with_reuse, without = report["with_prefix_reuse"], report["without_prefix_reuse"]
+    if with_reuse.get("p50_ms") and without.get("p50_ms"):
+        report["p50_speedup"] = round(without["p50_ms"] / with_reuse["p50_ms"], 3)
+    return report
+
+
+def run_benchmark(
+    docs: int = 200,
+    queries: int = 200,
+    workers: int = 1,
+    batch_size: int = build_index.DEFAULT_BATCH_SIZE,
+    seed: int = 0,
+    token_delay: float = 0.0,
+    first_token_delay: float = 0.0,
+    hf_embeddings: bool = False,
+    prefill_per_token: float = 0.0002,
+    ollama_url: Optional[str] = None,
+    ollama_model: str = "llama3",
+    work_dir: Optional[Path] = None,
+    vector_backend: str = "chroma",
+) -> Dict:
+    with ExitStack() as stack:
+        if work_dir is None:
+            work_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        vector_dir = work_dir / "vectorstore"
+
+        stack.enter_context(patch.object(build_index, "VECTOR_DB_DIR", vector_dir))
+        stack.enter_context(patch.object(rag_service, "VECTOR_DB_DIR", vector_dir))
+        stack.enter_context(patch.object(rag_service, "LEXICAL_INDEX_PATH", vector_dir / LexicalIndex.FILENAME))
+        stack.enter_context(patch.object(rag_service, "INDEX_VERSION_PATH", vector_dir / "index_version"))
+        stack.enter_context(patch.object(build_index, "CATALOG_PATH", vector_dir / CATALOG_FILENAME))
+        stack.enter_context(patch.object(rag_service, "CATALOG_PATH", vector_dir / CATALOG_FILENAME))
+        if not hf_embeddings:
+            stack.enter_context(patch.object(rag_service, "HuggingFaceEmbeddings", HashingEmbeddings))
+
+        cases = make_corpus(work_dir / "data", docs, seed)
+        files = [case["path"] for case in cases]
+        questions = make_questions(cases, queries, seed)
+
+        if hf_embeddings:
+            base = build_index.HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME, encode_kwargs=ENCODE_KWARGS)
+        else:
+            base = HashingEmbeddings()
+        indexing = bench_indexing(files, CachedEmbeddings(base), workers, batch_size, vector_backend)
+
+        # בלי cache של תשובות/אחזור – כל שאלה עוברת את כל השלבים
+        service = rag_service.LegalRAGService(cache_size=0, vector_backend=vector_backend)
+        try:
+            service.warmup()
+            model = FakeChatModel(first_token_delay=first_token_delay, token_delay=token_delay)
+            query = bench_queries(service, model, questions)
+            ttft_simulated = ttft_report(
+                service,
+                lambda: FakeChatModel(first_token_delay, token_delay, prefill_per_token),
+                questions,
+            )
+            if ollama_url:
+                ttft = ttft_report(
+                    service, lambda: OllamaChatModel(model_name=ollama_model, base_url=ollama_url), questions
+                )
+        finally:
+            service.close()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "docs": docs,
+            "queries": len(questions),
+            "workers": workers,
+            "batch_size": batch_size,
+            "seed": seed,
+            "token_delay": token_delay,
+            "first_token_delay": first_token_delay,
+            "embeddings": "huggingface" if hf_embeddings else "hashing",
+            "prefill_per_token": prefill_per_token,
+            "vector_backend": vector_backend,
+        },
+        "indexing": indexing,
+        "query": query,
+        "ttft_simulated": ttft_simulated,
+    }
+    if ollama_url:
+        results["ttft"] = ttft
+    return results
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = 0.10, min_delta_ms: float = 1.0) -> List[str]:
+    regressions = []
+    print(f"{'stage':<16}{'metric':<8}{'baseline':>12}{'current':>12}{'change':>10}")
+    for stage in QUERY_STAGES:
+        before = baseline.get("query", {}).get(stage, {})
+        after = current["query"].get(stage, {})
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if metric not in before or metric not in after:
+                continue
+            old, new = before[metric], after[metric]
+            change = (new - old) / old if old else 0.0
+            flag = ""
+            # שינויים של שברירי מילישנייה הם רעש מדידה ולא רגרסיה
+            if change > threshold and new - old >= min_delta_ms:
+                flag = "  <-- regression"
+                regressions.append(f"{stage} {metric}: {old} -> {new} ms")
+            print(f"{stage:<16}{metric:<8}{old:>12.3f}{new:>12.3f}{change:>+10.1%}{flag}")
+
+    old_rate = baseline.get("indexing", {}).get("chunks_per_second")
+    new_rate = current["indexing"]["chunks_per_second"]
+    if old_rate:
+        change = (new_rate - old_rate) / old_rate
+        print(f"{'indexing':<16}{'chunk/s':<8}{old_rate:>12.2f}{new_rate:>12.2f}{change:>+10.1%}")
+        if change < -threshold:
+            regressions.append(f"indexing chunks/s: {old_rate} -> {new_rate}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark indexing and query latency on a synthetic corpus.")
+    parser.add_argument("--docs", type=int, default=200, help="Number of synthetic verdicts to generate")
+    parser.add_argument("--queries", type=int, default=200, help="Number of distinct questions to run")
+    parser.add_argument("--workers", type=int, default=1, help="Extraction worker processes")
+    parser.add_argument("--batch-size", type=int, default=build_index.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between fake model tokens")
+    parser.add_argument("--first-token-delay", type=float, default=0.0, help="Seconds before the first fake token")
+    parser.add_argument("--prefill-per-token", type=float, default=0.0002,
+                        help="Seconds the fake model spends per uncached prompt token before the first token")
+    parser.add_argument("--ollama-url", help="Measure time-to-first-token with and without prefix reuse on this Ollama server")
+    parser.add_argument("--ollama-model", default="llama3")
+    parser.add_argument("--hf-embeddings", action="store_true", help="Use the real embedding model instead of hashing")
+    parser.add_argument("--vector-backend", choices=VECTOR_BACKENDS, default="chroma", help="Vector index engine")
+    parser.add_argument("--output", type=Path, help="Where to write the JSON results")
+    parser.add_argument("--compare", type=Path, help="Baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown counted as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(
+        docs=args.docs,
+        queries=args.queries,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        seed=args.seed,
+        token_delay=args.token_delay,
+        first_token_delay=args.first_token_delay,
+        hf_embeddings=args.hf_embeddings,
+        prefill_per_token=args.prefill_per_token,
+        ollama_url=args.ollama_url,
+        ollama_model=args.ollama_model,
+        vector_backend=args.vector_backend,
+    )
+
+    output = args.output or RESULTS_DIR / f"{results['commit'] or 'results'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    summary = {key: results[key] for key in ("indexing", "query", "ttft_simulated", "ttft") if key in results}
+    print(json.dumps(summary, indent=2))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare(baseline, results, args.threshold, args.min_delta_ms)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
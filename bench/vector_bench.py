@@ -0,0 +1,181 @@
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from bench.run_bench import RESULTS_DIR, git_commit, summarize
+from vector_index import CHROMA_COLLECTION, VECTOR_BACKENDS, ChromaVectorIndex, VectorIndex, chroma_collection, open_local_index
+
+# Chroma מגביל את גודל ה-batch בכתיבה אחת
+UPSERT_BATCH = 4096
+
+
+def clustered_vectors(count: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    # וקטורים מנורמלים סביב מרכזים – קרוב יותר ל-embeddings של פסקי דין מרעש אחיד
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(0, clusters, count)] + 0.35 * rng.normal(size=(count, dim))
+    vectors = vectors.astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(vectors: np.ndarray, count: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1)
+    queries = vectors[rng.integers(0, len(vectors), count)] + 0.1 * rng.normal(size=(count, vectors.shape[1]))
+    queries = queries.astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_neighbors(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ vectors.T
+    return np.argsort(-scores, axis=1, kind="stable")[:, :k]
+
+
+def recall_at(found: List[List[int]], truth: np.ndarray, k: int) -> float:
+    hits = [len(set(rows[:k]) & set(expected[:k].tolist())) / k for rows, expected in zip(found, truth)]
+    return round(float(np.mean(hits)), 4)
+
+
+def open_backend(name: str, directory: Path) -> VectorIndex:
+    if name == "chroma":
+        import chromadb
+        from langchain_community.vectorstores import Chroma
+
+        client = chromadb.PersistentClient(path=str(directory / "chroma"))
+        store = Chroma(client=client, collection_name=CHROMA_COLLECTION)
+        return ChromaVectorIndex(store, chroma_collection(client))
+    return open_local_index(name, directory)
+
+
+def rows_of(results) -> List[List[int]]:
+    return [[doc.metadata["row"] for doc in docs] for docs in results]
+
+
+def bench_backend(
+    name: str, directory: Path, vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, ks: Sequence[int]
+) -> Dict:
+    try:
+        index = open_backend(name, directory)
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    started = time.perf_counter()
+    for start in range(0, len(vectors), UPSERT_BATCH):
+        rows = range(start, min(start + UPSERT_BATCH, len(vectors)))
+        index.upsert(
+            ids=[f"v{row}" for row in rows],
+            embeddings=vectors[start:start + len(rows)],
+            documents=[""] * len(rows),
+            metadatas=[{"row": row} for row in rows],
+        )
+    index.persist()
+    build_seconds = time.perf_counter() - started
+    index.warmup()
+
+    k = max(ks)
+    single = []
+    found = []
+    for query in queries:
+        started = time.perf_counter()
+        found.extend(rows_of(index.query([query.tolist()], k)))
+        single.append(time.perf_counter() - started)
+
+    # כל השאלות בקריאה אחת, כמו ב-/chat/batch
+    started = time.perf_counter()
+    batch_found = rows_of(index.query(queries.tolist(), k))
+    batch_seconds = time.perf_counter() - started
+
+    report = {
+        "build_seconds": round(build_seconds, 4),
+        "single_query": summarize(single),
+        "batch_ms_per_query": round(batch_seconds * 1000 / len(queries), 4),
+    }
+    for at in ks:
+        report[f"recall@{at}"] = recall_at(found, truth, at)
+        report[f"batch_recall@{at}"] = recall_at(batch_found, truth, at)
+    return report
+
+
+def run_vector_benchmark(
+    vectors: int = 20000,
+    dim: int = 384,
+    queries: int = 200,
+    ks: Sequence[int] = (10, 100),
+    clusters: int = 64,
+    seed: int = 0,
+    backends: Sequence[str] = VECTOR_BACKENDS,
+    work_dir: Optional[Path] = None,
+) -> Dict:
+    matrix = clustered_vectors(vectors, dim, clusters, seed)
+    query_matrix = make_queries(matrix, queries, seed)
+    truth = exact_neighbors(matrix, query_matrix, max(ks))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        root = work_dir or Path(tmp)
+        for name in backends:
+            print(f"Benchmarking {name}...")
+            results[name] = bench_backend(name, root / name, matrix, query_matrix, truth, ks)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"vectors": vectors, "dim": dim, "queries": queries, "ks": list(ks), "clusters": clusters, "seed": seed},
+        "backends": results,
+    }
+
+
+def print_table(results: Dict) -> None:
+    ks = results["config"]["ks"]
+    header = f"{'backend':<10}{'build s':>10}{'p50 ms':>10}{'p95 ms':>10}{'batch ms/q':>12}"
+    header += "".join(f"{f'recall@{k}':>12}" for k in ks)
+    print(header)
+    for name, report in results["backends"].items():
+        if "skipped" in report:
+            print(f"{name:<10}skipped: {report['skipped']}")
+            continue
+        line = (
+            f"{name:<10}{report['build_seconds']:>10.2f}{report['single_query']['p50_ms']:>10.3f}"
+            f"{report['single_query']['p95_ms']:>10.3f}{report['batch_ms_per_query']:>12.3f}"
+        )
+        line += "".join(f"{report[f'recall@{k}']:>12.4f}" for k in ks)
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare recall@k and query latency of the vector index backends.")
+    parser.add_argument("--vectors", type=int, default=20000, help="Number of synthetic vectors to index")
+    parser.add_argument("--dim", type=int, default=384, help="Vector dimension (384 = the embedding model)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[10, 100], help="Cut-offs for recall@k")
+    parser.add_argument("--clusters", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", nargs="+", choices=VECTOR_BACKENDS, default=list(VECTOR_BACKENDS))
+    parser.add_argument("--output", type=Path, help="Where to write the JSON results")
+    args = parser.parse_args(argv)
+
+    results = run_vector_benchmark(
+        vectors=args.vectors,
+        dim=args.dim,
+        queries=args.queries,
+        ks=args.k,
+        clusters=args.clusters,
+        seed=args.seed,
+        backends=args.backends,
+    )
+
+    output = args.output or RESULTS_DIR / f"vectors-{results['commit'] or 'results'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print_table(results)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
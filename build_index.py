@@ -1,17 +1,50 @@
+import os
 import re
+import json
+import hashlib
 import logging
+import argparse
+import sys
+import time
+import queue
+import resource
+import threading
+import multiprocessing
+from collections import deque
+from itertools import islice
 from pathlib import Path
-from typing import List
+import numpy as np
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+import chromadb
 from langchain_community.vectorstores import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+from cache import write_index_version
+from catalog import CATALOG_FILENAME, Catalog
+from file_registry import file_id_for
+from embedding_cache import EMBEDDING_CONFIG_KEY, EMBEDDING_MODEL_NAME, ENCODE_KWARGS, CachedEmbeddings
+from lexical_index import LexicalIndex
+from vector_index import (
+    CHROMA_COLLECTION, DEFAULT_VECTOR_BACKEND, VECTOR_BACKENDS, ChromaVectorIndex, VectorIndex, chroma_collection,
+    open_local_index, vector_backend_from_env,
+)
 
 logging.getLogger("pypdf").setLevel(logging.ERROR)
 
 DOCS_DIR = Path("scraper/data")
 VECTOR_DB_DIR = Path("vectorstore")
+EMBEDDING_CACHE_DIR = VECTOR_DB_DIR / "embedding_cache"
+MANIFEST_PATH = VECTOR_DB_DIR / "manifest.json"
+CATALOG_PATH = VECTOR_DB_DIR / CATALOG_FILENAME
+# יומן השינויים שה-scraper כותב ליד הקבצים (added / changed / removed)
+CHANGES_FILENAME = "changes.jsonl"
+SUPPORTED_SUFFIXES = (".pdf", ".doc", ".docx")
+DEFAULT_FILE_TIMEOUT = 120.0
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_QUEUE_SIZE = 2
 
 def clean_text(text: str) -> str:
     text = re.sub(r'\n{3,}', '\n\n', text)
@@ -32,96 +65,556 @@ def extract_metadata_from_filename(filename: str) -> dict:
         "display_name": display_name
     }
 
-def load_documents() -> List[Document]:
+def list_source_files() -> List[Path]:
     if not DOCS_DIR.exists():
         raise FileNotFoundError(f"Documents folder not found: {DOCS_DIR}")
 
-    all_docs: List[Document] = []
+    return sorted(
+        p for p in DOCS_DIR.iterdir()
+        if p.is_file() and p.suffix.lower() in SUPPORTED_SUFFIXES
+    )
 
-    print(f"Scanning documents in {DOCS_DIR}...")
-    for path in DOCS_DIR.iterdir():
-        if not path.is_file():
-            continue
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-        suffix = path.suffix.lower()
-        loader = None
-        
-        try:
-            if suffix == ".pdf":
-                loader = PyPDFLoader(str(path))
-            elif suffix in (".doc", ".docx"):
-                loader = Docx2txtLoader(str(path))
-            else:
-                continue
+def _read_manifest(vector_backend: str) -> dict:
+    if not MANIFEST_PATH.exists():
+        return {}
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        data = json.load(f)
 
-            print(f"Loading {path.name} ...")
-            docs = loader.load()
-            
-            meta = extract_metadata_from_filename(path.name)
-            
-            for d in docs:
-                d.page_content = clean_text(d.page_content)
-                d.metadata["source_path"] = str(path)
-                d.metadata.update(meta)
-
-            all_docs.extend(docs)
-        except Exception as e:
-            msg = str(e)
-            if "File is not a zip file" in msg and suffix in (".doc", ".docx"):
-                continue
-            print(f"Error loading {path.name}: {e}")
+    if data.get("embedding") != EMBEDDING_CONFIG_KEY:
+        # וקטורים שנוצרו בתצורת embedding אחרת – מתייחסים כאילו אין manifest (בנייה מלאה)
+        print("Embedding configuration changed since the last build.")
+        return {}
+    if data.get("vector_backend", "chroma") != vector_backend:
+        # האינדקס של ה-backend החדש לא מכיל את מה שה-manifest מתאר
+        print(f"Vector backend changed to {vector_backend} since the last build.")
+        return {}
+    if data.get("files") and not LexicalIndex.is_current(VECTOR_DB_DIR / LexicalIndex.FILENAME):
+        # האינדקס הלקסיקלי נמחק או נשמר בפורמט ישן – כל הקבצים נכנסים אליו מחדש
+        print("Lexical index is missing.")
+        return {}
+    return data
+
+def load_manifest(vector_backend: str = DEFAULT_VECTOR_BACKEND) -> Dict[str, dict]:
+    return _read_manifest(vector_backend).get("files", {})
+
+def load_changes_offset(vector_backend: str = DEFAULT_VECTOR_BACKEND) -> Optional[int]:
+    # עד איזה byte ב-changes.jsonl האינדקס כבר מעודכן; None – עוד לא נקרא, סורקים את כל התיקייה
+    return _read_manifest(vector_backend).get("changes_offset")
+
+def save_manifest(
+    files: Dict[str, dict], changes_offset: Optional[int] = None, vector_backend: str = DEFAULT_VECTOR_BACKEND
+) -> None:
+    data = {"embedding": EMBEDDING_CONFIG_KEY, "vector_backend": vector_backend, "files": files}
+    if changes_offset is not None:
+        data["changes_offset"] = changes_offset
+    tmp = MANIFEST_PATH.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    tmp.replace(MANIFEST_PATH)
+
+def changes_size() -> Optional[int]:
+    path = DOCS_DIR / CHANGES_FILENAME
+    return path.stat().st_size if path.exists() else None
+
+def read_changes(offset: int) -> Optional[Tuple[Dict[str, dict], int]]:
+    # האירוע האחרון לכל קובץ מאז offset, והמקום החדש ביומן. None – היומן נמחק או קוצר, צריך סריקה מלאה
+    path = DOCS_DIR / CHANGES_FILENAME
+    if not path.exists() or path.stat().st_size < offset:
+        return None
+
+    events: Dict[str, dict] = {}
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                # שורה שה-scraper עדיין כותב – תיקרא בפעם הבאה
+                break
+            offset += len(line)
+            event = json.loads(line)
+            events[event["filename"]] = event
+    return events, offset
+
+def files_from_changes(manifest: Dict[str, dict], events: Dict[str, dict]) -> Tuple[List[Path], Dict[str, str]]:
+    # המצב הנוכחי של התיקייה = ה-manifest + השינויים מהיומן, בלי לקרוא ולגבב כל קובץ מחדש
+    # קובץ שהחילוץ שלו נכשל נשאר עם התוכן האחרון שנראה, כדי שינוסה שוב
+    hashes = {name: entry.get("failed_sha256") or entry["sha256"] for name, entry in manifest.items()}
+    for name, event in events.items():
+        if event["event"] == "removed" or Path(name).suffix.lower() not in SUPPORTED_SUFFIXES:
+            hashes.pop(name, None)
+        elif (DOCS_DIR / name).exists():
+            hashes[name] = event["sha256"]
+    return [DOCS_DIR / name for name in sorted(hashes)], hashes
+
+def extract_file(path_str: str) -> Optional[List[Document]]:
+    # רץ בתהליך נפרד – מחזיר את העמודים הנקיים עם המטא-דאטה; None בשגיאה, כדי שהקובץ ינוסה שוב בבנייה הבאה
+    path = Path(path_str)
+    suffix = path.suffix.lower()
+    loader = None
+
+    try:
+        if suffix == ".pdf":
+            loader = PyPDFLoader(str(path))
+        elif suffix in (".doc", ".docx"):
+            loader = Docx2txtLoader(str(path))
+        else:
+            return []
+
+        print(f"Loading {path.name} ...")
+        docs = loader.load()
+
+        meta = extract_metadata_from_filename(path.name)
+
+        for d in docs:
+            d.page_content = clean_text(d.page_content)
+            d.metadata["source_path"] = str(path)
+            d.metadata.update(meta)
+
+        return docs
+    except Exception as e:
+        msg = str(e)
+        if "File is not a zip file" in msg and suffix in (".doc", ".docx"):
+            return []
+        print(f"Error loading {path.name}: {e}")
+        return None
+
+def iter_extracted(
+    paths: List[Path],
+    workers: int,
+    file_timeout: float,
+    extract: Callable[[str], Optional[List[Document]]] = extract_file,
+) -> Iterator[Tuple[Path, Optional[List[Document]]]]:
+    # לכל קובץ – העמודים שלו, או None אם החילוץ נכשל או חרג מהזמן
+    if workers <= 1:
+        for path in paths:
+            yield path, extract(str(path))
+        return
+
+    # spawn ולא fork: בתהליך הראשי כבר רצים threads של torch/Chroma
+    ctx = multiprocessing.get_context("spawn")
+    remaining = iter(paths)
+    pending: Deque[Tuple[Path, Any, float]] = deque()
+    pool = ctx.Pool(workers)
+
+    def submit(path: Path) -> Tuple[Path, Any, float]:
+        return path, pool.apply_async(extract, (str(path),)), time.monotonic() + file_timeout
 
-    print(f"Loaded {len(all_docs)} raw document pages/sections.")
-    return all_docs
+    try:
+        while True:
+            # לא יותר משימות פתוחות מתהליכים: כל קובץ מתחיל לרוץ כשהוא נשלח,
+            # כך שהזמן הקצוב נמדד מתחילת החילוץ שלו ולא מהרגע שהגיע לראש התור
+            while len(pending) < workers:
+                path = next(remaining, None)
+                if path is None:
+                    break
+                pending.append(submit(path))
+
+            if not pending:
+                break
+
+            # התוצאות נאספות לפי סדר הקבצים, כך שמזהי ה-chunks יציבים בין ריצות
+            path, result, deadline = pending.popleft()
+            try:
+                yield path, result.get(timeout=max(0.0, deadline - time.monotonic()))
+            except multiprocessing.TimeoutError:
+                print(f"Timed out after {file_timeout:.0f}s, skipping: {path.name}")
+                # תהליך תקוע לא משתחרר לבד – מחליפים את ה-pool ומגישים מחדש את מה שלא הסתיים
+                pool.terminate()
+                pool = ctx.Pool(workers)
+                pending = deque(
+                    (p, r, d) if r.ready() else submit(p)
+                    for p, r, d in pending
+                )
+                yield path, None
+    finally:
+        pool.terminate()
 
-def split_documents(documents: List[Document]) -> List[Document]:
-    text_splitter = RecursiveCharacterTextSplitter(
+def make_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=250,
         separators=["\n\n", "\n", " ", ""],
         keep_separator=True
     )
-    
-    split_docs = text_splitter.split_documents(documents)
-    print(f"Created {len(split_docs)} chunks from {len(documents)} source pages.")
-    return split_docs
 
-def build_vector_store(chunks: List[Document]):
-    if not chunks:
-        print("No chunks to index.")
-        return
+def iter_chunks(extracted: Iterable[Tuple[Path, List[Document]]]) -> Iterator[Document]:
+    # קובץ אחד בכל פעם: העמודים שלו מתפצלים ל-chunks ומשתחררים לפני שהקובץ הבא נטען
+    text_splitter = make_text_splitter()
+    for _, pages in extracted:
+        if not pages:
+            continue
+        chunks = text_splitter.split_documents(pages)
+        assign_chunk_ids(chunks)
+        yield from chunks
+
+def assign_chunk_ids(chunks: List[Document]) -> None:
+    counters = {}
+    for chunk in chunks:
+        filename = chunk.metadata.get("filename", "")
+        ordinal = counters.get(filename, 0)
+        counters[filename] = ordinal + 1
+        chunk.metadata["chunk_id"] = f"{filename}#{ordinal}"
+
+def open_lexical_index(stale_ids: List[str], reset: bool = False) -> LexicalIndex:
+    path = VECTOR_DB_DIR / LexicalIndex.FILENAME
+    index = LexicalIndex.create(path) if reset else LexicalIndex(path)
+    for chunk_id in stale_ids:
+        index.remove(chunk_id)
+    return index
+
+class MultiProcessEncoder(Embeddings):
+    # pool של תהליכי sentence-transformers שנפתח פעם אחת לכל הבנייה
+    def __init__(self, workers: int, batch_size: int):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        self.pool = self.model.start_multi_process_pool(target_devices=["cpu"] * workers)
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.model.encode_multi_process(
+            texts, self.pool, batch_size=self.batch_size, **ENCODE_KWARGS
+        )
+        return vectors.tolist()
 
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def close(self) -> None:
+        self.model.stop_multi_process_pool(self.pool)
+
+def create_embeddings(batch_size: int = DEFAULT_BATCH_SIZE, encode_workers: int = 1) -> CachedEmbeddings:
+    if encode_workers > 1:
+        base = MultiProcessEncoder(encode_workers, batch_size)
+    else:
+        base = HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL_NAME,
+            encode_kwargs={**ENCODE_KWARGS, "batch_size": batch_size},
+        )
+
+    return CachedEmbeddings(base, disk_dir=EMBEDDING_CACHE_DIR, model_name=EMBEDDING_CONFIG_KEY)
+
+def open_chroma_client():
     VECTOR_DB_DIR.mkdir(exist_ok=True)
-    
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    return chromadb.PersistentClient(path=str(VECTOR_DB_DIR))
+
+def open_vector_store(embeddings: Optional[Embeddings] = None, client=None) -> Chroma:
+    return Chroma(
+        client=client or open_chroma_client(),
+        embedding_function=embeddings or create_embeddings(),
+        collection_name=CHROMA_COLLECTION,
+    )
+
+def open_vector_index(
+    vector_backend: str = DEFAULT_VECTOR_BACKEND, embeddings: Optional[Embeddings] = None, reset: bool = False
+) -> VectorIndex:
+    if vector_backend == "chroma":
+        client = open_chroma_client()
+        store = open_vector_store(embeddings, client)
+        if reset:
+            store.delete_collection()
+            store = open_vector_store(embeddings, client)
+        return ChromaVectorIndex(store, chroma_collection(client))
+
+    VECTOR_DB_DIR.mkdir(exist_ok=True)
+    index = open_local_index(vector_backend, VECTOR_DB_DIR, embeddings)
+    if reset:
+        index.clear()
+    return index
+
+def iter_batches(items: Iterable[Document], size: int) -> Iterator[List[Document]]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def encode_batch(embeddings: Embeddings, batch: List[Document]) -> np.ndarray:
+    vectors = np.asarray(embeddings.embed_documents([c.page_content for c in batch]), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def upsert_batch(vector_index: VectorIndex, batch: List[Document], vectors: np.ndarray) -> None:
+    vector_index.upsert(
+        ids=[c.metadata["chunk_id"] for c in batch],
+        embeddings=vectors,
+        documents=[c.page_content for c in batch],
+        metadatas=[c.metadata for c in batch],
     )
 
-    print("Building vector store...")
-    vectordb = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=str(VECTOR_DB_DIR),
-        collection_name="verdicts"
+def build_vector_store(
+    chunks: Iterable[Document],
+    vector_index: VectorIndex,
+    embeddings: Embeddings,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> Dict[str, float]:
+    print(f"Embedding and upserting chunks in batches of {batch_size}...")
+    started = time.perf_counter()
+    encode_seconds = 0.0
+    done = 0
+
+    # ה-encode של batch N+1 רץ בזמן שה-thread הכותב שומר את batch N;
+    # התור חסום, כך שבזיכרון יש לכל היותר queue_size + 1 batches
+    write_queue: "queue.Queue[Optional[Tuple[List[Document], np.ndarray]]]" = queue.Queue(maxsize=queue_size)
+    write_errors: List[BaseException] = []
+
+    def writer():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            if not write_errors:
+                try:
+                    upsert_batch(vector_index, *item)
+                except BaseException as e:
+                    write_errors.append(e)
+
+    writer_thread = threading.Thread(target=writer, name="index-writer", daemon=True)
+    writer_thread.start()
+
+    try:
+        for batch in iter_batches(chunks, batch_size):
+            if write_errors:
+                break
+
+            encode_started = time.perf_counter()
+            vectors = encode_batch(embeddings, batch)
+            encode_seconds += time.perf_counter() - encode_started
+
+            write_queue.put((batch, vectors))
+            done += len(batch)
+            print(f"  {done} chunks embedded")
+    finally:
+        write_queue.put(None)
+        writer_thread.join()
+
+    if write_errors:
+        raise write_errors[0]
+
+    if not done:
+        print("No chunks to index.")
+
+    seconds = time.perf_counter() - started
+    rate = done / seconds if seconds > 0 else 0.0
+    print(
+        f"Vector store updated at {VECTOR_DB_DIR}: {done} chunks in {seconds:.1f}s "
+        f"({rate:.1f} chunks/s, encode {encode_seconds:.1f}s)"
     )
-    
+    return {"chunks": done, "seconds": seconds, "chunks_per_second": rate}
+
+def peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss הוא ב-KB בלינוקס ובבתים ב-macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "main": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "workers": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+def main(
+    full: bool = False,
+    workers: Optional[int] = None,
+    file_timeout: float = DEFAULT_FILE_TIMEOUT,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    encode_workers: int = 1,
+    scan: bool = False,
+    vector_backend: Optional[str] = None,
+):
+    vector_backend = vector_backend or vector_backend_from_env()
+    manifest = {} if full else load_manifest(vector_backend)
+    offset = None if full or scan or not manifest else load_changes_offset(vector_backend)
+    changes = read_changes(offset) if offset is not None else None
+
+    if changes is not None:
+        events, changes_offset = changes
+        print(f"Read {len(events)} file change(s) from {CHANGES_FILENAME}.")
+        files, hashes = files_from_changes(manifest, events)
+    else:
+        # המיקום ביומן נלקח לפני הסריקה: מה שנכתב בזמן הסריקה ייקרא שוב בפעם הבאה
+        changes_offset = changes_size()
+        files, hashes = list_source_files(), None
+
+    embeddings = create_embeddings(batch_size=batch_size, encode_workers=encode_workers)
     try:
-        if hasattr(vectordb, 'persist'):
-            vectordb.persist()
-    except Exception as e:
-        print(f"Persist note: {e}")
-        
-    print(f"Vector store successfully saved to: {VECTOR_DB_DIR}")
+        update_index(
+            files, manifest, embeddings, full, workers, file_timeout, batch_size,
+            hashes=hashes, changes_offset=changes_offset, vector_backend=vector_backend,
+        )
+    finally:
+        if isinstance(embeddings.base, MultiProcessEncoder):
+            embeddings.base.close()
 
-def main():
-    documents = load_documents()
-    
-    if not documents:
-        print("No documents found to index.")
+def update_index(
+    files: List[Path],
+    manifest: Dict[str, dict],
+    embeddings: CachedEmbeddings,
+    full: bool,
+    workers: Optional[int],
+    file_timeout: float,
+    batch_size: int,
+    hashes: Optional[Dict[str, str]] = None,
+    changes_offset: Optional[int] = None,
+    vector_backend: str = DEFAULT_VECTOR_BACKEND,
+):
+    vector_index = open_vector_index(vector_backend, embeddings)
+
+    if not full and not manifest and vector_index.count():
+        # אינדקס ישן בלי manifest – אין דרך לדעת אילו chunks שייכים לאיזה קובץ
+        print("Existing vector store has no manifest, doing a full rebuild.")
+        full = True
+
+    if full:
+        vector_index = open_vector_index(vector_backend, embeddings, reset=True)
+
+    catalog = Catalog() if full else Catalog.load(CATALOG_PATH)
+    if hashes is None:
+        hashes = {path.name: file_sha256(path) for path in files}
+    # קובץ שאונדקס לפני שהיה קטלוג נשלף שוב (ה-embeddings שלו כבר ב-cache)
+    changed = [
+        path for path in files
+        if manifest.get(path.name, {}).get("sha256") != hashes[path.name]
+        or (manifest[path.name].get("chunk_ids") and path.name not in catalog.entries)
+    ]
+    removed = [name for name in manifest if name not in hashes]
+
+    if not changed and not removed:
+        print("Index is up to date, nothing to do.")
+        if changes_offset is not None and changes_offset != load_changes_offset(vector_backend):
+            save_manifest(manifest, changes_offset, vector_backend)
         return
 
-    chunks = split_documents(documents)
-    build_vector_store(chunks)
+    print(f"Files: {len(files)} total, {len(changed)} new or changed, {len(removed)} removed.")
+
+    # ה-chunks של קובץ שנמחק יוצאים מיד; של קובץ שהשתנה – רק אחרי שהחילוץ החדש שלו הצליח
+    # (ה-upsert דורס את אותם מזהים), כך שחילוץ שנכשל לא מוחק פסק דין שכבר היה באינדקס
+    stale_ids = [chunk_id for name in removed for chunk_id in manifest[name].get("chunk_ids", [])]
+    if stale_ids:
+        vector_index.delete(stale_ids)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(changed) or 1))
+    print(f"Extracting {len(changed)} files with {workers} worker(s)...")
+
+    lexicon = open_lexical_index(stale_ids, reset=full)
+    chunk_ids: Dict[str, List[str]] = {}
+
+    for name in removed:
+        catalog.remove(name)
+
+    sizes: Dict[str, Tuple[int, float]] = {}
+    failed: List[str] = []
+
+    def register(
+        extracted: Iterable[Tuple[Path, Optional[List[Document]]]]
+    ) -> Iterator[Tuple[Path, List[Document]]]:
+        # גודל ומזהה הקובץ נשמרים ב-metadata של כל chunk וב-manifest, כדי שהשרת לא יבדוק את הדיסק בכל ציטוט
+        for path, pages in extracted:
+            if pages is None:
+                failed.append(path.name)
+                continue
+            st = path.stat()
+            sizes[path.name] = (st.st_size, st.st_mtime)
+            for page in pages:
+                page.metadata["file_id"] = file_id_for(path.name)
+                page.metadata["file_size"] = st.st_size
+            catalog.remove(path.name)
+            if pages:
+                catalog.add(path.name, pages)
+            yield path, pages
+
+    def track(chunks: Iterable[Document]) -> Iterator[Document]:
+        for chunk in chunks:
+            lexicon.add(chunk.metadata["chunk_id"], chunk.page_content)
+            chunk_ids.setdefault(chunk.metadata["filename"], []).append(chunk.metadata["chunk_id"])
+            yield chunk
+
+    # extraction -> split -> encode -> upsert, הכל דרך generators ותורים חסומים
+    extracted = register(iter_extracted(changed, workers, file_timeout))
+    stats = build_vector_store(track(iter_chunks(extracted)), vector_index, embeddings, batch_size=batch_size)
+
+    # קובץ שהתקצר משאיר מזהים ישנים מעבר למה שנדרס
+    leftover_ids = [
+        chunk_id
+        for name in sizes
+        for chunk_id in set(manifest.get(name, {}).get("chunk_ids", [])) - set(chunk_ids.get(name, []))
+    ]
+    if leftover_ids:
+        vector_index.delete(leftover_ids)
+        for chunk_id in leftover_ids:
+            lexicon.remove(chunk_id)
+    vector_index.persist()
+
+    lexicon.save()
+    lexicon.close()
+    print(f"Lexical index saved with {len(lexicon)} chunks.")
+    catalog.save(CATALOG_PATH)
+    print(f"Catalog saved with {len(catalog)} verdicts.")
+
+    for name in removed:
+        del manifest[name]
+    for path in changed:
+        if path.name not in sizes:
+            continue
+        size, mtime = sizes[path.name]
+        manifest[path.name] = {
+            "sha256": hashes[path.name],
+            "file_id": file_id_for(path.name),
+            "size": size,
+            "mtime": mtime,
+            "chunk_ids": chunk_ids.get(path.name, []),
+        }
+    for name in failed:
+        # הרשומה הקודמת (והאינדקס שלה) נשארת; failed_sha256 שונה מ-sha256, ולכן הקובץ ינוסה שוב בפעם הבאה
+        manifest.setdefault(name, {"chunk_ids": []})["failed_sha256"] = hashes[name]
+    if failed:
+        print(f"{len(failed)} file(s) failed to extract and will be retried next time: {', '.join(failed)}")
+    save_manifest(manifest, changes_offset, vector_backend)
+
+    # השרת משווה לגרסה הזו ומרוקן את ה-cache שלו כשהאינדקס נבנה מחדש
+    version = write_index_version(VECTOR_DB_DIR)
+    rss = peak_rss_mb()
+    print(
+        f"Index version: {version} | files: {len(sizes)} ({len(failed)} failed) | chunks: {stats['chunks']} | "
+        f"{stats['chunks_per_second']:.1f} chunks/s | "
+        f"peak RSS: {rss['main']:.0f} MB (extraction workers: {rss['workers']:.0f} MB)"
+    )
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Build or update the verdicts search index.")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and rebuild everything.")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: CPU count).")
+    parser.add_argument(
+        "--file-timeout", type=float, default=DEFAULT_FILE_TIMEOUT,
+        help="Seconds before a single file's extraction is abandoned.",
+    )
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Chunks per embedding batch.")
+    parser.add_argument(
+        "--encode-workers", type=int, default=1,
+        help="Processes for multi-process embedding (1 = encode in this process).",
+    )
+    parser.add_argument(
+        "--scan", action="store_true",
+        help=f"Hash every file in the documents folder instead of reading {CHANGES_FILENAME}.",
+    )
+    parser.add_argument(
+        "--vector-backend", choices=VECTOR_BACKENDS, default=None,
+        help="Vector index engine (default: VECTOR_BACKEND or chroma).",
+    )
+    args = parser.parse_args()
+    main(
+        full=args.full,
+        workers=args.workers,
+        file_timeout=args.file_timeout,
+        batch_size=args.batch_size,
+        encode_workers=args.encode_workers,
+        scan=args.scan,
+        vector_backend=args.vector_backend,
+    )
@@ -0,0 +1,276 @@
+import json
+import math
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from lexical_index import STOP_WORDS, query_terms, strip_prefix, tokenize
+
+CATALOG_FILENAME = "catalog.json"
+SUMMARY_CHARS = 240
+TOPIC_COUNT = 5
+# לכל פסק דין נשמרים רק המונחים השכיחים – מספיק כדי לחשב נושאים (TF-IDF) מול שאר הקטלוג
+TERM_CANDIDATES = 30
+DEFAULT_PAGE_SIZE = 20
+
+HEBREW_MONTHS = {
+    "ינואר": 1, "פברואר": 2, "מרץ": 3, "מרס": 3, "אפריל": 4, "מאי": 5, "יוני": 6,
+    "יולי": 7, "אוגוסט": 8, "ספטמבר": 9, "אוקטובר": 10, "נובמבר": 11, "דצמבר": 12,
+}
+
+NUMERIC_DATE_RE = re.compile(r"\b(\d{1,2})[./](\d{1,2})[./](\d{4})\b")
+HEBREW_DATE_RE = re.compile(r"\b(\d{1,2})\s+ב?(" + "|".join(HEBREW_MONTHS) + r")\s+(\d{4})\b")
+PDF_DATE_RE = re.compile(r"^(?:D:)?(\d{4})-?(\d{2})-?(\d{2})")
+
+# מילים שמנסחות שאלת קטלוג ולא מסננות אותו ("איזה פסקי דין יש במאגר?"), כולל הצורה אחרי הסרת אות שימוש
+CATALOG_WORDS = {
+    "איזה", "אילו", "פסקי", "פסקים", "כמה", "רשימה", "רשימת", "אתה", "מכיר", "מאגר",
+    "במאגר", "מסמכים", "סמכים", "המסמכים", "אחרון", "האחרון", "אחרונים", "האחרונים", "חדש",
+    "החדש", "ישן", "הישן", "ראשון", "הראשון", "מבחינת", "בחינת", "תאריך", "התאריך", "עמוד",
+    "הדין", "דינים", "הצג", "תראה", "הראה", "כל", "לי", "לך", "תן", "יש", "ישנם", "קיימים",
+    "אצלך", "שנת", "משנת", "בשנת", "נושא", "בנושא", "עוסקים", "שעוסקים",
+}
+
+# ניסוחים של בקשה על המאגר עצמו – רשימה, ספירה, האחרון/הראשון. "מה פסק..." או "רשימה של הטענות"
+# הן שאלות על תוכן פסק דין ועוברות ל-RAG
+CATALOG_INTENTS = (
+    "איזה פסקי", "אילו פסקי", "כמה פסקי", "רשימת פסקי", "רשימה של פסקי", "רשימה של כל פסקי",
+    "הצג את פסקי", "הצג פסקי", "פסקי דין אתה", "פסקי הדין שיש", "פסקי הדין האחרונים",
+    "פסק הדין האחרון", "פסק הדין הראשון", "פסק הדין החדש", "פסק הדין הישן", "מבחינת התאריך",
+    "מה יש במאגר", "מה במאגר", "איזה מסמכים", "אילו מסמכים", "כמה מסמכים",
+)
+# מספר תיק ("8-644-2023", "תא/100") – שאלה על פסק דין מסוים
+CASE_NUMBER_RE = re.compile(r"\d+\s*[-/]\s*\d+")
+
+NEWEST_WORDS = ("האחרון", "האחרונים", "החדש", "הכי חדש")
+OLDEST_WORDS = ("הראשון", "הישן", "הכי ישן", "המוקדם")
+PAGE_RE = re.compile(r"עמוד\s+(\d+)")
+YEAR_RE = re.compile(r"\b(19\d{2}|20\d{2})\b")
+
+
+def _valid_date(year: int, month: int, day: int) -> Optional[str]:
+    if 1 <= month <= 12 and 1 <= day <= 31 and 1900 <= year <= 2100:
+        return f"{year:04d}-{month:02d}-{day:02d}"
+    return None
+
+
+def parse_metadata_date(value) -> Optional[str]:
+    # pypdf מחזיר "D:20230514120000+03'00'" או ISO ("2023-05-14T12:00:00+03:00")
+    match = PDF_DATE_RE.match(str(value or "").strip())
+    if not match:
+        return None
+    return _valid_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+
+
+def find_verdict_date(text: str) -> Optional[str]:
+    # "ניתן היום, 12.5.2023" מופיע בסוף פסק הדין – לכן התאריך האחרון בטקסט
+    found = []
+    for match in NUMERIC_DATE_RE.finditer(text):
+        found.append((match.start(), _valid_date(int(match.group(3)), int(match.group(2)), int(match.group(1)))))
+    for match in HEBREW_DATE_RE.finditer(text):
+        month = HEBREW_MONTHS[match.group(2)]
+        found.append((match.start(), _valid_date(int(match.group(3)), month, int(match.group(1)))))
+
+    dates = [date for _, date in sorted(found) if date]
+    return dates[-1] if dates else None
+
+
+def summarize(text: str, limit: int = SUMMARY_CHARS) -> str:
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit] + "…"
+
+
+def candidate_terms(text: str, limit: int = TERM_CANDIDATES) -> Tuple[Dict[str, int], Dict[str, str]]:
+    # המונחים (אחרי הסרת אות שימוש, לסינון ול-TF-IDF) והצורה השכיחה של כל אחד בטקסט, להצגה
+    counts = Counter()
+    forms: Dict[str, Counter] = {}
+    for token in tokenize(text):
+        term = strip_prefix(token)
+        if len(term) > 2 and not term.isdigit() and term not in STOP_WORDS and token not in STOP_WORDS:
+            counts[term] += 1
+            forms.setdefault(term, Counter())[token] += 1
+    terms = dict(counts.most_common(limit))
+    return terms, {term: forms[term].most_common(1)[0][0] for term in terms}
+
+
+def catalog_entry(filename: str, pages: List[Document]) -> Dict:
+    metadata = pages[0].metadata if pages else {}
+    text = "\n".join(page.page_content for page in pages)
+    moddate = parse_metadata_date(metadata.get("moddate"))
+    creationdate = parse_metadata_date(metadata.get("creationdate"))
+    verdict_date = find_verdict_date(text)
+    terms, forms = candidate_terms(text)
+
+    page_count = metadata.get("total_pages")
+    if page_count is None and filename.lower().endswith(".pdf"):
+        page_count = len(pages)
+
+    return {
+        "filename": filename,
+        "display_name": metadata.get("display_name", filename),
+        "source_path": metadata.get("source_path", ""),
+        # תאריך המיון: תאריך מתן פסק הדין מהטקסט, ואם אין – תאריכי הקובץ
+        "date": verdict_date or moddate or creationdate,
+        "verdict_date": verdict_date,
+        "moddate": moddate,
+        "creationdate": creationdate,
+        "pages": page_count,
+        "summary": summarize(pages[0].page_content if pages else ""),
+        "topics": [],
+        "terms": terms,
+        "forms": forms,
+    }
+
+
+class Catalog:
+    def __init__(self, entries: Optional[Dict[str, Dict]] = None):
+        self.entries: Dict[str, Dict] = entries or {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, filename: str, pages: List[Document]) -> None:
+        self.entries[filename] = catalog_entry(filename, pages)
+
+    def remove(self, filename: str) -> None:
+        self.entries.pop(filename, None)
+
+    def _update_topics(self) -> None:
+        df = Counter(term for entry in self.entries.values() for term in entry["terms"])
+        total = len(self.entries)
+        for entry in self.entries.values():
+            scored = sorted(
+                entry["terms"].items(),
+                key=lambda item: (-item[1] * math.log(1 + total / df[item[0]]), item[0]),
+            )
+            forms = entry.get("forms", {})
+            entry["topics"] = [forms.get(term, term) for term, _ in scored[:TOPIC_COUNT]]
+
+    def save(self, path: Path) -> None:
+        self._update_topics()
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"entries": self.entries}, f, ensure_ascii=False)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "Catalog":
+        if not path.exists():
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f).get("entries", {}))
+
+    def query(
+        self,
+        terms: Optional[List[str]] = None,
+        year: Optional[int] = None,
+        newest_first: bool = True,
+        offset: int = 0,
+        limit: int = DEFAULT_PAGE_SIZE,
+    ) -> Tuple[int, List[Dict]]:
+        entries = list(self.entries.values())
+        if year is not None:
+            entries = [e for e in entries if (e["date"] or "").startswith(f"{year:04d}")]
+        for term in terms or []:
+            entries = [e for e in entries if term in _haystack(e)]
+
+        # רשומות בלי תאריך תמיד בסוף, בלי קשר לכיוון המיון
+        dated = sorted((e for e in entries if e["date"]), key=lambda e: (e["date"], e["filename"]), reverse=newest_first)
+        undated = sorted((e for e in entries if not e["date"]), key=lambda e: e["filename"])
+        ordered = dated + undated
+        return len(ordered), ordered[max(offset, 0):max(offset, 0) + max(limit, 0)]
+
+
+def _haystack(entry: Dict) -> str:
+    return " ".join([entry["display_name"], entry["summary"], *entry["topics"], *entry["terms"]]).lower()
+
+
+def is_page_request(question: str) -> bool:
+    # "עמוד 2" / "תן לי עמוד 2" – המשך של רשימה מהקטלוג, כפי ש-format_answer מציע
+    return bool(PAGE_RE.search(question)) and all(term in CATALOG_WORDS for term in query_terms(question))
+
+
+def is_catalog_question(question: str) -> bool:
+    text = question.lower()
+    if CASE_NUMBER_RE.search(text):
+        return False
+    return any(intent in text for intent in CATALOG_INTENTS) or is_page_request(text)
+
+
+class CatalogQuery:
+    def __init__(self, terms: List[str], year: Optional[int], newest_first: bool, offset: int, limit: int,
+                 count_only: bool, unmatched: Optional[List[str]] = None):
+        self.terms = terms
+        # מילים ענייניות שאינן ניסוח ולא מופיעות בקטלוג – הקטלוג לא יודע לענות עליהן
+        self.unmatched = unmatched or []
+        self.year = year
+        self.newest_first = newest_first
+        self.offset = offset
+        self.limit = limit
+        self.count_only = count_only
+
+
+def parse_question(question: str, catalog: Catalog, page_size: int = DEFAULT_PAGE_SIZE) -> CatalogQuery:
+    text = question.lower()
+    single = any(word in text for word in NEWEST_WORDS + OLDEST_WORDS) and "פסקי" not in text
+    newest_first = not any(word in text for word in OLDEST_WORDS)
+
+    page_match = PAGE_RE.search(text)
+    page = int(page_match.group(1)) if page_match else 1
+    year_match = YEAR_RE.search(text)
+    year = int(year_match.group(1)) if year_match else None
+
+    # מילה שמופיעה בקטלוג מסננת אותו; מילה שלא מופיעה בו נשמרת בצד, כדי שהשאלה תעבור ל-RAG
+    corpus = " ".join(_haystack(entry) for entry in catalog.entries.values())
+    candidates = [
+        term for term in query_terms(question)
+        if term not in CATALOG_WORDS and not YEAR_RE.fullmatch(term) and not term.isdigit()
+    ]
+    terms = [term for term in candidates if term in corpus]
+    unmatched = [term for term in candidates if term not in corpus]
+
+    limit = 1 if single else page_size
+    return CatalogQuery(
+        terms, year, newest_first, (page - 1) * limit, limit, count_only="כמה" in text, unmatched=unmatched
+    )
+
+
+def format_entry(entry: Dict) -> str:
+    details = [entry["date"] or "ללא תאריך"]
+    if entry["pages"]:
+        details.append(f"{entry['pages']} עמ'")
+    line = f"{entry['display_name']} ({', '.join(details)})"
+    if entry["topics"]:
+        line += f" – נושאים: {', '.join(entry['topics'])}"
+    return line
+
+
+def format_answer(query: CatalogQuery, total: int, entries: List[Dict]) -> str:
+    if total == 0:
+        return "לא נמצאו במאגר פסקי דין שמתאימים לבקשה."
+    if query.count_only:
+        return f"במאגר {total} פסקי דין שמתאימים לבקשה."
+    if query.limit == 1 and entries:
+        which = "האחרון" if query.newest_first else "הראשון"
+        return f"פסק הדין {which} מבחינת התאריך הוא [1] {format_entry(entries[0])}."
+    if not entries:
+        return f"במאגר {total} פסקי דין מתאימים, אין תוצאות בעמוד המבוקש."
+
+    order = "מהחדש לישן" if query.newest_first else "מהישן לחדש"
+    first = query.offset + 1
+    lines = [f"במאגר {total} פסקי דין מתאימים. מוצגים {first}-{query.offset + len(entries)}, לפי תאריך ({order}):"]
+    lines += [f"[{i}] {format_entry(entry)}" for i, entry in enumerate(entries, start=1)]
+    if query.offset + len(entries) < total:
+        page = query.offset // query.limit + 2
+        if query.terms or query.year:
+            # אין זיכרון בין שאלות – "עמוד N" לבד מציג את כל המאגר, לכן הסינון צריך לחזור בשאלה
+            lines.append(f"לתוצאות נוספות שאל שוב עם \"עמוד {page}\" בסוף השאלה.")
+        else:
+            lines.append(f"לתוצאות נוספות בקש \"עמוד {page}\".")
+    return "\n".join(lines)
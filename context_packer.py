@@ -0,0 +1,110 @@
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.documents import Document
+
+from models.base import estimate_tokens
+
+# build_index.py מפצל עם chunk_overlap=250; מחפשים חפיפה קצת מעבר לזה בגלל מפרידים שנשמרו
+OVERLAP_SEARCH_CHARS = 300
+# כל בלוק DOCUMENT בהקשר כולל כותרת, שם מקור ותאריכים – מעבר לטקסט עצמו
+BLOCK_TEMPLATE = "--- DOCUMENT [00] ---\nSource: {name}\nDate: 0000-00-00\nContent:\n\n--- END [00] ---\n\n"
+GAP_MARKER = "\n...\n"
+
+TokenCounter = Callable[[str], int]
+
+
+def verdict_key(doc: Document) -> str:
+    return doc.metadata.get("display_name") or doc.metadata.get("filename") or ""
+
+
+def chunk_ordinal(doc: Document) -> Optional[int]:
+    chunk_id = doc.metadata.get("chunk_id") or ""
+    _, sep, ordinal = chunk_id.rpartition("#")
+    if sep and ordinal.isdigit():
+        return int(ordinal)
+    return None
+
+
+def strip_overlap(previous: str, following: str, limit: int = OVERLAP_SEARCH_CHARS) -> str:
+    # החלק שבתחילת ה-chunk הבא שכבר מופיע בסוף הקודם (החפיפה של ה-splitter)
+    for size in range(min(limit, len(previous), len(following)), 0, -1):
+        if previous.endswith(following[:size]):
+            return following[size:].lstrip()
+    return following
+
+
+def merge_chunks(chunks: List[Document]) -> Document:
+    # chunks של אותו פסק דין לפי סדר הופעתם במסמך; סמוכים מתאחדים בלי החפיפה, ובין רחוקים מסמנים פער
+    ordered = sorted(chunks, key=lambda c: (chunk_ordinal(c) is None, chunk_ordinal(c) or 0))
+    text = ordered[0].page_content
+    for prev, chunk in zip(ordered, ordered[1:]):
+        prev_ordinal, ordinal = chunk_ordinal(prev), chunk_ordinal(chunk)
+        if prev_ordinal is not None and ordinal == prev_ordinal + 1:
+            addition = strip_overlap(prev.page_content, chunk.page_content)
+            if addition:
+                text += " " + addition
+        else:
+            text += GAP_MARKER + chunk.page_content
+
+    metadata = dict(ordered[0].metadata)
+    if len(ordered) > 1:
+        metadata["chunk_ids"] = [c.metadata.get("chunk_id") for c in ordered]
+    return Document(page_content=text, metadata=metadata)
+
+
+class PackedContext:
+    def __init__(self, docs: List[Document], budget: int, used_tokens: int, dropped_tokens: int,
+                 used_chunks: int, dropped_chunks: int):
+        self.docs = docs
+        self.budget = budget
+        self.used_tokens = used_tokens
+        self.dropped_tokens = dropped_tokens
+        self.used_chunks = used_chunks
+        self.dropped_chunks = dropped_chunks
+
+    def report(self) -> Dict[str, int]:
+        return {
+            "budget": self.budget,
+            "used_tokens": self.used_tokens,
+            "dropped_tokens": self.dropped_tokens,
+            "used_chunks": self.used_chunks,
+            "dropped_chunks": self.dropped_chunks,
+            "documents": len(self.docs),
+        }
+
+
+def pack_context(docs: List[Document], budget: int, count_tokens: TokenCounter = estimate_tokens) -> PackedContext:
+    # docs מגיעים מדורגים (הטוב ראשון). בוחרים בחמדנות chunk אחרי chunk כל עוד נשאר תקציב –
+    # chunk שלא נכנס מדולג, וקטן ממנו בהמשך עדיין יכול להיכנס
+    remaining = max(budget, 0)
+    selected: Dict[str, List[Document]] = {}
+    used_chunks = dropped_chunks = dropped_tokens = 0
+
+    for doc in docs:
+        key = verdict_key(doc)
+        text_cost = count_tokens(doc.page_content)
+        header_cost = 0 if key in selected else count_tokens(BLOCK_TEMPLATE.format(name=key))
+
+        if text_cost + header_cost <= remaining:
+            selected.setdefault(key, []).append(doc)
+            remaining -= text_cost + header_cost
+            used_chunks += 1
+        elif not selected and remaining > header_cost:
+            # גם ה-chunk הטוב ביותר לא נכנס – עדיף חלק ממנו מאשר תשובה בלי הקשר
+            text_budget = remaining - header_cost
+            keep = int(len(doc.page_content) * text_budget / text_cost)
+            while keep > 0 and count_tokens(doc.page_content[:keep]) > text_budget:
+                keep = int(keep * 0.95)
+            truncated = Document(page_content=doc.page_content[:keep], metadata=doc.metadata)
+            selected[key] = [truncated]
+            dropped_tokens += text_cost - count_tokens(truncated.page_content)
+            remaining = 0
+            used_chunks += 1
+        else:
+            dropped_tokens += count_tokens(doc.page_content)
+            dropped_chunks += 1
+
+    merged = [merge_chunks(chunks) for chunks in selected.values()]
+    used_tokens = sum(count_tokens(doc.page_content) + count_tokens(BLOCK_TEMPLATE.format(name=verdict_key(doc)))
+                      for doc in merged)
+    return PackedContext(merged, budget, used_tokens, dropped_tokens, used_chunks, dropped_chunks)
@@ -0,0 +1,234 @@
+import fcntl
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from cache import normalize_text
+from metrics import span
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# שאילתות ומסמכים מנורמלים שניהם (אורך 1), אחרת המרחקים ב-Chroma לא עקביים
+ENCODE_KWARGS = {"normalize_embeddings": True}
+# מזהה את תצורת ה-embedding – שינוי שלו מבטל cache ומחייב בנייה מלאה של האינדקס
+EMBEDDING_CONFIG_KEY = f"{EMBEDDING_MODEL_NAME}|normalized"
+
+class DiskEmbeddingStore:
+    # מטריצת float32 ממופה לזיכרון (vectors.f32) + אינדקס מפתח -> שורה (keys.jsonl, append-only).
+    # כמה תהליכים (ה-API ו-build_index.py) יכולים לחלוק תיקייה: הקצאת שורות וכתיבה עוברות תחת נעילת קובץ
+    # (keys.lock), ולפני הקצאה קוראים את מה שתהליכים אחרים הוסיפו ל-keys.jsonl
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, directory: Path, dim: int, model_name: str = ""):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self._vectors_path = self.directory / "vectors.f32"
+        self._keys_path = self.directory / "keys.jsonl"
+        self._meta_path = self.directory / "meta.json"
+        self._lock_path = self.directory / "keys.lock"
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._next_row = 0
+        self._keys_offset = 0
+
+        with self._lock, self._file_lock():
+            meta = {"dim": dim, "model_name": model_name}
+            if not self._meta_path.exists() or json.loads(self._meta_path.read_text(encoding="utf-8")) != meta:
+                # מודל או ממד אחר – הווקטורים הישנים לא שמישים
+                self._vectors_path.unlink(missing_ok=True)
+                self._keys_path.unlink(missing_ok=True)
+                self._meta_path.write_text(json.dumps(meta), encoding="utf-8")
+
+            self._read_new_keys()
+            capacity = max(self.INITIAL_CAPACITY, self._next_row)
+            if self._vectors_path.exists():
+                capacity = max(capacity, self._vectors_path.stat().st_size // (4 * dim))
+            self._open(capacity)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        # נעילה בלעדית בין תהליכים; ה-threading.Lock מגן בתוך התהליך
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_new_keys(self) -> None:
+        # ממשיכים מהמקום שבו עצרנו; שורה שעוד לא נכתבה עד הסוף נקראת בפעם הבאה
+        if not self._keys_path.exists():
+            return
+        with open(self._keys_path, "rb") as f:
+            f.seek(self._keys_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._keys_offset += len(line)
+                line = line.strip()
+                if line:
+                    key, row = json.loads(line)
+                    self._rows[key] = row
+                    self._next_row = max(self._next_row, row + 1)
+
+    def _open(self, capacity: int) -> None:
+        size = capacity * self.dim * 4
+        with open(self._vectors_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        # המיפוי החדש מחליף את הישן בהשמה אחת; הישן נסגר כשאין עליו עוד הפניות
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._capacity = capacity
+
+    def _ensure_capacity(self, rows: int) -> None:
+        if rows > self._capacity:
+            self._vectors.flush()
+            on_disk = self._vectors_path.stat().st_size // (4 * self.dim)
+            self._open(max(rows, self._capacity * 2, on_disk))
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        # put_many מגדיל את המיפוי מתחת לאותו מנעול, כך שלא קוראים מיפוי שמוחלף באמצע
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                # אולי תהליך אחר כבר חישב אותו; הווקטור נכתב לפני השורה ב-keys.jsonl
+                self._read_new_keys()
+                row = self._rows.get(key)
+                if row is None:
+                    return None
+                self._ensure_capacity(self._next_row)
+            return np.array(self._vectors[row])
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        with self._lock, self._file_lock():
+            self._read_new_keys()
+            new_items = [(k, v) for k, v in items.items() if k not in self._rows]
+            if not new_items:
+                return
+
+            first = self._next_row
+            self._ensure_capacity(first + len(new_items))
+            for row, (_, vector) in enumerate(new_items, start=first):
+                self._vectors[row] = vector
+            # הווקטורים על הדיסק לפני שהמפתחות שמצביעים עליהם נראים לתהליכים אחרים
+            self._vectors.flush()
+
+            lines = [json.dumps([key, row]) + "\n" for row, (key, _) in enumerate(new_items, start=first)]
+            with open(self._keys_path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+            # השורות שלנו נקראות כמו של כל תהליך אחר – כך גם ההיסט בקובץ מתעדכן
+            self._read_new_keys()
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(
+        self,
+        base: Embeddings,
+        max_entries: int = 4096,
+        disk_dir: Optional[Path] = None,
+        model_name: str = "",
+    ):
+        self.base = base
+        self.max_entries = max_entries
+        self.model_name = model_name
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_dir = Path(disk_dir) if disk_dir else None
+        self._disk: Optional[DiskEmbeddingStore] = None
+        self.hits = 0
+        self.misses = 0
+
+        if self._disk_dir is not None and (self._disk_dir / "meta.json").exists():
+            # הממד ידוע מהריצה הקודמת – פותחים מיד כדי שגם השאילתה הראשונה תיהנה מה-cache
+            meta = json.loads((self._disk_dir / "meta.json").read_text(encoding="utf-8"))
+            self._disk = DiskEmbeddingStore(self._disk_dir, meta["dim"], model_name)
+
+    @staticmethod
+    def _key(namespace: str, text: str) -> str:
+        return namespace + hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                return vector
+
+        if self._disk is not None:
+            vector = self._disk.get(key)
+            if vector is not None:
+                self._remember(key, vector)
+            return vector
+        return None
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _embed(self, keys: List[str], texts: List[str]) -> List[List[float]]:
+        vectors: List[Optional[np.ndarray]] = [self._lookup(k) for k in keys]
+
+        missing: Dict[str, str] = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+
+        hits = len(keys) - sum(1 for v in vectors if v is None)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        if missing:
+            # כל החסרים עוברים יחד ב-forward pass אחד (ב-MiniLM אין הבדל בין קידוד שאילתה למסמך)
+            computed = self.base.embed_documents(list(missing.values()))
+            fresh = {key: np.asarray(vec, dtype=np.float32) for key, vec in zip(missing, computed)}
+
+            for key, vector in fresh.items():
+                self._remember(key, vector)
+            if self._disk_dir is not None:
+                with self._lock:
+                    if self._disk is None:
+                        self._disk = DiskEmbeddingStore(self._disk_dir, len(computed[0]), self.model_name)
+                    disk = self._disk
+                disk.put_many(fresh)
+
+            vectors = [v if v is not None else fresh[k] for k, v in zip(keys, vectors)]
+
+        return [v.tolist() for v in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        with span("embed"):
+            keys = [self._key("q:", normalize_text(t)) for t in texts]
+            return self._embed(keys, texts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key("d:", t) for t in texts]
+        return self._embed(keys, texts)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits, misses, memory_entries = self.hits, self.misses, len(self._memory)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "memory_entries": memory_entries,
+            "disk_entries": len(self._disk) if self._disk is not None else 0,
+        }
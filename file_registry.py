@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import stat
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import quote
+
+DEFAULT_PUBLIC_BASE_URL = "http://localhost:8005"
+
+
+def file_id_for(filename: str) -> str:
+    # מזהה לפי שם הקובץ ולא לפי התוכן – נשאר זהה גם כשהקובץ מתעדכן
+    return hashlib.sha256(filename.encode("utf-8")).hexdigest()[:16]
+
+
+class FileRecord:
+    __slots__ = ("filename", "file_id", "path", "size", "mtime", "sha256")
+
+    def __init__(self, filename: str, path: Path, size: int, mtime: float, sha256: str = ""):
+        self.filename = filename
+        self.file_id = file_id_for(filename)
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.sha256 = sha256
+
+    @property
+    def etag(self) -> str:
+        if self.sha256:
+            return f'"{self.sha256[:32]}"'
+        return f'"{self.file_id}-{self.size}-{int(self.mtime)}"'
+
+    def stat_result(self) -> os.stat_result:
+        # FileResponse מקבל stat מוכן ולא ניגש לדיסק בשביל גודל ותאריך
+        return os.stat_result((stat.S_IFREG | 0o644, 0, 0, 1, 0, 0, self.size, self.mtime, self.mtime, self.mtime))
+
+
+class FileRegistry:
+    # כל קבצי המקור שבאינדקס, לפי ה-manifest של build_index.py: נטען פעם אחת בעלייה
+    # ומחדש רק כשהאינדקס נבנה מחדש, כך שציטוטים והורדות לא ניגשים לדיסק בכל בקשה
+    def __init__(self, manifest_path: Path, docs_dir: Path, base_url: str = DEFAULT_PUBLIC_BASE_URL):
+        self.manifest_path = manifest_path
+        self.docs_dir = docs_dir
+        self.base_url = base_url.rstrip("/")
+        self._by_name: Dict[str, FileRecord] = {}
+        self._by_id: Dict[str, FileRecord] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def reload(self) -> None:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                files = json.load(f).get("files", {})
+        except (OSError, ValueError):
+            files = {}
+
+        records = {}
+        for filename, entry in files.items():
+            path = self.docs_dir / filename
+            size, mtime = entry.get("size"), entry.get("mtime")
+            if size is None or mtime is None:
+                # manifest מגרסה שלא שמרה גודל – stat חד-פעמי בטעינה
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                size, mtime = st.st_size, st.st_mtime
+            records[filename] = FileRecord(filename, path, size, mtime, entry.get("sha256", ""))
+
+        with self._lock:
+            self._by_name = records
+            self._by_id = {record.file_id: record for record in records.values()}
+
+    def get(self, name_or_id: str) -> Optional[FileRecord]:
+        return self._by_name.get(name_or_id) or self._by_id.get(name_or_id) or self._from_disk(name_or_id)
+
+    def _from_disk(self, filename: str) -> Optional[FileRecord]:
+        # קובץ בלי רשומה ב-manifest (אינדקס שנבנה לפני שהיה manifest) מוגש מ-DOCS_DIR כמו קודם: stat אחד,
+        # ETag מהגודל והתאריך. רק שם קובץ פשוט – לא נתיב שיוצא מהתיקייה
+        if not filename or filename in (".", "..") or Path(filename).name != filename:
+            return None
+        path = self.docs_dir / filename
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        record = FileRecord(filename, path, st.st_size, st.st_mtime)
+        with self._lock:
+            record = self._by_name.setdefault(filename, record)
+            self._by_id.setdefault(record.file_id, record)
+        return record
+
+    def verify(self, record: FileRecord) -> Optional[FileRecord]:
+        # stat אחד לבקשה: קובץ שה-scraper החליף אחרי הבנייה האחרונה מוגש לפי הגודל והתאריך שלו בפועל,
+        # אחרת Content-Length, ETag ו-Range היו מתארים את הקובץ הישן
+        try:
+            st = record.path.stat()
+        except OSError:
+            return None
+        if st.st_size == record.size and st.st_mtime == record.mtime:
+            return record
+
+        # ה-sha256 מה-manifest כבר לא נכון – ה-ETag נגזר מהגודל והתאריך עד הבנייה הבאה
+        fresh = FileRecord(record.filename, record.path, st.st_size, st.st_mtime)
+        with self._lock:
+            if self._by_name.get(record.filename) is record:
+                self._by_name[record.filename] = fresh
+                self._by_id[fresh.file_id] = fresh
+        return fresh
+
+    def url_for(self, filename: str) -> str:
+        record = self._by_name.get(filename) or self._from_disk(filename)
+        if record is None:
+            return ""
+        return f"{self.base_url}/api/files/{quote(record.filename)}"
+
+
+def load_file_registry(manifest_path: Path, docs_dir: Path, base_url: str = DEFAULT_PUBLIC_BASE_URL) -> FileRegistry:
+    registry = FileRegistry(manifest_path, docs_dir, base_url)
+    registry.reload()
+    return registry
@@ -42,7 +42,7 @@ function App() {
           setMessages((prev) => {
             const newMsgs = [...prev];
             const last = newMsgs[newMsgs.length - 1];
-            last.content += token;
+            newMsgs[newMsgs.length - 1] = { ...last, content: last.content + token };
             return newMsgs;
           });
         },
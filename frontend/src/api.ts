@@ -13,12 +13,20 @@ export type Citation = {
   metadata: any;
 };
 
+export type StreamStats = {
+  retrieval_ms: number;
+  first_token_ms: number | null;
+  total_ms: number;
+  chunks: number;
+};
+
 export async function chat(
   question: string,
   modelType: "ollama" | "openai",
   modelName: string | undefined,
   onToken: (token: string) => void,
-  onCitations: (citations: Citation[]) => void
+  onCitations: (citations: Citation[]) => void,
+  onDone?: (stats: StreamStats) => void
 ) {
   const response = await fetch("http://localhost:8005/chat", {
     method: "POST",
@@ -53,6 +61,8 @@ export async function chat(
           onCitations(json.data);
         } else if (json.type === "token") {
           onToken(json.data);
+        } else if (json.type === "done") {
+          onDone?.(json.data);
         }
       } catch (e) {
         console.error("Error parsing line", line, e);
@@ -0,0 +1,351 @@
+import heapq
+import math
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+
+HEBREW_PREFIXES = ("ב", "ה", "ל", "מ", "ש", "כ")
+
+STOP_WORDS = {
+    "של", "את", "על", "כי", "זה", "או", "כל", "הוא", "היא", "גם", "בין", "רק", "אך",
+    "אין", "יש", "מה", "מי", "איך", "כיצד", "מתי", "איפה", "למה", "מדוע", "האם",
+    "היה", "היתה", "היו", "תהיה", "יהיה", "פסק", "דין", "בית", "משפט", "החלטה",
+    "תביעה", "נתבעת", "תובעת", "נגד", "בפני", "ב", "בעמ", "בע\"מ",
+}
+
+TOKEN_STRIP = '.,?"\'!:;()[]{}-–'
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def strip_prefix(word: str) -> str:
+    if len(word) > 4 and word.startswith(HEBREW_PREFIXES):
+        return word[1:]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for raw in text.split():
+        token = raw.strip(TOKEN_STRIP).lower()
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def query_terms(question: str) -> List[str]:
+    raw_words = [w.strip('.,?"\'').lower() for w in question.split()]
+
+    filtered_words = []
+    for w in raw_words:
+        clean_w = strip_prefix(w)
+        if len(clean_w) > 1 and clean_w not in STOP_WORDS and w not in STOP_WORDS:
+            filtered_words.append(clean_w)
+
+    return filtered_words
+
+
+# מילה שנשמרה גם כשהיא הפוכה (PDF שחולץ מימין לשמאל) – בצורה המתוקנת שלה, אחרי הסימן הזה
+REVERSED_MARK = "~"
+
+
+def term_forms(token: str) -> Set[str]:
+    # הצורות שמילה נשמרת תחתן: בלי אות שימוש אחת ובלי שתיים ("למקרקעין" -> "מקרקעין", "קרקעין"),
+    # כי strip_prefix בשאלה חותך גם אות שהיא חלק מהמילה ("מקרקעין" -> "קרקעין")
+    first = strip_prefix(token)
+    return {first, strip_prefix(first)}
+
+
+def token_terms(tokens: List[str]) -> Counter:
+    # כל מילה בצורותיה, וגם בצורות של המילה כשהיא הפוכה – כך "הזוחב" נמצאת כ-"~חוזה"
+    terms = Counter(form for token in tokens for form in term_forms(token))
+    terms.update(REVERSED_MARK + form for token in tokens for form in term_forms(token[::-1]))
+    return terms
+
+
+def word_pairs(tokens: List[str]) -> Set[str]:
+    # לכל שתי מילים סמוכות: הצמד ("א ב"), המילה המחוברת ("אב" – ל-PDF-ים שבהם מילה נשברה לשתיים)
+    # והצמד כשהטקסט הפוך (המילים מתוקנות ובסדר ההפוך)
+    pairs = set()
+    for first, second in zip(tokens, tokens[1:]):
+        pairs.update(f"{a} {b}" for a in term_forms(first) for b in term_forms(second))
+        pairs.update(term_forms(first + second))
+        pairs.update(
+            f"{REVERSED_MARK}{a} {b}" for a in term_forms(second[::-1]) for b in term_forms(first[::-1])
+        )
+    return pairs
+
+
+class ChunkFeatures:
+    # מה שהדירוג בודק ב-chunk, כקבוצות: המונחים (אחרי הסרת אות שימוש) ומספר ההופעות שלהם, וצמדי המילים
+    # הסמוכות (word_pairs). מהאינדקס נטען רק מה שנוגע לשאלה; chunk שלא באינדקס מחושב מהטקסט
+    __slots__ = ("term_freqs", "pairs", "length")
+
+    def __init__(self, term_freqs: Counter, pairs: Set[str], length: int):
+        self.term_freqs = term_freqs
+        self.pairs = pairs
+        self.length = length
+
+    @classmethod
+    def from_text(cls, text: str) -> "ChunkFeatures":
+        tokens = tokenize(text)
+        return cls(token_terms(tokens), word_pairs(tokens), len(tokens))
+
+
+class LexicalIndex:
+    # אינדקס הפוך שנבנה ב-build_index.py, ב-SQLite: לכל מונח (אחרי הסרת אות שימוש) – ה-chunks שבהם הוא
+    # מופיע ומספר ההופעות, לכל צמד מילים סמוכות – ה-chunks שבהם הוא מופיע, ולכל chunk האורך שלו.
+    # הכל נכתב לדיסק תוך כדי הבנייה, כך שהזיכרון לא גדל עם גודל הקורפוס
+    FILENAME = "lexical_index.db"
+    # PRAGMA user_version; קובץ בגרסה אחרת נבנה מחדש
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path) if path else ":memory:", check_same_thread=False)
+        with self._lock:
+            if path:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+                for table in ("chunks", "postings", "pairs"):
+                    self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+                self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id INTEGER PRIMARY KEY,
+                    chunk_id TEXT NOT NULL UNIQUE,
+                    length INTEGER NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term, chunk)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pairs (
+                    pair TEXT NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    PRIMARY KEY (pair, chunk)
+                ) WITHOUT ROWID
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS pairs_chunk ON pairs (chunk)")
+            self._conn.commit()
+            self._count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+            self._total_length = total
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, chunk_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+        return row is not None
+
+    @property
+    def avg_length(self) -> float:
+        return self._total_length / self._count if self._count else 0.0
+
+    @classmethod
+    def is_current(cls, path: Path) -> bool:
+        if not path.exists():
+            return False
+        conn = sqlite3.connect(str(path))
+        try:
+            return conn.execute("PRAGMA user_version").fetchone()[0] == cls.SCHEMA_VERSION
+        finally:
+            conn.close()
+
+    def add(self, chunk_id: str, text: str) -> None:
+        # נכתב בטרנזקציה הפתוחה; save() מבצע commit
+        self.remove(chunk_id)
+        features = ChunkFeatures.from_text(text)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO chunks (chunk_id, length) VALUES (?, ?)", (chunk_id, features.length)
+            )
+            chunk = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO postings (term, chunk, tf) VALUES (?, ?, ?)",
+                [(term, chunk, tf) for term, tf in features.term_freqs.items()],
+            )
+            self._conn.executemany(
+                "INSERT INTO pairs (pair, chunk) VALUES (?, ?)", [(pair, chunk) for pair in features.pairs]
+            )
+            self._count += 1
+            self._total_length += features.length
+
+    def remove(self, chunk_id: str) -> None:
+        with self._lock:
+            row = self._conn.execute("SELECT id, length FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if row is None:
+                return
+            self._conn.execute("DELETE FROM postings WHERE chunk = ?", (row[0],))
+            self._conn.execute("DELETE FROM pairs WHERE chunk = ?", (row[0],))
+            self._conn.execute("DELETE FROM chunks WHERE id = ?", (row[0],))
+            self._count -= 1
+            self._total_length -= row[1]
+
+    def features_many(self, docs: List[Document], terms: Iterable[str], pairs: Iterable[str] = ()) -> List[ChunkFeatures]:
+        # כל המועמדים בבת אחת: האורך, ההופעות של מונחי השאלה והצמדים שלה – שתי שאילתות לכל הדירוג
+        terms, pairs = list(set(terms)), list(set(pairs))
+        chunk_ids = list({doc.metadata["chunk_id"] for doc in docs if doc.metadata.get("chunk_id")})
+        found: Dict[str, ChunkFeatures] = {}
+
+        if chunk_ids:
+            ids = ", ".join("?" * len(chunk_ids))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"""SELECT c.chunk_id, c.length, p.term, p.tf FROM chunks c
+                        LEFT JOIN postings p ON p.chunk = c.id AND p.term IN ({", ".join("?" * len(terms)) or "NULL"})
+                        WHERE c.chunk_id IN ({ids})""",
+                    terms + chunk_ids,
+                ).fetchall()
+                pair_rows = self._conn.execute(
+                    f"""SELECT c.chunk_id, p.pair FROM pairs p JOIN chunks c ON c.id = p.chunk
+                        WHERE p.pair IN ({", ".join("?" * len(pairs))}) AND c.chunk_id IN ({ids})""",
+                    pairs + chunk_ids,
+                ).fetchall() if pairs else []
+
+            for chunk_id, length, term, tf in rows:
+                features = found.get(chunk_id)
+                if features is None:
+                    features = found[chunk_id] = ChunkFeatures(Counter(), set(), length)
+                if term is not None:
+                    features.term_freqs[term] = tf
+            for chunk_id, pair in pair_rows:
+                found[chunk_id].pairs.add(pair)
+
+        # chunk מאינדקס ישן (בלי chunk_id) או שלא נכנס לאינדקס – מחשבים מהטקסט
+        return [found.get(doc.metadata.get("chunk_id")) or ChunkFeatures.from_text(doc.page_content) for doc in docs]
+
+    def idfs(self, terms: Iterable[str]) -> Dict[str, float]:
+        # פעם אחת לשאלה, לא לכל מסמך
+        terms = list(set(terms))
+        if not terms:
+            return {}
+        with self._lock:
+            counts = dict(self._conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({', '.join('?' * len(terms))}) GROUP BY term",
+                terms,
+            ).fetchall())
+        return {term: self._idf(counts.get(term, 0)) for term in terms}
+
+    def idf(self, term: str) -> float:
+        return self.idfs([term])[term]
+
+    def _idf(self, df: int) -> float:
+        n = self._count
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def _term_score(self, tf: int, length: int, avg_length: float) -> float:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+        return tf * (BM25_K1 + 1) / (tf + norm)
+
+    def bm25(self, features: ChunkFeatures, idfs: Dict[str, float]) -> float:
+        avg_length = self.avg_length or float(features.length or 1)
+
+        score = 0.0
+        for term, idf in idfs.items():
+            tf = features.term_freqs.get(term, 0)
+            if tf:
+                score += idf * self._term_score(tf, features.length, avg_length)
+        return score
+
+    def search(self, terms: Iterable[str], k: int = 20) -> List[Tuple[str, float]]:
+        avg_length = self.avg_length or 1.0
+        scores: Dict[int, float] = {}
+
+        with self._lock:
+            for term in set(terms):
+                postings = self._conn.execute(
+                    "SELECT p.chunk, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.chunk WHERE p.term = ?",
+                    (term,),
+                ).fetchall()
+                if not postings:
+                    continue
+                idf = self._idf(len(postings))
+                for chunk, tf, length in postings:
+                    scores[chunk] = scores.get(chunk, 0.0) + idf * self._term_score(tf, length, avg_length)
+
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            names = dict(self._conn.execute(
+                f"SELECT id, chunk_id FROM chunks WHERE id IN ({', '.join('?' * len(top))})",
+                [chunk for chunk, _ in top],
+            ).fetchall()) if top else {}
+        return [(names[chunk], score) for chunk, score in top]
+
+    def save(self, path: Optional[Path] = None) -> None:
+        with self._lock:
+            self._conn.commit()
+            if path is not None and path != self.path:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                target = sqlite3.connect(str(path))
+                try:
+                    self._conn.backup(target)
+                finally:
+                    target.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @classmethod
+    def load(cls, path: Path) -> "LexicalIndex":
+        # אינדקס שעוד לא נבנה (או נשמר בפורמט ישן) – אינדקס ריק בזיכרון, בלי לגעת בקובץ
+        return cls(path) if cls.is_current(path) else cls()
+
+    @classmethod
+    def create(cls, path: Path) -> "LexicalIndex":
+        # בנייה מלאה מתחילה מקובץ ריק
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return cls(path)
+
+
+class HeuristicQuery:
+    # הניקוד של הסריקה המקורית – מילה +2, מילה הפוכה +2, מילה ארוכה גם כשנשברה לשתיים +0.5, צמד +5,
+    # צמד הפוך +5 – כבדיקות בקבוצות של ה-chunk במקום חיפוש תת-מחרוזת. terms ו-pairs הם כל מה שצריך
+    # לטעון מהאינדקס
+    def __init__(self, words: List[str], bigrams: List[str]):
+        self.words = words
+        self.bigrams = bigrams
+        self.terms: Set[str] = set(words) | {REVERSED_MARK + word for word in words}
+        self.pairs: Set[str] = (
+            {word for word in words if len(word) > 3} | set(bigrams) | {REVERSED_MARK + bigram for bigram in bigrams}
+        )
+
+    def score(self, features: ChunkFeatures) -> float:
+        terms, pairs = features.term_freqs, features.pairs
+        score = 0.0
+
+        for word in self.words:
+            if word in terms:
+                score += 2.0
+            if REVERSED_MARK + word in terms:
+                score += 2.0
+            if len(word) > 3 and (word in terms or word in pairs):
+                score += 0.5
+
+        for bigram in self.bigrams:
+            if bigram in pairs:
+                score += 5.0
+            if REVERSED_MARK + bigram in pairs:
+                score += 5.0
+
+        return score
+
+
+def heuristic_score(features: ChunkFeatures, words: List[str], bigrams: List[str]) -> float:
+    return HeuristicQuery(words, bigrams).score(features)
@@ -0,0 +1,287 @@
+import json
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # לכל צירוף labels: מונים לכל bucket (לא מצטברים), סכום וספירה
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_duration_seconds", "Time spent in each answer stage, excluding nested stages.", ["stage"]
+)
+# path מפריד בין /chat לבין /chat/batch – בקשת batch אחת נמשכת כמו הרבה שאלות, ובלי הפרדה מעוותת את ההיסטוגרמה
+REQUESTS = REGISTRY.counter(
+    "rag_requests_total", "Chat requests by endpoint, model type and status.", ["path", "model_type", "status"]
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_request_duration_seconds", "End-to-end chat request time by endpoint.", ["path", "model_type"]
+)
+FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    "rag_first_token_seconds", "Time from request start to the first streamed answer text.", ["model_type"]
+)
+TOKENS = REGISTRY.counter(
+    "rag_tokens_total",
+    "Prompt words, packed and dropped context tokens, and generated stream tokens by model type.",
+    ["model_type", "kind"],
+)
+CACHE_HIT_RATIO = REGISTRY.gauge("rag_cache_hit_ratio", "Hit ratio of the service caches.", ["cache"])
+CACHE_LOOKUPS = REGISTRY.gauge("rag_cache_lookups", "Cache lookups since startup.", ["cache", "result"])
+CACHE_ENTRIES = REGISTRY.gauge("rag_cache_entries", "Entries currently held in each cache.", ["cache"])
+GENERATION_ACTIVE = REGISTRY.gauge("rag_generation_active", "Generations currently running per backend.", ["backend"])
+GENERATION_QUEUE_DEPTH = REGISTRY.gauge(
+    "rag_generation_queue_depth", "Requests waiting for a generation slot per backend.", ["backend"]
+)
+GENERATION_QUEUE_SECONDS = REGISTRY.histogram(
+    "rag_generation_queue_seconds", "Time admitted requests waited for a generation slot.", ["backend"]
+)
+GENERATION_REJECTED = REGISTRY.counter(
+    "rag_generation_rejected_total", "Requests rejected by admission control, by reason.", ["backend", "reason"]
+)
+
+
+class RequestTrace:
+    # מה שנאסף על בקשה אחת: זמן לכל שלב, מונים (טוקנים, cache) ושדות חופשיים ללוג
+    def __init__(self, **fields):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.fields: Dict[str, object] = dict(fields)
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self._stack: List[list] = []
+
+    def add(self, name: str, amount: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def to_dict(self) -> Dict:
+        return {
+            "request_id": self.request_id,
+            **self.fields,
+            "total_ms": round(self.elapsed() * 1000, 1),
+            "stages_ms": {stage: round(s * 1000, 2) for stage, s in self.stages.items()},
+            **self.counts,
+        }
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("rag_request_trace", default=None)
+_fallback = threading.local()
+
+
+def start_trace(**fields) -> RequestTrace:
+    trace = RequestTrace(**fields)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(stage: str):
+    # שלב מקונן (embed בתוך vector_search) מנוכה מהשלב העוטף, כך שסכום השלבים ≈ זמן הבקשה.
+    # בלי trace (למשל קריאה ישירה ל-answer מסקריפט) הזמנים נרשמים רק להיסטוגרמה
+    trace = _current_trace.get()
+    if trace is not None:
+        stack = trace._stack
+    else:
+        stack = getattr(_fallback, "stack", None)
+        if stack is None:
+            stack = _fallback.stack = []
+
+    frame = [time.perf_counter(), 0.0]
+    stack.append(frame)
+    try:
+        yield
+    finally:
+        stack.pop()
+        elapsed = time.perf_counter() - frame[0]
+        if stack:
+            stack[-1][1] += elapsed
+        own = elapsed - frame[1]
+        if trace is not None:
+            trace.record(stage, own)
+        else:
+            STAGE_SECONDS.observe(own, stage=stage)
+
+
+def record_stage(stage: str, seconds: float, trace: Optional[RequestTrace] = None) -> None:
+    # לשלבים שחוצים await או yield, שבהם span על מחסנית משותפת לא בטוח
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        trace.record(stage, seconds)
+    else:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def count(name: str, amount: int = 1, trace: Optional[RequestTrace] = None) -> None:
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        trace.add(name, amount)
+
+
+def update_cache_metrics(stats: Dict) -> None:
+    for cache in ("retrieval", "answer", "embedding"):
+        cache_stats = stats.get(cache)
+        if not cache_stats:
+            continue
+        CACHE_HIT_RATIO.set(cache_stats["hit_rate"], cache=cache)
+        CACHE_LOOKUPS.set(cache_stats["hits"], cache=cache, result="hit")
+        CACHE_LOOKUPS.set(cache_stats["misses"], cache=cache, result="miss")
+        entries = cache_stats.get("size", cache_stats.get("memory_entries", 0))
+        CACHE_ENTRIES.set(entries, cache=cache)
+
+
+def log_trace(trace: RequestTrace) -> None:
+    print(json.dumps(trace.to_dict(), ensure_ascii=False), flush=True)
@@ -1,9 +1,41 @@
+import asyncio
+import math
 from abc import ABC, abstractmethod
-from typing import Iterable, List, Dict
+from typing import AsyncIterator, Iterable, List, Dict
 
 Message = Dict[str, str]
 
+# המודלים מחזירים שגיאות תקשורת כטקסט שמתחיל בקידומת הזו (ולא כחריגה)
+ERROR_PREFIX = "שגיאה"
+
+
+def estimate_tokens(text: str) -> int:
+    # הערכה שמרנית בלי tokenizer: ~4 בתים לטוקן (אות עברית = 2 בתים ב-UTF-8)
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
 class ChatModel(ABC):
+    context_window: int = 4096
+    max_output_tokens: int = 512
+
+    def count_tokens(self, text: str) -> int:
+        return estimate_tokens(text)
+
+    def warmup(self, prefix: List[Message]) -> None:
+        # מודלים שיודעים לטעון את עצמם מראש ולשמור את עיבוד התחילית הקבועה (system prompt) דורסים
+        pass
+
+    async def reserve(self) -> None:
+        # נקרא רגע לפני יצירה שבאמת תרוץ (לא בתשובה מה-cache או מהקטלוג); מודל עם בקרת כניסה דורס
+        pass
+
+    def cancel_reservation(self) -> None:
+        # שחרור מקום שנתפס ב-reserve ולא נוצל (למשל הלקוח התנתק לפני שה-stream התחיל)
+        pass
+
+    def close(self) -> None:
+        # שחרור לקוחות שהמודל מחזיק לעצמו; לקוחות משותפים (http_pool) נסגרים בכיבוי השרת
+        pass
+
     @abstractmethod
     def generate(self, messages: List[Message]) -> str:
         raise NotImplementedError
@@ -11,3 +43,11 @@ class ChatModel(ABC):
     def stream(self, messages: List[Message]) -> Iterable[str]:
         full = self.generate(messages)
         yield full
+
+    async def agenerate(self, messages: List[Message]) -> str:
+        # ברירת מחדל למודלים בלי לקוח אסינכרוני – מריצים את הגרסה הסינכרונית ב-thread
+        return await asyncio.to_thread(self.generate, messages)
+
+    async def astream(self, messages: List[Message]) -> AsyncIterator[str]:
+        full = await self.agenerate(messages)
+        yield full
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Sequence, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+
+_lock = threading.Lock()
+_sessions: Dict[Tuple[str, int], requests.Session] = {}
+# httpx.AsyncClient קשור ל-event loop שבו נפתח – לכן client נפרד לכל loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, int], httpx.AsyncClient]]" = (
+    weakref.WeakKeyDictionary()
+)
+_balancers: Dict[Tuple[str, ...], "LeastOutstandingBalancer"] = {}
+
+
+def session(base_url: str, pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    # Session משותף לכל המודלים מול אותה כתובת, כך שחיבורי keep-alive נשמרים בין שאלות
+    key = (base_url, pool_size)
+    with _lock:
+        sess = _sessions.get(key)
+        if sess is None:
+            sess = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+            sess.mount(base_url + "/", adapter)
+            _sessions[key] = sess
+        return sess
+
+
+def async_client(base_url: str, pool_size: int = DEFAULT_POOL_SIZE) -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    key = (base_url, pool_size)
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None or client.is_closed:
+            limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            client = httpx.AsyncClient(base_url=base_url, limits=limits)
+            clients[key] = client
+        return client
+
+
+async def aclose_async_clients() -> None:
+    with _lock:
+        clients = list(_async_clients.pop(asyncio.get_running_loop(), {}).values())
+    for client in clients:
+        await client.aclose()
+
+
+def close_sessions() -> None:
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for sess in sessions:
+        sess.close()
+
+
+class LeastOutstandingBalancer:
+    # כל בקשה הולכת לשרת עם הכי מעט בקשות פתוחות (כולל streams שעדיין רצים);
+    # בשוויון – סבב, כדי שהעומס יתחלק גם כשהשרתים פנויים
+    def __init__(self, urls: Sequence[str]):
+        self.urls = [url.rstrip("/") for url in urls]
+        if not self.urls:
+            raise ValueError("At least one base URL is required")
+        self._outstanding: Dict[str, int] = {url: 0 for url in self.urls}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def outstanding(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._outstanding)
+
+    @contextmanager
+    def acquire(self, avoid: Iterable[str] = ()) -> Iterator[str]:
+        with self._lock:
+            avoid = set(avoid)
+            candidates = [url for url in self.urls if url not in avoid] or self.urls
+            start = self._next % len(candidates)
+            self._next += 1
+            rotated = candidates[start:] + candidates[:start]
+            url = min(rotated, key=self._outstanding.__getitem__)
+            self._outstanding[url] += 1
+        try:
+            yield url
+        finally:
+            with self._lock:
+                self._outstanding[url] -= 1
+
+
+def balancer(urls: Sequence[str]) -> LeastOutstandingBalancer:
+    # אותו balancer לכל המודלים (llama3, mistral...) שרצים על אותם שרתים
+    key = tuple(url.rstrip("/") for url in urls)
+    with _lock:
+        lb = _balancers.get(key)
+        if lb is None:
+            lb = _balancers[key] = LeastOutstandingBalancer(key)
+        return lb
@@ -1,55 +1,181 @@
+import asyncio
 import json
+import time
+import httpx
 import requests
-from typing import Iterable, List
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterable, Iterator, List, Sequence, Union
+from . import http_pool
 from .base import ChatModel, Message
 
 class OllamaChatModel(ChatModel):
-    def __init__(self, model_name: str = "llama3", base_url: str = "http://localhost:11434"):
+    def __init__(
+        self,
+        model_name: str = "llama3",
+        base_url: Union[str, Sequence[str]] = "http://localhost:11434",
+        pool_size: int = http_pool.DEFAULT_POOL_SIZE,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 45.0,
+        retries: int = 2,
+        backoff: float = 0.5,
+        context_window: int = 2048,
+        max_output_tokens: int = 512,
+        keep_alive: Union[str, int] = "30m",
+    ):
         self.model_name = model_name
-        self.base_url = base_url.rstrip("/")
+        self.context_window = context_window
+        self.max_output_tokens = max_output_tokens
+        # המודל נשאר טעון בין בקשות, ואותן options בדיוק בכל בקשה – שינוי (למשל num_ctx)
+        # גורם ל-Ollama לטעון מחדש ולאבד את ה-KV cache של התחילית
+        self.keep_alive = keep_alive
+        self._options = {
+            "temperature": 0.1,
+            "num_ctx": context_window,
+            "num_predict": max_output_tokens,
+        }
+        urls = [base_url] if isinstance(base_url, str) else list(base_url)
+        self.balancer = http_pool.balancer(urls)
+        self.base_url = self.balancer.urls[0]
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
 
-    def generate(self, messages: List[Message]) -> str:
-        url = f"{self.base_url}/api/chat"
-        payload = {
+    def _payload(self, messages: List[Message], stream: bool) -> dict:
+        return {
             "model": self.model_name,
             "messages": messages,
-            "stream": False,
-            "options": {
-                "temperature": 0.1,
-                "num_ctx": 2048,
-                "num_predict": 512
-            }
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": self._options,
         }
+
+    def warmup(self, prefix: List[Message]) -> None:
+        # טוען את המודל בכל שרת ומעבד את התחילית פעם אחת; בלי ניסיונות חוזרים – שרת כבוי פשוט מדולג
+        payload = self._payload(prefix, stream=False)
+        payload["options"] = {**self._options, "num_predict": 1}
+        for base_url in self.balancer.urls:
+            try:
+                resp = self._session(base_url).post(
+                    f"{base_url}/api/chat", json=payload, timeout=(self.connect_timeout, self.read_timeout)
+                )
+                resp.raise_for_status()
+            except requests.RequestException as e:
+                print(f"Ollama warmup skipped for {base_url}: {e}")
+
+    def _session(self, base_url: str) -> requests.Session:
+        return http_pool.session(base_url, self.pool_size)
+
+    def _async_client(self, base_url: str) -> httpx.AsyncClient:
+        return http_pool.async_client(base_url, self.pool_size)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        return self.backoff * (2 ** attempt)
+
+    @staticmethod
+    def _parse_line(line) -> str:
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return ""
+        return data.get("message", {}).get("content", "")
+
+    @contextmanager
+    def _chat(self, payload: dict, stream: bool) -> Iterator[requests.Response]:
+        # ניסיון חוזר רק על כשל בחיבור (השרת לא קיבל את הבקשה), ועדיף לשרת אחר;
+        # timeout בקריאה או שגיאת HTTP עולים מיד – המודל כבר עבד עליהם
+        failed = set()
+        attempt = 0
+        while True:
+            with self.balancer.acquire(avoid=failed) as base_url:
+                try:
+                    resp = self._session(base_url).post(
+                        f"{base_url}/api/chat",
+                        json=payload,
+                        stream=stream,
+                        timeout=(self.connect_timeout, self.read_timeout),
+                    )
+                except requests.ConnectionError:
+                    if attempt >= self.retries:
+                        raise
+                    failed.add(base_url)
+                    resp = None
+
+                if resp is not None:
+                    with resp:
+                        resp.raise_for_status()
+                        yield resp
+                    return
+
+            time.sleep(self._backoff_delay(attempt))
+            attempt += 1
+
+    @asynccontextmanager
+    async def _achat(self, payload: dict) -> AsyncIterator[httpx.Response]:
+        failed = set()
+        attempt = 0
+        timeout = httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        while True:
+            with self.balancer.acquire(avoid=failed) as base_url:
+                client = self._async_client(base_url)
+                request = client.build_request("POST", f"{base_url}/api/chat", json=payload, timeout=timeout)
+                try:
+                    resp = await client.send(request, stream=True)
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    if attempt >= self.retries:
+                        raise
+                    failed.add(base_url)
+                    resp = None
+
+                if resp is not None:
+                    try:
+                        resp.raise_for_status()
+                        yield resp
+                    finally:
+                        await resp.aclose()
+                    return
+
+            await asyncio.sleep(self._backoff_delay(attempt))
+            attempt += 1
+
+    def generate(self, messages: List[Message]) -> str:
+        payload = self._payload(messages, stream=False)
         try:
-            resp = requests.post(url, json=payload, timeout=45)
-            resp.raise_for_status()
-            return resp.json().get("message", {}).get("content", "")
+            with self._chat(payload, stream=False) as resp:
+                return resp.json().get("message", {}).get("content", "")
         except requests.RequestException as e:
             return f"שגיאה בתקשורת עם המודל: {str(e)}"
 
     def stream(self, messages: List[Message]) -> Iterable[str]:
-        url = f"{self.base_url}/api/chat"
-        payload = {
-            "model": self.model_name,
-            "messages": messages,
-            "stream": True,
-            "options": {
-                "temperature": 0.1,
-                "num_ctx": 2048,
-                "num_predict": 512
-            }
-        }
+        payload = self._payload(messages, stream=True)
         try:
-            with requests.post(url, json=payload, stream=True, timeout=45) as resp:
-                resp.raise_for_status()
+            with self._chat(payload, stream=True) as resp:
                 for line in resp.iter_lines():
                     if line:
-                        try:
-                            data = json.loads(line)
-                            content = data.get("message", {}).get("content", "")
-                            if content:
-                                yield content
-                        except ValueError:
-                            pass
+                        content = self._parse_line(line)
+                        if content:
+                            yield content
         except requests.RequestException:
             yield "שגיאה: לא ניתן להתחבר למודל המקומי."
+
+    async def agenerate(self, messages: List[Message]) -> str:
+        payload = self._payload(messages, stream=False)
+        try:
+            async with self._achat(payload) as resp:
+                await resp.aread()
+                return resp.json().get("message", {}).get("content", "")
+        except httpx.HTTPError as e:
+            return f"שגיאה בתקשורת עם המודל: {str(e)}"
+
+    async def astream(self, messages: List[Message]) -> AsyncIterator[str]:
+        payload = self._payload(messages, stream=True)
+        try:
+            async with self._achat(payload) as resp:
+                async for line in resp.aiter_lines():
+                    if line:
+                        content = self._parse_line(line)
+                        if content:
+                            yield content
+        except httpx.HTTPError:
+            yield "שגיאה: לא ניתן להתחבר למודל המקומי."
@@ -1,11 +1,21 @@
+import asyncio
 import os
-from typing import Iterable, List
-from openai import OpenAI
+from typing import AsyncIterator, Iterable, List
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
-from .base import ChatModel, Message
+from .base import ChatModel, Message, estimate_tokens
 
 load_dotenv()
 
+# חלונות הקשר לפי קידומת שם המודל; מודל לא מוכר מקבל את ברירת המחדל של ChatModel
+CONTEXT_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+}
+
 class OpenAIChatModel(ChatModel):
     def __init__(self, model_name: str = "gpt-4o"):
         api_key = os.getenv("API_GPT") or os.getenv("OPENAI_API_KEY")
@@ -13,7 +23,33 @@ class OpenAIChatModel(ChatModel):
             raise RuntimeError("Missing API key. Set API_GPT in your .env file.")
 
         self.client = OpenAI(api_key=api_key)
+        self.async_client = AsyncOpenAI(api_key=api_key)
         self.model_name = model_name
+        for prefix, window in CONTEXT_WINDOWS.items():
+            if model_name.startswith(prefix):
+                self.context_window = window
+                break
+        self._encoding = None
+
+    def count_tokens(self, text: str) -> int:
+        # tiktoken הוא תלות אופציונלית; בלעדיו – אותה הערכה כמו לשאר המודלים
+        if self._encoding is None:
+            try:
+                import tiktoken
+                self._encoding = tiktoken.encoding_for_model(self.model_name)
+            except (ImportError, KeyError):
+                self._encoding = False
+        if self._encoding is False:
+            return estimate_tokens(text)
+        return len(self._encoding.encode(text))
+
+    def close(self) -> None:
+        # לכל מודל OpenAI לקוחות משלו; הסגירה האסינכרונית רצה ב-loop הנוכחי אם יש כזה
+        self.client.close()
+        try:
+            asyncio.get_running_loop().create_task(self.async_client.close())
+        except RuntimeError:
+            asyncio.run(self.async_client.close())
 
     def generate(self, messages: List[Message]) -> str:
         try:
@@ -21,7 +57,7 @@ class OpenAIChatModel(ChatModel):
                 model=self.model_name,
                 messages=messages,
                 temperature=0.1,
-                max_tokens=512
+                max_tokens=self.max_output_tokens
             )
             return resp.choices[0].message.content or ""
         except Exception as e:
@@ -34,7 +70,7 @@ class OpenAIChatModel(ChatModel):
                 messages=messages,
                 stream=True,
                 temperature=0.1,
-                max_tokens=512
+                max_tokens=self.max_output_tokens
             )
             for chunk in stream:
                 delta = chunk.choices[0].delta
@@ -42,3 +78,31 @@ class OpenAIChatModel(ChatModel):
                     yield delta.content
         except Exception as e:
             yield f"שגיאה בתקשורת עם OpenAI: {str(e)}"
+
+    async def agenerate(self, messages: List[Message]) -> str:
+        try:
+            resp = await self.async_client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                temperature=0.1,
+                max_tokens=self.max_output_tokens
+            )
+            return resp.choices[0].message.content or ""
+        except Exception as e:
+            return f"שגיאה בתקשורת עם OpenAI: {str(e)}"
+
+    async def astream(self, messages: List[Message]) -> AsyncIterator[str]:
+        try:
+            stream = await self.async_client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                stream=True,
+                temperature=0.1,
+                max_tokens=self.max_output_tokens
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    yield delta.content
+        except Exception as e:
+            yield f"שגיאה בתקשורת עם OpenAI: {str(e)}"
@@ -0,0 +1,81 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+from .base import ChatModel
+
+ModelFactory = Callable[[str], ChatModel]
+
+
+# כמה מודלים בשם שאינו ברירת המחדל נשמרים; model_name מגיע מהלקוח, אז בלי תקרה כל שם חדש נשאר לתמיד
+DEFAULT_MAX_INSTANCES = 8
+
+
+class ModelRegistry:
+    def __init__(self, max_instances: int = DEFAULT_MAX_INSTANCES):
+        self._factories: Dict[str, Tuple[ModelFactory, str]] = {}
+        self._instances: "OrderedDict[Tuple[str, str], ChatModel]" = OrderedDict()
+        self.max_instances = max_instances
+        self._lock = threading.Lock()
+
+    def register(self, model_type: str, factory: ModelFactory, default_name: str) -> None:
+        self._factories[model_type] = (factory, default_name)
+
+    def model_types(self):
+        return list(self._factories)
+
+    def get(self, model_type: str, model_name: Optional[str] = None) -> ChatModel:
+        if model_type not in self._factories:
+            raise KeyError(f"Unknown model type: {model_type}")
+
+        factory, default_name = self._factories[model_type]
+        key = (model_type, model_name or default_name)
+
+        with self._lock:
+            model = self._instances.get(key)
+            if model is None:
+                # מודל שנכשל ביצירה (למשל חסר מפתח API) לא נשמר, כדי שינסו שוב בבקשה הבאה
+                model = factory(key[1])
+                self._instances[key] = model
+            self._instances.move_to_end(key)
+            evicted = self._evict()
+
+        for old in evicted:
+            old.close()
+        return model
+
+    def _is_default(self, key: Tuple[str, str]) -> bool:
+        return key[1] == self._factories[key[0]][1]
+
+    def _evict(self):
+        # מודלי ברירת המחדל לא נזרקים; מהשאר יוצא זה שלא נוצל הכי הרבה זמן
+        named = [key for key in self._instances if not self._is_default(key)]
+        evicted = []
+        for key in named[:max(0, len(named) - self.max_instances)]:
+            evicted.append(self._instances.pop(key))
+        return evicted
+
+
+def default_registry() -> ModelRegistry:
+    from .ollama_model import OllamaChatModel
+    from .openai_model import OpenAIChatModel
+
+    # OLLAMA_BASE_URLS="http://host1:11434,http://host2:11434" – מפזר את הבקשות בין כמה שרתי Ollama
+    ollama_urls = [u.strip() for u in os.getenv("OLLAMA_BASE_URLS", "http://localhost:11434").split(",") if u.strip()]
+    # חלון ההקשר (num_ctx) שנשלח ל-Ollama – וגם התקציב שלפיו נארזים המסמכים
+    ollama_num_ctx = int(os.getenv("OLLAMA_NUM_CTX", "2048"))
+    # משך השארת המודל בזיכרון: "30m", או מספר שניות (-1 = לתמיד)
+    ollama_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+    if ollama_keep_alive.lstrip("-").isdigit():
+        ollama_keep_alive = int(ollama_keep_alive)
+
+    registry = ModelRegistry(max_instances=int(os.getenv("MODEL_CACHE_SIZE", str(DEFAULT_MAX_INSTANCES))))
+    registry.register(
+        "ollama",
+        lambda name: OllamaChatModel(
+            model_name=name, base_url=ollama_urls, context_window=ollama_num_ctx, keep_alive=ollama_keep_alive
+        ),
+        "llama3",
+    )
+    registry.register("openai", lambda name: OpenAIChatModel(model_name=name), "gpt-4o-mini")
+    return registry
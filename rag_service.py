@@ -1,30 +1,262 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Iterable, Tuple
+from typing import AsyncIterator, Callable, List, Dict, Iterable, Optional, Tuple
+import chromadb
 from langchain_community.vectorstores import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
-from models.base import ChatModel, Message
-
+from embedding_cache import EMBEDDING_CONFIG_KEY, EMBEDDING_MODEL_NAME, ENCODE_KWARGS, CachedEmbeddings
+from cache import INDEX_VERSION_FILENAME, TTLCache, normalize_text, read_index_version
+from lexical_index import REVERSED_MARK, HeuristicQuery, LexicalIndex, query_terms
+from context_packer import pack_context
+from catalog import CATALOG_FILENAME, Catalog, format_answer, is_catalog_question, parse_question
+from file_registry import FileRegistry, load_file_registry
+from metrics import count, current_trace, record_stage, span
+from models.base import ERROR_PREFIX, ChatModel, Message, estimate_tokens
+from vector_index import CHROMA_COLLECTION, ChromaVectorIndex, chroma_collection, open_local_index, vector_backend_from_env
+
+DOCS_DIR = Path("scraper/data")
 VECTOR_DB_DIR = Path("vectorstore")
+MANIFEST_PATH = VECTOR_DB_DIR / "manifest.json"
+LEXICAL_INDEX_PATH = VECTOR_DB_DIR / LexicalIndex.FILENAME
+INDEX_VERSION_PATH = VECTOR_DB_DIR / INDEX_VERSION_FILENAME
+CATALOG_PATH = VECTOR_DB_DIR / CATALOG_FILENAME
+
+# כל השאלות ה"כלליות" ממופות לאותה שאילתה, ולכן חולקות רשומת cache אחת
+GENERAL_BUCKET = "__general__"
+INDEX_VERSION_CHECK_SECONDS = 5.0
+
+RRF_K = 60
+
+SYSTEM_PROMPT = (
+    "אתה עורך דין מומחה בישראל.\n\n"
+    "חוקים בלתי משתנים - הפרה של כל אחד מהם היא שגיאה קריטית:\n"
+    "1. **אסור לכתוב אף מילה באנגלית!**\n"
+    "2. **אסור לכתוב משפטי הקדמה באנגלית!**\n"
+    "3. **אסור לחזור על התשובה!**\n"
+    "4. **אסור לכלול את השאלה בתשובה!**\n"
+    "5. התבסס רק על המסמכים.\n"
+    "6. חובה לציין מקורות.\n"
+    "7. אם אין מידע – אמור זאת.\n"
+    "8. התמודד עם טקסט הפוך/משובש.\n"
+    "9. כתוב עברית מקצועית.\n"
+    "10. ענה ישירות בעברית בלבד.\n"
+)
+
+# כשלא נשלפו מסמכים ההנחיה עוברת בהודעת המשתמש, כדי שה-system prompt (והתחילית שכבר עובדה) יישאר זהה
+NO_SOURCES_INSTRUCTION = (
+    "לא נמצאו מסמכים רלוונטיים לשאלה זו.\n"
+    "כללים 5 ו-6 לא חלים כאן: אין מסמכים ואין מקורות לציין. "
+    "אמור שלא נמצאו מסמכים במאגר וענה בעברית בלבד ולא באנגלית.\n"
+)
+
+# תוספת לכל הודעה בפורמט ה-chat (role, מפרידים) ומרווח ביטחון לשגיאת ההערכה של הטוקנים
+MESSAGE_OVERHEAD_TOKENS = 4
+CONTEXT_SAFETY_TOKENS = 64
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class AnswerCleaner:
+    # גרסה אינקרמנטלית של _clean_answer: מחזיקה רק את המשפט הנוכחי בבאפר,
+    # ומוציאה כל משפט שלם ברגע שהסתיים (אחרי הסרת הקדמות וכפילויות)
+    ENGLISH_PREFIXES = [
+        "i'll answer", "i will answer", "i'll answer your question",
+        "i will answer your question", "let me answer", "here's the answer",
+        "the answer is", "answer:", "question:", "תשובה:", "שאלה:",
+    ]
+
+    BAD_PHRASES = [
+        "i'll answer", "i will answer", "directly in hebrew",
+        "without writing in english", "repeating the question",
+    ]
+
+    # מספיק תווים כדי להכריע אם התשובה פותחת באחת ההקדמות (כולל ":" שאחריה)
+    PREFIX_WINDOW = max(len(p) for p in ENGLISH_PREFIXES) + 2
+
+    def __init__(self):
+        self._buffer = ""
+        self._prefix_done = False
+        self._seen = set()
+        self._emitted = False
+
+    def _strip_prefix(self) -> None:
+        text = self._buffer.lstrip()
+        for prefix in self.ENGLISH_PREFIXES:
+            if text.lower().startswith(prefix):
+                text = text[len(prefix):].lstrip()
+                if text.startswith(":"):
+                    text = text[1:].lstrip()
+                break
+        self._buffer = text
+        self._prefix_done = True
+
+    def _accept(self, sentence: str) -> str:
+        sent_clean = sentence.strip()
+        if not sent_clean:
+            return ""
+
+        sent_lower = sent_clean.lower()
+        if any(bad in sent_lower for bad in self.BAD_PHRASES):
+            return ""
+        if sent_lower in self._seen:
+            return ""
+
+        self._seen.add(sent_lower)
+        if self._emitted:
+            return ". " + sent_clean
+        self._emitted = True
+        return sent_clean
+
+    def feed(self, token: str) -> str:
+        self._buffer += token
+        if not self._prefix_done:
+            if len(self._buffer.lstrip()) < self.PREFIX_WINDOW:
+                return ""
+            self._strip_prefix()
+
+        out = []
+        while "." in self._buffer:
+            sentence, _, self._buffer = self._buffer.partition(".")
+            out.append(self._accept(sentence))
+        return "".join(out)
+
+    def finish(self) -> str:
+        if not self._prefix_done:
+            self._strip_prefix()
+
+        out = []
+        for sentence in self._buffer.split("."):
+            out.append(self._accept(sentence))
+        self._buffer = ""
+
+        if self._emitted:
+            out.append(".")
+        return "".join(out)
 
 
 class LegalRAGService:
-    def __init__(self, chat_model: ChatModel, top_k: int = 100):
+    def __init__(
+        self,
+        chat_model: Optional[ChatModel] = None,
+        top_k: int = 20,
+        retrieval_workers: int = 4,
+        scoring: str = "heuristic",
+        hybrid: bool = True,
+        cache_size: int = 256,
+        cache_ttl: float = 600.0,
+        embedding_cache_dir: Optional[Path] = None,
+        chunks_per_verdict: int = 3,
+        max_context_tokens: int = 8000,
+        file_registry: Optional[FileRegistry] = None,
+        vector_backend: Optional[str] = None,
+    ):
+        if scoring not in ("heuristic", "bm25"):
+            raise ValueError(f"Unknown scoring mode: {scoring}")
+
         if not VECTOR_DB_DIR.exists():
             raise FileNotFoundError(f"Vector DB not found at {VECTOR_DB_DIR}")
 
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+        self.embeddings = CachedEmbeddings(
+            HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME, encode_kwargs=ENCODE_KWARGS),
+            disk_dir=embedding_cache_dir,
+            model_name=EMBEDDING_CONFIG_KEY,
         )
 
-        vectordb = Chroma(
-            embedding_function=embeddings,
-            persist_directory=str(VECTOR_DB_DIR),
-            collection_name="verdicts",
+        # "chroma" (ברירת המחדל), "numpy" (חיפוש מדויק בזיכרון) או "hnsw" (מקורב); VECTOR_BACKEND בסביבה
+        self.vector_backend = vector_backend or vector_backend_from_env()
+        if self.vector_backend == "chroma":
+            client = chromadb.PersistentClient(path=str(VECTOR_DB_DIR))
+            store = Chroma(client=client, embedding_function=self.embeddings, collection_name=CHROMA_COLLECTION)
+            self.vector_index = ChromaVectorIndex(store, chroma_collection(client), top_k)
+        else:
+            self.vector_index = open_local_index(self.vector_backend, VECTOR_DB_DIR, self.embeddings, top_k)
+
+        self.lexicon = LexicalIndex.load(LEXICAL_INDEX_PATH)
+        self.catalog = Catalog.load(CATALOG_PATH)
+        self.files = file_registry or load_file_registry(MANIFEST_PATH, DOCS_DIR)
+        self.scoring = scoring
+        self.hybrid = hybrid
+        self.top_k = top_k
+        self.chunks_per_verdict = chunks_per_verdict
+        self.max_context_tokens = max_context_tokens
+
+        self.retrieval_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.answer_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._index_version = read_index_version(INDEX_VERSION_PATH)
+        self._version_checked_at = time.monotonic()
+        self._version_lock = threading.Lock()
+        self.chat_model = chat_model
+        self.ready = False
+        # embedding + חיפוש באינדקס הווקטורי הם CPU-bound וחוסמים – רצים ב-pool חסום ולא על ה-event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=retrieval_workers, thread_name_prefix="rag-retrieval"
         )
 
-        self.retriever = vectordb.as_retriever(search_kwargs={"k": top_k})
-        self.chat_model = chat_model
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def warmup(self) -> None:
+        # טעינת מודל ה-embedding ופתיחת האוסף מראש, כדי שהבקשה הראשונה לא תשלם על זה
+        self.embeddings.embed_query("פסק דין")
+        self.vector_index.warmup()
+        self.ready = True
+
+    def _current_index_version(self) -> str:
+        # build_index.py כותב גרסה חדשה בכל בנייה; כשהיא משתנה – טוענים מחדש ומרוקנים את ה-cache
+        now = time.monotonic()
+        if now - self._version_checked_at < INDEX_VERSION_CHECK_SECONDS:
+            return self._index_version
+
+        with self._version_lock:
+            self._version_checked_at = now
+            version = read_index_version(INDEX_VERSION_PATH)
+            if version != self._index_version:
+                self.lexicon = LexicalIndex.load(LEXICAL_INDEX_PATH)
+                self.catalog = Catalog.load(CATALOG_PATH)
+                self.vector_index.reload()
+                self.files.reload()
+                self.retrieval_cache.clear()
+                self.answer_cache.clear()
+                self._index_version = version
+        return self._index_version
+
+    def cache_stats(self) -> Dict:
+        return {
+            "index_version": self._index_version,
+            "retrieval": self.retrieval_cache.stats(),
+            "answer": self.answer_cache.stats(),
+            "embedding": self.embeddings.stats(),
+        }
+
+    def _answer_key(self, question: str, model: ChatModel) -> Tuple[str, str, str]:
+        digest = hashlib.sha256(normalize_text(question).encode("utf-8")).hexdigest()
+        # מודל עטוף (למשל ע"י ה-scheduler) חולק את ה-cache עם המודל המקורי
+        model = getattr(model, "wrapped", model)
+        model_key = f"{type(model).__name__}:{getattr(model, 'model_name', '')}"
+        return digest, model_key, self._current_index_version()
+
+    def _remember_answer(self, key: Tuple[str, str, str], answer: str, citations: List[Dict]) -> None:
+        if answer and not answer.startswith(ERROR_PREFIX):
+            self.answer_cache.set(key, (answer, citations))
+
+    def _resolve_model(self, chat_model: Optional[ChatModel]) -> ChatModel:
+        model = chat_model or self.chat_model
+        if model is None:
+            raise ValueError("No chat model configured for this request")
+        return model
 
     def _is_general_question(self, question: str) -> bool:
         general_keywords = [
@@ -35,66 +267,75 @@ class LegalRAGService:
         q_lower = question.lower()
         return any(keyword in q_lower for keyword in general_keywords)
 
+    def _catalog_answer(self, question: str) -> Optional[Tuple[str, List[Dict]]]:
+        # שאלות על המאגר עצמו (רשימה, האחרון, כמה) נענות מהקטלוג שנבנה באינדוקס – בלי חיפוש ובלי LLM.
+        # שאלה עם מספר תיק, עם מילים שהקטלוג לא מכיר, או שהסינון שלה לא מוצא כלום – עוברת ל-RAG
+        if not is_catalog_question(question):
+            return None
+        self._current_index_version()
+        catalog = self.catalog
+        if not len(catalog):
+            return None
+
+        with span("catalog"):
+            query = parse_question(question, catalog)
+            if query.unmatched:
+                return None
+            total, entries = catalog.query(query.terms, query.year, query.newest_first, query.offset, query.limit)
+            if not total:
+                return None
+            if query.count_only:
+                entries = []
+            answer = format_answer(query, total, entries)
+            citations = [
+                self._citation(f"[{idx}]", entry["display_name"], entry["source_path"], entry)
+                for idx, entry in enumerate(entries, start=1)
+            ]
+        count("catalog_answers")
+        return answer, citations
+
     def retrieve(self, question: str) -> List[Document]:
         is_general = self._is_general_question(question)
 
-        if is_general:
-            query = "פסק דין"
-        else:
-            query = question
+        docs = self._candidates(question, is_general)
+        with span("rerank"):
+            return self._rerank(question, docs)
 
-        docs = self.retriever.invoke(query)
-        unique = {}
+    def _rerank(self, question: str, docs: List[Document]) -> List[Document]:
+        # עד chunks_per_verdict לכל פסק דין – ה-packer מאחד אותם אחר כך לבלוק אחד
+        per_case: Dict[str, int] = {}
+        unique = []
 
         for doc in docs:
             case_id = doc.metadata.get("display_name") or doc.metadata.get("filename")
-            if case_id not in unique:
-                unique[case_id] = doc
+            if per_case.get(case_id, 0) < self.chunks_per_verdict:
+                per_case[case_id] = per_case.get(case_id, 0) + 1
+                unique.append(doc)
 
-        docs = list(unique.values())
+        docs = unique
 
         if not docs:
             return []
 
-        stop_words = {
-            "של", "את", "על", "כי", "זה", "או", "כל", "הוא", "היא", "גם", "בין", "רק", "אך",
-            "אין", "יש", "מה", "מי", "איך", "כיצד", "מתי", "איפה", "למה", "מדוע", "האם",
-            "היה", "היתה", "היו", "תהיה", "יהיה", "פסק", "דין", "בית", "משפט", "החלטה",
-            "תביעה", "נתבעת", "תובעת", "נגד", "בפני", "ב", "בעמ", "בע\"מ",
-        }
-
-        raw_words = [w.strip('.,?"\'').lower() for w in question.split()]
-
-        filtered_words = []
-        for w in raw_words:
-            clean_w = w
-            if len(w) > 4 and w.startswith(("ב", "ה", "ל", "מ", "ש", "כ")):
-                clean_w = w[1:]
-
-            if len(clean_w) > 1 and clean_w not in stop_words and w not in stop_words:
-                filtered_words.append(clean_w)
-
-        words = filtered_words
+        words = query_terms(question)
         bigrams = [" ".join(words[i:i + 2]) for i in range(len(words) - 1)]
 
+        # מה שהדירוג צריך מכל המועמדים נטען מהאינדקס בבת אחת, וה-idf מחושב פעם אחת לכל מונח
+        if self.scoring == "bm25":
+            idfs = self.lexicon.idfs(set(words) | {REVERSED_MARK + w for w in words})
+            candidates = self.lexicon.features_many(docs, idfs)
+        else:
+            query = HeuristicQuery(words, bigrams)
+            candidates = self.lexicon.features_many(docs, query.terms, query.pairs)
+
         scored_docs = []
-        for idx, doc in enumerate(docs):
+        for idx, (doc, features) in enumerate(zip(docs, candidates)):
             score = (len(docs) - idx) / len(docs)
-            content = doc.page_content
-
-            for word in words:
-                if word in content:
-                    score += 2.0
-                if word[::-1] in content:
-                    score += 2.0
-                if len(word) > 3 and word in content.replace(" ", ""):
-                    score += 0.5
-
-            for bg in bigrams:
-                if bg in content:
-                    score += 5.0
-                if bg[::-1] in content:
-                    score += 5.0
+
+            if self.scoring == "bm25":
+                score += self.lexicon.bm25(features, idfs)
+            else:
+                score += query.score(features)
 
             scored_docs.append((doc, score))
 
@@ -112,6 +353,91 @@ class LegalRAGService:
 
         return filtered_docs[:30] if filtered_docs else []
 
+    def _retrieval_key(self, question: str, is_general: bool) -> Tuple[str, str]:
+        bucket = GENERAL_BUCKET if is_general else normalize_text(question)
+        return self._current_index_version(), bucket
+
+    def _candidates(self, question: str, is_general: bool) -> List[Document]:
+        key = self._retrieval_key(question, is_general)
+
+        cached = self.retrieval_cache.get(key)
+        if cached is not None:
+            count("retrieval_cache_hits")
+            return list(cached)
+
+        if is_general:
+            query = "פסק דין"
+        else:
+            query = question
+
+        with span("vector_search"):
+            docs = self.vector_index.search(query)
+        return self._store_candidates(key, question, is_general, docs)
+
+    def _store_candidates(
+        self, key: Tuple[str, str], question: str, is_general: bool, docs: List[Document]
+    ) -> List[Document]:
+        if self.hybrid and not is_general and len(self.lexicon):
+            with span("lexical_search"):
+                docs = self._fuse_lexical_hits(docs, question)
+
+        self.retrieval_cache.set(key, docs)
+        return list(docs)
+
+    def _vector_search_many(self, queries: List[str]) -> List[List[Document]]:
+        # כל השאלות ב-forward pass אחד של ה-embedding ובשאילתה אחת לאינדקס
+        vectors = self.embeddings.embed_queries(queries)
+        return self.vector_index.query(vectors, self.top_k)
+
+    def retrieve_many(self, questions: List[str]) -> List[List[Document]]:
+        general = [self._is_general_question(q) for q in questions]
+        keys = [self._retrieval_key(q, g) for q, g in zip(questions, general)]
+
+        # שאלות עם אותו מפתח אחזור (כולל כל השאלות הכלליות) נשלפות פעם אחת
+        results: Dict[Tuple[str, str], List[Document]] = {}
+        pending: Dict[Tuple[str, str], Tuple[str, bool]] = {}
+        for question, is_general, key in zip(questions, general, keys):
+            if key in results or key in pending:
+                continue
+            cached = self.retrieval_cache.get(key)
+            if cached is not None:
+                count("retrieval_cache_hits")
+                results[key] = list(cached)
+            else:
+                pending[key] = (question, is_general)
+
+        if pending:
+            queries = ["פסק דין" if is_general else question for question, is_general in pending.values()]
+            with span("vector_search"):
+                hits = self._vector_search_many(queries)
+            for (key, (question, is_general)), docs in zip(pending.items(), hits):
+                results[key] = self._store_candidates(key, question, is_general, docs)
+
+        with span("rerank"):
+            return [self._rerank(question, list(results[key])) for question, key in zip(questions, keys)]
+
+    def _fuse_lexical_hits(self, docs: List[Document], question: str) -> List[Document]:
+        # שמות צדדים (למשל 'נדל"ן בע"מ') נתפסים ע"י BM25 גם כשה-embedding מפספס אותם
+        words = query_terms(question)
+        hits = self.lexicon.search(words + [REVERSED_MARK + w for w in words], k=self.top_k)
+        if not hits:
+            return docs
+
+        by_id: Dict[str, Document] = {}
+        vector_ids = []
+        for idx, doc in enumerate(docs):
+            chunk_id = doc.metadata.get("chunk_id") or f"vector:{idx}"
+            by_id[chunk_id] = doc
+            vector_ids.append(chunk_id)
+
+        lexical_ids = [chunk_id for chunk_id, _ in hits]
+        missing = [chunk_id for chunk_id in lexical_ids if chunk_id not in by_id]
+        if missing:
+            by_id.update(self.vector_index.get(missing))
+
+        fused = reciprocal_rank_fusion([vector_ids, lexical_ids])
+        return [by_id[chunk_id] for chunk_id in fused if chunk_id in by_id]
+
     def build_context_and_citations(self, docs: List[Document]) -> Tuple[str, List[Dict]]:
         if not docs:
             return "", []
@@ -124,12 +450,6 @@ class LegalRAGService:
             display_name = doc.metadata.get("display_name", doc.metadata.get("filename", "Unknown"))
             source_path = doc.metadata.get("source_path", "")
 
-            file_url = ""
-            if source_path:
-                file_path = Path(source_path)
-                if file_path.exists():
-                    file_url = f"http://localhost:8005/api/files/{file_path.name}"
-
             metadata_str = ""
             if "moddate" in doc.metadata:
                 metadata_str += f"\nDate: {doc.metadata.get('moddate', 'Unknown')}"
@@ -143,128 +463,263 @@ class LegalRAGService:
                 f"--- END {cid} ---"
             )
 
-            citations.append({
-                "id": cid,
-                "filename": display_name,
-                "url": file_url,
-                "source_path": source_path,
-                "metadata": doc.metadata,
-            })
+            citations.append(self._citation(cid, display_name, source_path, doc.metadata))
 
         return "\n\n".join(context_parts), citations
 
+    def _citation(self, cid: str, display_name: str, source_path: str, metadata: Dict) -> Dict:
+        filename = metadata.get("filename") or Path(source_path).name
+        return {
+            "id": cid,
+            "filename": display_name,
+            "url": self.files.url_for(filename),
+            "source_path": source_path,
+            "metadata": metadata,
+        }
+
+    def prompt_prefix(self) -> List[Message]:
+        return [{"role": "system", "content": SYSTEM_PROMPT}]
+
     def _build_messages(self, question: str, context_text: str, num_sources: int = 0) -> List[Message]:
+        # הנחיית המערכת זהה בכל בקשה, והמסמכים שנשלפו באים בסוף – כך Ollama (KV cache) ו-OpenAI
+        # (prompt caching) יכולים לעשות שימוש חוזר בתחילית שכבר עובדה
         if num_sources > 0:
-            system_prompt = (
-                "אתה עורך דין מומחה בישראל.\n\n"
-                "חוקים בלתי משתנים - הפרה של כל אחד מהם היא שגיאה קריטית:\n"
-                "1. **אסור לכתוב אף מילה באנגלית!**\n"
-                "2. **אסור לכתוב משפטי הקדמה באנגלית!**\n"
-                "3. **אסור לחזור על התשובה!**\n"
-                "4. **אסור לכלול את השאלה בתשובה!**\n"
-                "5. התבסס רק על המסמכים.\n"
-                "6. חובה לציין מקורות.\n"
-                "7. אם אין מידע – אמור זאת.\n"
-                "8. התמודד עם טקסט הפוך/משובש.\n"
-                "9. כתוב עברית מקצועית.\n"
-            )
-
             user_content = (
                 f"{question}\n\n"
-                f"מקורות מידע מהמאגר ({num_sources} מסמכים):\n{context_text}\n\n"
-                "ענה ישירות בעברית בלבד."
+                f"מקורות מידע מהמאגר ({num_sources} מסמכים):\n{context_text}"
             )
-
         else:
-            system_prompt = (
-                "אתה עורך דין מומחה בישראל.\n"
-                "לא נמצאו מסמכים רלוונטיים.\n"
-                "ענה בעברית בלבד ולא באנגלית.\n"
-            )
-
-            user_content = (
-                f"{question}\n\n"
-                "לא נמצאו מסמכים רלוונטיים לשאלה זו.\n"
-            )
+            user_content = f"{question}\n\n{NO_SOURCES_INSTRUCTION}"
 
-        return [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_content},
-        ]
+        return self.prompt_prefix() + [{"role": "user", "content": user_content}]
 
     def _clean_answer(self, answer: str) -> str:
         if not answer:
             return ""
 
-        answer = answer.strip()
-
-        english_prefixes = [
-            "i'll answer", "i will answer", "i'll answer your question",
-            "i will answer your question", "let me answer", "here's the answer",
-            "the answer is", "answer:", "question:", "תשובה:", "שאלה:",
-        ]
+        cleaner = AnswerCleaner()
+        return (cleaner.feed(answer) + cleaner.finish()).strip()
 
-        for prefix in english_prefixes:
-            if answer.lower().startswith(prefix):
-                answer = answer[len(prefix):].strip()
-                if answer.startswith(":"):
-                    answer = answer[1:].strip()
-                break
+    def answer(self, question: str, chat_model: Optional[ChatModel] = None) -> Tuple[str, List[Dict]]:
+        model = self._resolve_model(chat_model)
+        catalog_answer = self._catalog_answer(question)
+        if catalog_answer is not None:
+            return catalog_answer
 
-        sentences = answer.split(".")
-        filtered_sentences = []
-        seen = set()
+        key = self._answer_key(question, model)
+        cached = self.answer_cache.get(key)
+        if cached is not None:
+            count("answer_cache_hits")
+            return cached
 
-        for sent in sentences:
-            sent_clean = sent.strip()
-            if not sent_clean:
-                continue
+        messages, citations = self._prepare(question, model)
 
-            sent_lower = sent_clean.lower()
+        with span("generation"):
+            answer = model.generate(messages)
+        answer = self._clean_answer(answer)
 
-            if any(bad in sent_lower for bad in [
-                "i'll answer", "i will answer", "directly in hebrew",
-                "without writing in english", "repeating the question",
-            ]):
-                continue
+        self._remember_answer(key, answer, citations)
+        return answer, citations
 
-            if sent_lower not in seen:
-                seen.add(sent_lower)
-                filtered_sentences.append(sent_clean)
+    def stream_answer(
+        self, question: str, chat_model: Optional[ChatModel] = None
+    ) -> Tuple[Iterable[str], List[Dict]]:
+        model = self._resolve_model(chat_model)
+        catalog_answer = self._catalog_answer(question)
+        if catalog_answer is not None:
+            answer, citations = catalog_answer
+            return iter([answer]), citations
+
+        key = self._answer_key(question, model)
+        cached = self.answer_cache.get(key)
+        if cached is not None:
+            count("answer_cache_hits")
+            answer, citations = cached
+            return iter([answer]), citations
+
+        messages, citations = self._prepare(question, model)
+        stream = model.stream(messages)
+        trace = current_trace()
 
-        answer = ". ".join(filtered_sentences)
-        if answer and not answer.endswith("."):
-            answer += "."
+        def cleaned_stream():
+            cleaner = AnswerCleaner()
+            parts = []
+            started = time.perf_counter()
+            for token in stream:
+                count("completion_tokens", trace=trace)
+                text = cleaner.feed(token)
+                if text:
+                    parts.append(text)
+                    yield text
 
-        return answer.strip()
+            tail = cleaner.finish()
+            if tail:
+                parts.append(tail)
+                yield tail
 
-    def answer(self, question: str) -> Tuple[str, List[Dict]]:
-        docs = self.retrieve(question)
-        context, citations = self.build_context_and_citations(docs)
-        messages = self._build_messages(question, context, num_sources=len(citations))
+            record_stage("generation", time.perf_counter() - started, trace)
+            self._remember_answer(key, "".join(parts).strip(), citations)
 
-        answer = self.chat_model.generate(messages)
-        answer = self._clean_answer(answer)
+        print(f"מספר ציטוטים שנמצאו: {len(citations)}")
 
-        return answer, citations
+        return cleaned_stream(), citations
 
-    def stream_answer(self, question: str) -> Tuple[Iterable[str], List[Dict]]:
-        docs = self.retrieve(question)
-        context, citations = self.build_context_and_citations(docs)
+    async def _run_blocking(self, func, *args):
+        loop = asyncio.get_running_loop()
+        # run_in_executor לא מעביר contextvars – בלי זה ה-thread לא רואה את ה-trace של הבקשה
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(ctx.run, func, *args))
 
+    def _context_budget(self, question: str, model: ChatModel) -> Tuple[int, Callable[[str], int]]:
+        if isinstance(model, ChatModel):
+            window, reserve, counter = model.context_window, model.max_output_tokens, model.count_tokens
+        else:
+            window, reserve, counter = ChatModel.context_window, ChatModel.max_output_tokens, estimate_tokens
+
+        # מה שנשאר בחלון אחרי הנחיות המערכת, השאלה והתשובה – זה התקציב למסמכים
+        prompt = self._build_messages(question, "", num_sources=1)
+        overhead = sum(counter(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in prompt)
+        budget = window - reserve - overhead - CONTEXT_SAFETY_TOKENS
+        return min(budget, self.max_context_tokens), counter
+
+    def _prepare(
+        self, question: str, model: Optional[ChatModel] = None, docs: Optional[List[Document]] = None
+    ) -> Tuple[List[Message], List[Dict]]:
+        if docs is None:
+            docs = self.retrieve(question)
+        with span("context_build"):
+            budget, counter = self._context_budget(question, model)
+            packed = pack_context(docs, budget, counter)
+            context, citations = self.build_context_and_citations(packed.docs)
+        count("context_tokens", packed.used_tokens)
+        count("context_tokens_dropped", packed.dropped_tokens)
         messages = self._build_messages(question, context, num_sources=len(citations))
-        stream = self.chat_model.stream(messages)
-
-        def cleaned_stream():
-            full_text = ""
-            for token in stream:
-                full_text += token
-                yield token
+        count("prompt_words", sum(len(m["content"].split()) for m in messages))
+        return messages, citations
+
+    def _prepare_many(self, questions: List[str], model: ChatModel) -> Tuple[Dict[int, Tuple], Dict[int, Tuple]]:
+        # לכל שאלה: תשובה מוכנה (קטלוג/cache), או הודעות ל-LLM ומפתח ה-cache; האחזור של כולן יחד
+        ready: Dict[int, Tuple[str, List[Dict]]] = {}
+        keys = {}
+        for idx, question in enumerate(questions):
+            answer = self._catalog_answer(question)
+            if answer is None:
+                keys[idx] = self._answer_key(question, model)
+                answer = self.answer_cache.get(keys[idx])
+                if answer is not None:
+                    count("answer_cache_hits")
+            if answer is not None:
+                ready[idx] = answer
+
+        todo = [idx for idx in range(len(questions)) if idx not in ready]
+        retrieved = self.retrieve_many([questions[idx] for idx in todo]) if todo else []
+        pending = {
+            idx: (*self._prepare(questions[idx], model, docs), keys[idx])
+            for idx, docs in zip(todo, retrieved)
+        }
+        return ready, pending
+
+    async def answer_many(
+        self, questions: List[str], chat_model: Optional[ChatModel] = None, concurrency: int = 4
+    ) -> AsyncIterator[Dict]:
+        # התוצאות חוזרות לפי סדר הסיום, כל אחת עם index של השאלה ברשימה המקורית
+        model = self._resolve_model(chat_model)
+        ready, pending = await self._run_blocking(self._prepare_many, questions, model)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def generate(idx: int, messages: List[Message], citations: List[Dict], key: Tuple[str, str, str]) -> Dict:
+            try:
+                async with semaphore:
+                    started = time.perf_counter()
+                    answer = await model.agenerate(messages)
+                    record_stage("generation", time.perf_counter() - started)
+                answer = self._clean_answer(answer)
+                if answer.startswith(ERROR_PREFIX):
+                    # המודלים מחזירים שגיאות backend כטקסט – הן נספרות כשגיאה ולא כתשובה
+                    return {"index": idx, "error": answer}
+                self._remember_answer(key, answer, citations)
+                return {"index": idx, "answer": answer, "citations": citations}
+            except Exception as e:
+                return {"index": idx, "error": str(e)}
+
+        tasks = [asyncio.ensure_future(generate(idx, *plan)) for idx, plan in pending.items()]
+        try:
+            for idx, (answer, citations) in ready.items():
+                yield {"index": idx, "answer": answer, "citations": citations}
+
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def aretrieve(self, question: str) -> List[Document]:
+        return await self._run_blocking(self.retrieve, question)
+
+    async def aanswer(self, question: str, chat_model: Optional[ChatModel] = None) -> Tuple[str, List[Dict]]:
+        model = self._resolve_model(chat_model)
+        catalog_answer = await self._run_blocking(self._catalog_answer, question)
+        if catalog_answer is not None:
+            return catalog_answer
+
+        key = await self._run_blocking(self._answer_key, question, model)
+        cached = self.answer_cache.get(key)
+        if cached is not None:
+            count("answer_cache_hits")
+            return cached
+
+        messages, citations = await self._run_blocking(self._prepare, question, model)
+
+        started = time.perf_counter()
+        answer = await model.agenerate(messages)
+        record_stage("generation", time.perf_counter() - started)
+        answer = self._clean_answer(answer)
 
-            cleaned = self._clean_answer(full_text)
-            if cleaned != full_text:
-                pass
+        self._remember_answer(key, answer, citations)
+        return answer, citations
 
-        print(f"מספר ציטוטים שנמצאו: {len(citations)}")
+    async def astream_answer(
+        self, question: str, chat_model: Optional[ChatModel] = None
+    ) -> Tuple[AsyncIterator[str], List[Dict]]:
+        model = self._resolve_model(chat_model)
+        # תשובה מוכנה – מהקטלוג או מה-cache – נשלחת כ-stream של חלק אחד
+        ready = await self._run_blocking(self._catalog_answer, question)
+        if ready is None:
+            key = await self._run_blocking(self._answer_key, question, model)
+            ready = self.answer_cache.get(key)
+            if ready is not None:
+                count("answer_cache_hits")
+
+        if ready is not None:
+            answer, citations = ready
+
+            async def cached_stream():
+                yield answer
+
+            return cached_stream(), citations
+
+        messages, citations = await self._run_blocking(self._prepare, question, model)
+        # רק כאן ברור שהמודל ירוץ – תופסים מקום אצל ה-backend (או נדחים) לפני שה-stream מוחזר
+        await model.reserve()
+        trace = current_trace()
+
+        async def cleaned_stream():
+            cleaner = AnswerCleaner()
+            parts = []
+            started = time.perf_counter()
+            async for token in model.astream(messages):
+                count("completion_tokens", trace=trace)
+                text = cleaner.feed(token)
+                if text:
+                    parts.append(text)
+                    yield text
+
+            tail = cleaner.finish()
+            if tail:
+                parts.append(tail)
+                yield tail
+
+            record_stage("generation", time.perf_counter() - started, trace)
+            self._remember_answer(key, "".join(parts).strip(), citations)
 
         return cleaned_stream(), citations
@@ -0,0 +1,245 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Iterable, List, Optional
+
+import metrics
+from models.base import ChatModel, Message
+
+# זמן יצירה משוער לפני שנמדדה יצירה אמיתית – משמש רק לחישוב Retry-After
+DEFAULT_SERVICE_SECONDS = 5.0
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    # התור מלא (429) או שההמתנה בתור עברה את המקסימום (503); retry_after בשניות
+    def __init__(self, backend: str, reason: str, retry_after: int):
+        super().__init__(f"Generation backend '{backend}' is overloaded ({reason}), retry in {retry_after}s")
+        self.backend = backend
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def status_code(self) -> int:
+        return 429 if self.reason == "queue_full" else 503
+
+
+class Ticket:
+    def __init__(self, limiter: "BackendLimiter", queued_seconds: float = 0.0):
+        self._limiter = limiter
+        self._started = time.monotonic()
+        self._released = False
+        self.queued_seconds = queued_seconds
+
+    def release(self) -> None:
+        # נקרא גם מסוף ה-stream וגם מה-background של התשובה – רק הקריאה הראשונה משחררת
+        if not self._released:
+            self._released = True
+            self._limiter._release(time.monotonic() - self._started)
+
+
+class BackendLimiter:
+    # עד max_concurrent יצירות במקביל; מעבר לזה עד max_queue ממתינים בתור (FIFO),
+    # וכל אחד מהם ממתין לכל היותר max_queue_seconds. מה שלא נכנס – נדחה מיד
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_queue_seconds: float):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1")
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max(0, max_queue)
+        self.max_queue_seconds = max_queue_seconds
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._service_seconds = DEFAULT_SERVICE_SECONDS
+        self._publish()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _publish(self) -> None:
+        metrics.GENERATION_ACTIVE.set(self.active, backend=self.name)
+        metrics.GENERATION_QUEUE_DEPTH.set(len(self._waiters), backend=self.name)
+
+    def retry_after(self) -> int:
+        # כמה זמן ייקח לתור הנוכחי להתרוקן, לפי זמן היצירה הממוצע
+        rounds = (len(self._waiters) + 1) / self.max_concurrent
+        return max(1, math.ceil(rounds * self._service_seconds))
+
+    def _reject(self, reason: str) -> Overloaded:
+        metrics.GENERATION_REJECTED.inc(backend=self.name, reason=reason)
+        return Overloaded(self.name, reason, self.retry_after())
+
+    async def acquire(self) -> Ticket:
+        started = time.monotonic()
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self._publish()
+            metrics.GENERATION_QUEUE_SECONDS.observe(0.0, backend=self.name)
+            return Ticket(self)
+
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._publish()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_queue_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # המקום הועבר אלינו בדיוק כשנגמר הזמן – מחזירים אותו לבא בתור
+                self._release(None)
+            else:
+                waiter.cancel()
+                self._remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._reject("queue_timeout")
+
+        queued = time.monotonic() - started
+        metrics.GENERATION_QUEUE_SECONDS.observe(queued, backend=self.name)
+        return Ticket(self, queued)
+
+    def _remove(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        self._publish()
+
+    def _release(self, held_seconds: Optional[float]) -> None:
+        if held_seconds is not None:
+            self._service_seconds += SERVICE_TIME_SMOOTHING * (held_seconds - self._service_seconds)
+
+        # המקום עובר ישירות לממתין הבא, כך שבקשה חדשה לא עוקפת את התור
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._publish()
+                return
+        self.active -= 1
+        self._publish()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[Ticket]:
+        ticket = await self.acquire()
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+
+class GenerationScheduler:
+    def __init__(self, max_queue: int = 32, max_queue_seconds: float = 20.0):
+        self.max_queue = max_queue
+        self.max_queue_seconds = max_queue_seconds
+        self._limits: Dict[str, int] = {}
+        self._limiters: Dict[str, BackendLimiter] = {}
+
+    def configure(self, backend: str, max_concurrent: int) -> None:
+        self._limits[backend] = max_concurrent
+
+    def limiter(self, backend: str) -> Optional[BackendLimiter]:
+        # backend בלי מגבלה מוגדרת לא עובר בקרת כניסה
+        if backend not in self._limits:
+            return None
+        limiter = self._limiters.get(backend)
+        if limiter is None:
+            limiter = self._limiters[backend] = BackendLimiter(
+                backend, self._limits[backend], self.max_queue, self.max_queue_seconds
+            )
+        return limiter
+
+    async def acquire(self, backend: str) -> Optional[Ticket]:
+        limiter = self.limiter(backend)
+        return await limiter.acquire() if limiter is not None else None
+
+    def wrap(self, model: ChatModel, backend: str, patient: bool = False) -> ChatModel:
+        limiter = self.limiter(backend)
+        return ScheduledChatModel(model, limiter, patient) if limiter is not None else model
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {"active": limiter.active, "queued": limiter.queued, "max_concurrent": limiter.max_concurrent}
+            for name, limiter in self._limiters.items()
+        }
+
+
+class ScheduledChatModel(ChatModel):
+    # עוטף מודל כך שכל יצירה אסינכרונית תופסת מקום ב-limiter. ב-/chat העטיפה היא לבקשה אחת: reserve תופס
+    # את המקום אחרי האחזור, כך שעומס נדחה עם 429 לפני שה-stream התחיל ותשובות מוכנות לא תופסות מקום.
+    # patient (ב-/chat/batch) – דחייה לא מפילה את השאלה, היא ממתינה Retry-After ומנסה שוב
+    def __init__(self, model: ChatModel, limiter: BackendLimiter, patient: bool = False):
+        self.wrapped = model
+        self.limiter = limiter
+        self.patient = patient
+        self.model_name = getattr(model, "model_name", "")
+        self.context_window = model.context_window
+        self.max_output_tokens = model.max_output_tokens
+        self.queue_seconds = 0.0
+        self._reserved: Optional[Ticket] = None
+
+    def count_tokens(self, text: str) -> int:
+        return self.wrapped.count_tokens(text)
+
+    def warmup(self, prefix: List[Message]) -> None:
+        self.wrapped.warmup(prefix)
+
+    def generate(self, messages: List[Message]) -> str:
+        return self.wrapped.generate(messages)
+
+    def stream(self, messages: List[Message]) -> Iterable[str]:
+        return self.wrapped.stream(messages)
+
+    async def reserve(self) -> None:
+        if self._reserved is None:
+            self._reserved = await self.limiter.acquire()
+            self.queue_seconds = self._reserved.queued_seconds
+
+    def cancel_reservation(self) -> None:
+        ticket, self._reserved = self._reserved, None
+        if ticket is not None:
+            ticket.release()
+
+    async def _ticket(self) -> Ticket:
+        if self._reserved is not None:
+            ticket, self._reserved = self._reserved, None
+            return ticket
+        while True:
+            try:
+                return await self.limiter.acquire()
+            except Overloaded as e:
+                if not self.patient:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    async def agenerate(self, messages: List[Message]) -> str:
+        ticket = await self._ticket()
+        try:
+            return await self.wrapped.agenerate(messages)
+        finally:
+            ticket.release()
+
+    async def astream(self, messages: List[Message]) -> AsyncIterator[str]:
+        ticket = await self._ticket()
+        try:
+            async for token in self.wrapped.astream(messages):
+                yield token
+        finally:
+            ticket.release()
+
+
+def default_scheduler() -> GenerationScheduler:
+    # מגבלות לפי backend: Ollama מעבד מעט בקשות במקביל (OLLAMA_NUM_PARALLEL), OpenAI הרבה יותר
+    scheduler = GenerationScheduler(
+        max_queue=int(os.getenv("GENERATION_QUEUE_SIZE", "32")),
+        max_queue_seconds=float(os.getenv("GENERATION_MAX_QUEUE_SECONDS", "20")),
+    )
+    scheduler.configure("ollama", int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4")))
+    scheduler.configure("openai", int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")))
+    return scheduler
@@ -1,41 +1,342 @@
 import requests
+import argparse
+import hashlib
 import json
+import sqlite3
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import List, Dict, Set, Optional
+from html.parser import HTMLParser
+from typing import Iterable, List, Dict, Set, Optional
+from urllib.parse import urljoin, urlsplit
+from requests.adapters import HTTPAdapter
+
+PAGE_SIZE = 20
+# תגיות בלי תגית סגירה – לא נספרות בעומק הקינון של הפריט
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+class TokenBucket:
+    # עד burst בקשות מיד, ואחר כך rate בקשות בשנייה; acquire חוסם רק את ה-thread שביקש
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class HostRateLimiter:
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str) -> None:
+        host = urlsplit(url).netloc
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+
+def canonical_filename(doc: Dict) -> str:
+    # שם קבוע לפי ה-URL ולא לפי המיקום ברשימה – סידור מחדש באתר לא גורם להורדה חוזרת
+    ext = ".pdf" if doc["type"] == "pdf" else ".docx"
+    safe_name = doc["name"][:30].replace("/", "_").replace("\\", "_")
+    key = hashlib.sha256(doc["url"].encode("utf-8")).hexdigest()[:8]
+    return f"doc_{key}_{safe_name}{ext}"
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def document_type(classes: Set[str]) -> Optional[str]:
+    if "sprite-logo-pdf" in classes:
+        return "pdf"
+    if "sprite-logo-docx" in classes or "sprite-logo-doc" in classes:
+        return "word"
+    return None
+
+
+class ListingParser(HTMLParser):
+    # כל ".dy-file-item" בעמוד תוצאות: הקישור הראשון, הטקסט שלו, וסוג הקובץ לפי אייקון ה-sprite
+    def __init__(self, page_url: str):
+        super().__init__(convert_charrefs=True)
+        self.page_url = page_url
+        self.items: List[Dict] = []
+        self._depth = 0
+        self._item: Optional[Dict] = None
+        self._in_link = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = set((attrs.get("class") or "").split())
+
+        if self._item is None:
+            if "dy-file-item" in classes:
+                self._item = {"url": None, "name": "", "types": set()}
+                self._depth = 0 if tag in VOID_TAGS else 1
+            return
+
+        if tag not in VOID_TAGS:
+            self._depth += 1
+        if tag == "a" and self._item["url"] is None and attrs.get("href"):
+            self._item["url"] = urljoin(self.page_url, attrs["href"])
+            self._in_link = True
+        doc_type = document_type(classes)
+        if doc_type:
+            self._item["types"].add(doc_type)
+
+    def handle_endtag(self, tag):
+        if self._item is None or tag in VOID_TAGS:
+            return
+        if tag == "a":
+            self._in_link = False
+        self._depth -= 1
+        if self._depth <= 0:
+            self._finish_item()
+
+    def handle_data(self, data):
+        if self._in_link:
+            self._item["name"] += data
+
+    def _finish_item(self):
+        item, self._item, self._in_link = self._item, None, False
+        types = item["types"]
+        self.items.append({
+            "url": item["url"],
+            # כמו בגרסת ה-Selenium: אייקון PDF קודם ל-Word
+            "type": "pdf" if "pdf" in types else ("word" if types else None),
+            "name": " ".join(item["name"].split()),
+        })
+
+
+def parse_listing(html: str, page_url: str) -> List[Dict]:
+    parser = ListingParser(page_url)
+    parser.feed(html)
+    parser.close()
+    return parser.items
+
+
+class SeleniumListingBackend:
+    # עמוד ה-collector מרנדר את התוצאות ב-JavaScript, ולכן נטען בדפדפן headless; Selenium נדרש רק כאן.
+    # כל עמוד נקרא פעם אחת (page_source) ומפוענח ב-ListingParser, בלי קריאה לדפדפן לכל פריט
+    name = "selenium"
+
+    def __init__(self, wait_seconds: float = 10.0, attempts: int = 2):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
+        chrome_options = Options()
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        self.driver = webdriver.Chrome(options=chrome_options)
+        self.wait_seconds = wait_seconds
+        self.attempts = attempts
+
+    def fetch(self, page_url: str) -> Optional[List[Dict]]:
+        # [] – העמוד נטען ואין בו תוצאות (סוף הרשימה); None – העמוד לא נטען גם אחרי ניסיון חוזר
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        for attempt in range(1, self.attempts + 1):
+            try:
+                self.driver.get(page_url)
+                WebDriverWait(self.driver, self.wait_seconds).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, ".dy-file-item"))
+                )
+                return parse_listing(self.driver.page_source, page_url)
+            except TimeoutException:
+                return []
+            except WebDriverException as e:
+                print(f"Listing page failed (attempt {attempt}/{self.attempts}): {page_url}: {e}")
+        return None
+
+    def close(self) -> None:
+        self.driver.quit()
+
+
+DOCUMENT_FIELDS = (
+    "url", "type", "name", "downloaded", "failed_attempts",
+    "filename", "sha256", "etag", "last_modified", "duplicate_of",
+)
+
+
+class DocumentStore:
+    # מצב המסמכים ב-SQLite: כל עדכון הוא טרנזקציה של שורה אחת, כך שעצירה באמצע לא שוברת את המצב
+    # ואין צורך לכתוב מחדש את כל הרשימה אחרי כל הורדה
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    url TEXT NOT NULL UNIQUE,
+                    type TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    downloaded INTEGER NOT NULL DEFAULT 0,
+                    failed_attempts INTEGER NOT NULL DEFAULT 0,
+                    filename TEXT,
+                    sha256 TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    duplicate_of TEXT
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS documents_status ON documents (downloaded, type)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256)")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    @staticmethod
+    def _row(doc: Dict) -> tuple:
+        values = [doc.get(field) for field in DOCUMENT_FIELDS]
+        values[3] = int(bool(values[3]))
+        values[4] = values[4] or 0
+        return tuple(values)
+
+    def put(self, doc: Dict) -> None:
+        self.put_many([doc])
+
+    def put_many(self, documents: Iterable[Dict]) -> None:
+        columns = ", ".join(DOCUMENT_FIELDS)
+        updates = ", ".join(f"{field} = excluded.{field}" for field in DOCUMENT_FIELDS[1:])
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO documents ({columns}) VALUES ({', '.join('?' * len(DOCUMENT_FIELDS))}) "
+                f"ON CONFLICT(url) DO UPDATE SET {updates}",
+                [self._row(doc) for doc in documents],
+            )
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+    def add_new(self, documents: Iterable[Dict]) -> None:
+        # מסמכים חדשים מהרשימה; כתובת שכבר קיימת נשארת עם המצב שלה
+        columns = ", ".join(DOCUMENT_FIELDS)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO documents ({columns}) VALUES ({', '.join('?' * len(DOCUMENT_FIELDS))})",
+                [self._row(doc) for doc in documents],
+            )
+
+    def get(self, url: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents WHERE url = ?", (url,)).fetchone()
+        return self._document(row) if row else None
+
+    def all(self) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM documents ORDER BY id").fetchall()
+        return [self._document(row) for row in rows]
+
+    @staticmethod
+    def _document(row: sqlite3.Row) -> Dict:
+        doc = {field: row[field] for field in DOCUMENT_FIELDS}
+        doc["downloaded"] = bool(doc["downloaded"])
+        return doc
+
+    def downloaded_urls(self) -> Set[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT url FROM documents WHERE downloaded = 1").fetchall()
+        return {row[0] for row in rows}
+
+    def downloaded_counts(self) -> Dict[str, int]:
+        # מסמכים שהורדו לפי סוג, בלי כפילויות – שאילתה על האינדקס במקום מעבר על כל הרשימה
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT type, COUNT(*) FROM documents WHERE downloaded = 1 AND duplicate_of IS NULL GROUP BY type"
+            ).fetchall()
+        counts = {"pdf": 0, "word": 0}
+        counts.update({doc_type: count for doc_type, count in rows})
+        return counts
+
+    def import_json(self, path: Path) -> int:
+        # ייבוא חד-פעמי של documents_data.json מגרסאות קודמות, לפי הסדר המקורי
+        with open(path, "r", encoding="utf-8") as f:
+            documents = json.load(f)
+        self.add_new(documents)
+        return len(documents)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
 
 
 class TabuVerdictScraper:
-    def __init__(self, output_dir: str = "downloads"):
+    def __init__(
+        self,
+        output_dir: str = "downloads",
+        concurrency: int = 4,
+        rate_per_host: float = 2.0,
+        burst: int = 2,
+    ):
         self.base_url = "https://www.gov.il"
         self.search_url = "https://www.gov.il/he/Departments/DynamicCollectors/tabu_search_verdict?skip=0"
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.concurrency = max(1, concurrency)
+        # כל בקשה לאתר (כולל ניסיונות חוזרים) עוברת דרך ה-rate limit של השרת שלה
+        self.rate_limiter = HostRateLimiter(rate_per_host, burst)
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.session.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
         })
-        self.data_file = self.output_dir / "documents_data.json"
+        self.data_file = self.output_dir / "documents.db"
+        self.changes_file = self.output_dir / "changes.jsonl"
+        self.store = DocumentStore(self.data_file)
+        legacy_data = self.output_dir / "documents_data.json"
+        if len(self.store) == 0 and legacy_data.exists():
+            print(f"Imported {self.store.import_json(legacy_data)} documents from {legacy_data.name}")
+        self._state_lock = threading.Lock()
+        self._changes_lock = threading.Lock()
+        self._documents: List[Dict] = []
+        self._by_hash: Dict[str, str] = {}
 
 
     def load_data(self) -> List[Dict]:
-        if not self.data_file.exists():
-            return []
-        with open(self.data_file, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return self.store.all()
 
     def save_data(self, documents: List[Dict]) -> Path:
-        with open(self.data_file, "w", encoding="utf-8") as f:
-            json.dump(documents, f, ensure_ascii=False, indent=2)
+        self.store.put_many(documents)
         return self.data_file
 
 
+    def open_listing_backend(self) -> SeleniumListingBackend:
+        return SeleniumListingBackend()
+
     def gather_data(
         self,
         target_pdf: int = 50,
@@ -45,13 +346,6 @@ class TabuVerdictScraper:
         initial_pdf_count: int = 0,
         initial_word_count: int = 0,
     ) -> List[Dict]:
-        chrome_options = Options()
-        chrome_options.add_argument("--headless=new")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-
-        driver = webdriver.Chrome(options=chrome_options)
-
         documents: List[Dict] = []
         pdf_count = initial_pdf_count
         word_count = initial_word_count
@@ -59,24 +353,25 @@ class TabuVerdictScraper:
         base_search_url = self.search_url.partition("?")[0]
         seen_urls: Set[str] = set(initial_seen_urls or set())
         page_idx = 0
+        failed_pages = 0
+        backend = self.open_listing_backend()
 
         try:
             while (pdf_count < target_pdf or word_count < target_word) and page_idx < max_pages:
-                skip = page_idx * 20
-                page_url = f"{base_search_url}?skip={skip}"
-                print(f"Loading page {page_idx + 1}: {page_url}")
-
-                driver.get(page_url)
-                wait = WebDriverWait(driver, 10)
-
-                try:
-                    wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ".dy-file-item")))
-                    items = driver.find_elements(By.CSS_SELECTOR, ".dy-file-item")
-                except Exception:
-                    print(f"No items found on page {page_idx + 1}")
-                    break
-
+                page_url = f"{base_search_url}?skip={page_idx * PAGE_SIZE}"
+                page_idx += 1
+                # טעינת עמוד בדפדפן עוברת דרך אותו rate limit של השרת כמו ההורדות
+                self.rate_limiter.wait(page_url)
+                items = backend.fetch(page_url)
+                if items is None:
+                    # עמוד שנכשל לא עוצר את האיסוף – ממשיכים לעמוד הבא (ה-URL-ים שלו ייאספו בריצה הבאה)
+                    failed_pages += 1
+                    print(f"Skipping page {page_idx}: {page_url}")
+                    continue
+
+                print(f"Loaded page {page_idx}: {page_url}")
                 if not items:
+                    print(f"No items found on page {page_idx}")
                     break
 
                 initial_len = len(documents)
@@ -85,130 +380,241 @@ class TabuVerdictScraper:
                     if pdf_count >= target_pdf and word_count >= target_word:
                         break
 
-                    try:
-                        link = item.find_element(By.TAG_NAME, "a")
-                        href = link.get_attribute("href")
-
-                        if not href or href in seen_urls:
-                            continue
-
-                        doc_type = None
-                        if item.find_elements(By.CSS_SELECTOR, ".sprite-logo-pdf"):
-                            doc_type = "pdf"
-                        elif (
-                            item.find_elements(By.CSS_SELECTOR, ".sprite-logo-docx")
-                            or item.find_elements(By.CSS_SELECTOR, ".sprite-logo-doc")
-                        ):
-                            doc_type = "word"
-
-                        if not doc_type:
-                            continue
+                    href = item["url"]
+                    doc_type = item["type"]
+                    if not href or href in seen_urls or not doc_type:
+                        continue
 
-                        if doc_type == "pdf" and pdf_count >= target_pdf:
-                            continue
-                        if doc_type == "word" and word_count >= target_word:
-                            continue
+                    if doc_type == "pdf" and pdf_count >= target_pdf:
+                        continue
+                    if doc_type == "word" and word_count >= target_word:
+                        continue
 
-                        seen_urls.add(href)
+                    seen_urls.add(href)
 
-                        if doc_type == "pdf":
-                            pdf_count += 1
-                        else:
-                            word_count += 1
+                    if doc_type == "pdf":
+                        pdf_count += 1
+                    else:
+                        word_count += 1
 
-                        documents.append({
-                            "url": href,
-                            "type": doc_type,
-                            "name": link.text.strip() or f"doc_{len(documents)}",
-                            "downloaded": False,
-                            "failed_attempts": 0,
-                        })
-
-                    except Exception:
-                        continue
+                    documents.append({
+                        "url": href,
+                        "type": doc_type,
+                        "name": item["name"] or f"doc_{len(documents)}",
+                        "downloaded": False,
+                        "failed_attempts": 0,
+                    })
 
                 print(f"Status (collected): PDF={pdf_count}/{target_pdf}, Word={word_count}/{target_word}")
 
-                if len(documents) == initial_len and len(items) < 20:
+                if len(documents) == initial_len and len(items) < PAGE_SIZE:
                     break
 
-                page_idx += 1
-                time.sleep(1)
-
         finally:
-            driver.quit()
+            backend.close()
 
+        if failed_pages:
+            print(f"{failed_pages} listing page(s) could not be loaded and were skipped.")
         return documents
 
 
-    def download_file(self, url: str, filename: str, max_retries: int = 3) -> bool:
+    def document_index(self, documents: List[Dict]) -> None:
+        # מצב התוכן: איזה קובץ מחזיק כל SHA-256, כדי שתוכן זהה מכתובות שונות יישמר פעם אחת
+        self._documents = documents
+        self._by_hash = {
+            d["sha256"]: d["filename"]
+            for d in documents
+            if d.get("downloaded") and d.get("sha256") and not d.get("duplicate_of")
+        }
+        for idx, doc in enumerate(documents):
+            if doc.get("downloaded") and not doc.get("filename"):
+                self._adopt_legacy_file(idx, doc)
+
+    def _adopt_legacy_file(self, idx: int, doc: Dict) -> None:
+        # קבצים מגרסה שקראה להם לפי המיקום ברשימה (doc_{idx}_...) עוברים לשם הקבוע, או נמחקים אם הם כפילות
+        ext = ".pdf" if doc["type"] == "pdf" else ".docx"
+        safe_name = doc["name"][:30].replace("/", "_").replace("\\", "_")
+        legacy = self.output_dir / f"doc_{idx}_{safe_name}{ext}"
+        if not legacy.exists():
+            doc["downloaded"] = False
+            self.store.put(doc)
+            return
+
+        sha = file_sha256(legacy)
+        owner = self._by_hash.get(sha)
+        self.record_change("removed", legacy.name, url=doc["url"])
+        if owner is not None:
+            legacy.unlink()
+            doc.update(filename=owner, sha256=sha, duplicate_of=owner)
+            self.store.put(doc)
+            return
+
+        filename = canonical_filename(doc)
+        legacy.replace(self.output_dir / filename)
+        doc.update(filename=filename, sha256=sha)
+        self._by_hash[sha] = filename
+        self.store.put(doc)
+        self.record_change("added", filename, sha, doc["url"])
+
+    def record_change(self, event: str, filename: str, sha256: Optional[str] = None, url: Optional[str] = None) -> None:
+        # שורה לכל שינוי בקבצים – build_index.py קורא מהמקום שבו עצר ומאנדקס רק את מה שהשתנה
+        line = {"event": event, "filename": filename, "sha256": sha256, "url": url, "at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with self._changes_lock:
+            with open(self.changes_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    def _release_file(self, filename: str, url: str) -> None:
+        # הקובץ כבר לא מייצג את הכתובת הזו; מסמכים שהצביעו עליו ככפילות יורדו שוב בהרצה הבאה
+        (self.output_dir / filename).unlink(missing_ok=True)
+        self._by_hash = {sha: name for sha, name in self._by_hash.items() if name != filename}
+        self.record_change("removed", filename, url=url)
+        for other in self._documents:
+            if other.get("duplicate_of") == filename:
+                self._forget(other)
+                self.store.put(other)
+
+    @staticmethod
+    def _forget(doc: Dict) -> None:
+        doc["downloaded"] = False
+        for key in ("filename", "sha256", "etag", "last_modified", "duplicate_of"):
+            doc.pop(key, None)
+
+    def _store(self, doc: Dict, partial: Path, sha: str, headers) -> str:
+        filename = canonical_filename(doc)
         filepath = self.output_dir / filename
+        with self._state_lock:
+            doc["etag"] = headers.get("ETag")
+            doc["last_modified"] = headers.get("Last-Modified")
+            owns_file = doc.get("filename") == filename and filepath.exists()
+
+            if owns_file and doc.get("sha256") == sha:
+                partial.unlink()
+                return "unchanged"
+
+            owner = self._by_hash.get(sha)
+            if owner is not None and owner != filename:
+                partial.unlink()
+                if owns_file:
+                    self._release_file(filename, doc["url"])
+                doc.update(filename=owner, sha256=sha, duplicate_of=owner)
+                return "duplicate"
+
+            partial.replace(filepath)
+            if doc.get("sha256") and self._by_hash.get(doc["sha256"]) == filename:
+                del self._by_hash[doc["sha256"]]
+            self._by_hash[sha] = filename
+            doc.update(filename=filename, sha256=sha)
+            doc.pop("duplicate_of", None)
+            event = "changed" if owns_file else "added"
+            self.record_change(event, filename, sha, doc["url"])
+            for other in self._documents:
+                if other is not doc and other.get("duplicate_of") == filename:
+                    self._forget(other)
+                    self.store.put(other)
+            return event
+
+    def download_file(self, doc: Dict, max_retries: int = 3) -> str:
+        # מחזיר added / changed / unchanged / duplicate / removed, או failed אחרי כל הניסיונות
+        url = doc["url"]
         last_error = None
 
-        if filepath.exists():
-            print(f"File already exists, skipping: {filename}")
-            return True
+        # GET מותנה: אם הקובץ לא השתנה מאז ההורדה הקודמת השרת מחזיר 304 בלי גוף
+        headers = {}
+        if doc.get("filename") and (self.output_dir / doc["filename"]).exists():
+            if doc.get("etag"):
+                headers["If-None-Match"] = doc["etag"]
+            if doc.get("last_modified"):
+                headers["If-Modified-Since"] = doc["last_modified"]
 
+        # הורדה לקובץ זמני: קובץ חלקי (שגיאה או עצירה) לא מחליף את הקובץ הקיים
+        partial = self.output_dir / (canonical_filename(doc) + ".part")
         for attempt in range(1, max_retries + 1):
             try:
+                self.rate_limiter.wait(url)
                 print(f"  -> Download attempt {attempt} for {url}")
-                response = self.session.get(url, stream=True, timeout=30)
-                response.raise_for_status()
-
-                with open(filepath, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                return True
+                digest = hashlib.sha256()
+                with self.session.get(url, stream=True, timeout=30, headers=headers) as response:
+                    if response.status_code == 304:
+                        return "unchanged"
+                    if response.status_code in (404, 410) and doc.get("downloaded"):
+                        # מסמך שהורד בעבר ונמחק מהאתר
+                        with self._state_lock:
+                            if not doc.get("duplicate_of"):
+                                self._release_file(doc["filename"], url)
+                            self._forget(doc)
+                        return "removed"
+                    response.raise_for_status()
+
+                    with open(partial, "wb") as f:
+                        for chunk in response.iter_content(chunk_size=8192):
+                            if chunk:
+                                digest.update(chunk)
+                                f.write(chunk)
+                    return self._store(doc, partial, digest.hexdigest(), response.headers)
 
             except Exception as e:
                 last_error = e
                 print(f"Failed attempt {attempt} for {url}: {e}")
-                time.sleep(2 * attempt)
+                partial.unlink(missing_ok=True)
 
         print(f"Giving up on {url} after {max_retries} attempts. Last error: {last_error}")
-        return False
+        return "failed"
 
 
     def download_all(self, documents: List[Dict], target_pdf: int, target_word: int):
-        pdf_ok = sum(1 for d in documents if d.get("downloaded") and d["type"] == "pdf")
-        word_ok = sum(1 for d in documents if d.get("downloaded") and d["type"] == "word")
-
-        print(f"Already downloaded before run: PDF={pdf_ok}, Word={word_ok}")
-
-        for idx, doc in enumerate(documents):
-            if doc.get("downloaded"):
-                continue 
-
-            if doc["type"] == "pdf" and pdf_ok >= target_pdf:
-                continue
-            if doc["type"] == "word" and word_ok >= target_word:
-                continue
-
-            ext = ".pdf" if doc["type"] == "pdf" else ".docx"
-            safe_name = doc["name"][:30].replace("/", "_").replace("\\", "_")
-            filename = f"doc_{idx}_{safe_name}{ext}"
-
-            print(f"Downloading {idx + 1}/{len(documents)}: {filename} ({doc['type']})")
-
-            ok = self.download_file(doc["url"], filename)
-            if ok:
-                doc["downloaded"] = True
-                if doc["type"] == "pdf":
-                    pdf_ok += 1
+        self.document_index(documents)
+        targets = {"pdf": target_pdf, "word": target_word}
+        ok = {doc_type: 0 for doc_type in targets}
+        for d in documents:
+            if d.get("downloaded") and not d.get("duplicate_of"):
+                ok[d["type"]] += 1
+
+        print(f"Already downloaded before run: PDF={ok['pdf']}, Word={ok['word']}")
+
+        pending = [(idx, doc) for idx, doc in enumerate(documents) if not doc.get("downloaded")]
+        in_flight: Dict[Future, tuple] = {}
+        running = {doc_type: 0 for doc_type in targets}
+
+        def submit_more(pool: ThreadPoolExecutor) -> None:
+            # מגישים רק כמה שחסר עד היעד (כולל מה שכבר בהורדה); מסמך שנכשל או כפול מפנה מקום לבא אחריו
+            while pending and len(in_flight) < self.concurrency:
+                for i, (idx, doc) in enumerate(pending):
+                    if ok[doc["type"]] + running[doc["type"]] < targets[doc["type"]]:
+                        del pending[i]
+                        break
                 else:
-                    word_ok += 1
-            else:
-                doc["failed_attempts"] = doc.get("failed_attempts", 0) + 1
+                    return
+
+                print(f"Downloading {idx + 1}/{len(documents)}: {canonical_filename(doc)} ({doc['type']})")
+                running[doc["type"]] += 1
+                in_flight[pool.submit(self.download_file, doc)] = (idx, doc)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="download") as pool:
+            submit_more(pool)
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx, doc = in_flight.pop(future)
+                    running[doc["type"]] -= 1
+                    result = future.result()
+                    if result == "failed":
+                        doc["failed_attempts"] = doc.get("failed_attempts", 0) + 1
+                    else:
+                        doc["downloaded"] = True
+                        if result == "duplicate":
+                            print(f"Same content as {doc['filename']}, not saved again: {doc['url']}")
+                        else:
+                            ok[doc["type"]] += 1
 
-            print(f"Status (downloaded): PDF={pdf_ok}/{target_pdf}, Word={word_ok}/{target_word}")
-            time.sleep(0.5)
+                    # כל מסמך נשמר מיד כשההורדה שלו מסתיימת
+                    self.store.put(doc)
+                    print(f"Status (downloaded): PDF={ok['pdf']}/{target_pdf}, Word={ok['word']}/{target_word}")
 
-        self.save_data(documents)
+                submit_more(pool)
 
         print("\nFinal status:")
-        print(f"PDF downloaded successfully: {pdf_ok}")
-        print(f"Word downloaded successfully: {word_ok}")
+        print(f"PDF downloaded successfully: {ok['pdf']}")
+        print(f"Word downloaded successfully: {ok['word']}")
 
         failed_docs = [d for d in documents if not d.get("downloaded")]
         if failed_docs:
@@ -216,13 +622,33 @@ class TabuVerdictScraper:
         else:
             print("All documents downloaded successfully (subject to availability).")
 
+    def refresh(self, documents: List[Dict]) -> Dict[str, int]:
+        # בדיקה חוזרת של כל מה שכבר הורד, ב-GET מותנה; רק מה שהשתנה נכתב ונרשם ב-changes.jsonl
+        self.document_index(documents)
+        downloaded = [d for d in documents if d.get("downloaded")]
+        print(f"Revalidating {len(downloaded)} downloaded documents...")
+
+        results: Dict[str, int] = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="refresh") as pool:
+            for doc, result in zip(downloaded, pool.map(self.download_file, downloaded)):
+                results[result] = results.get(result, 0) + 1
+                # מסמך שסומן בינתיים להורדה מחדש (כפילות של קובץ שנמחק) לא מסומן כמוכן
+                if result not in ("failed", "removed") and doc.get("filename"):
+                    doc["downloaded"] = True
+                self.store.put(doc)
+
+        print("Refresh: " + ", ".join(f"{name}={count}" for name, count in sorted(results.items())))
+        return results
+
 
-    def run(self, target_pdf: int = 50, target_word: int = 50, max_pages: int = 50):
+    def run(self, target_pdf: int = 50, target_word: int = 50, max_pages: int = 50, refresh: bool = False):
         existing_docs = self.load_data()
+        if refresh:
+            self.refresh(existing_docs)
 
-        downloaded_urls = {d["url"] for d in existing_docs if d.get("downloaded")}
-        pdf_ok = sum(1 for d in existing_docs if d.get("downloaded") and d["type"] == "pdf")
-        word_ok = sum(1 for d in existing_docs if d.get("downloaded") and d["type"] == "word")
+        downloaded_urls = self.store.downloaded_urls()
+        counts = self.store.downloaded_counts()
+        pdf_ok, word_ok = counts["pdf"], counts["word"]
 
         remaining_pdf = max(target_pdf - pdf_ok, 0)
         remaining_word = max(target_word - word_ok, 0)
@@ -238,15 +664,31 @@ class TabuVerdictScraper:
                 initial_pdf_count=0,
                 initial_word_count=0,
             )
-            existing_docs.extend(new_docs)
-            self.save_data(existing_docs)
+            # כתובת שכבר רשומה (ועוד לא הורדה) לא נכפלת
+            self.store.add_new(new_docs)
+            existing_docs = self.load_data()
 
         self.download_all(existing_docs, target_pdf, target_word)
 
 
 def main():
-    scraper = TabuVerdictScraper(output_dir="scraper/data")
-    scraper.run(target_pdf=50, target_word=50, max_pages=50)
+    parser = argparse.ArgumentParser(description="Collect and download verdicts from gov.il.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel downloads.")
+    parser.add_argument("--rate", type=float, default=2.0, help="Requests per second per host.")
+    parser.add_argument("--burst", type=int, default=2, help="Requests allowed at once before rate limiting.")
+    parser.add_argument(
+        "--refresh", action="store_true",
+        help="Revalidate already downloaded documents with conditional requests.",
+    )
+    args = parser.parse_args()
+
+    scraper = TabuVerdictScraper(
+        output_dir="scraper/data",
+        concurrency=args.concurrency,
+        rate_per_host=args.rate,
+        burst=args.burst,
+    )
+    scraper.run(target_pdf=50, target_word=50, max_pages=50, refresh=args.refresh)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,311 @@
+import json
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch, AsyncMock, MagicMock
+from fastapi.testclient import TestClient
+
+import api
+from scheduler import GenerationScheduler
+
+
+def wait_until_ready(client, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        resp = client.get("/health")
+        if resp.status_code == 200:
+            return resp
+        time.sleep(0.01)
+    return resp
+
+
+async def token_stream(tokens):
+    for token in tokens:
+        yield token
+
+
+class TestChatAPI(unittest.TestCase):
+    @patch('api.LegalRAGService')
+    def test_service_created_once(self, mock_service_cls):
+        service = MagicMock()
+        service.astream_answer = AsyncMock(side_effect=lambda *a, **kw: (token_stream(["תשובה"]), []))
+        mock_service_cls.return_value = service
+
+        with TestClient(api.app) as client:
+            wait_until_ready(client)
+            with patch.object(client.app.state.model_registry, "get") as mock_get:
+                mock_get.return_value = MagicMock()
+                for _ in range(3):
+                    resp = client.post("/chat", json={"question": "שאלה"})
+                    self.assertEqual(resp.status_code, 200)
+
+        mock_service_cls.assert_called_once()
+        service.warmup.assert_called_once()
+        self.assertEqual(service.astream_answer.await_count, 3)
+
+    @patch('api.LegalRAGService')
+    def test_streams_tokens_then_done(self, mock_service_cls):
+        service = MagicMock()
+        citations = [{"id": "[1]", "filename": "doc.pdf"}]
+        service.astream_answer = AsyncMock(return_value=(token_stream(["משפט ראשון", ". משפט שני", "."]), citations))
+        mock_service_cls.return_value = service
+
+        with TestClient(api.app) as client:
+            wait_until_ready(client)
+            with patch.object(client.app.state.model_registry, "get"):
+                resp = client.post("/chat", json={"question": "שאלה"})
+
+        events = [json.loads(line) for line in resp.text.splitlines() if line]
+        self.assertEqual([e["type"] for e in events], ["citations", "token", "token", "token", "done"])
+        self.assertEqual(events[0]["data"], citations)
+        self.assertEqual("".join(e["data"] for e in events if e["type"] == "token"), "משפט ראשון. משפט שני.")
+        self.assertEqual(events[-1]["data"]["chunks"], 3)
+        self.assertIn("first_token_ms", events[-1]["data"])
+
+    @patch('api.LegalRAGService')
+    def test_health_not_ready_until_warm(self, mock_service_cls):
+        service = MagicMock()
+        service.ready = False
+        service.warmup.side_effect = lambda: time.sleep(0.3)
+        mock_service_cls.return_value = service
+
+        with TestClient(api.app) as client:
+            resp = client.get("/health")
+            self.assertEqual(resp.status_code, 503)
+            self.assertFalse(resp.json()["ready"])
+
+            resp = client.post("/chat", json={"question": "שאלה"})
+            self.assertEqual(resp.status_code, 503)
+
+            service.ready = True
+            resp = wait_until_ready(client)
+            self.assertEqual(resp.json(), {"status": "ok", "ready": True})
+
+    @patch('api.LegalRAGService')
+    def test_metrics_endpoint(self, mock_service_cls):
+        service = MagicMock()
+        service.astream_answer = AsyncMock(side_effect=lambda *a, **kw: (token_stream(["א", "ב"]), []))
+        service.cache_stats.return_value = {
+            "answer": {"hits": 3, "misses": 1, "hit_rate": 0.75, "size": 2},
+        }
+        mock_service_cls.return_value = service
+
+        with TestClient(api.app) as client:
+            wait_until_ready(client)
+            before = api.metrics.REQUESTS.value(path="/chat", model_type="ollama", status="200")
+            with patch.object(client.app.state.model_registry, "get"):
+                client.post("/chat", json={"question": "שאלה"})
+            client.post("/chat", json={"question": "שאלה", "model_type": "nope"})
+            resp = client.get("/metrics")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(api.metrics.REQUESTS.value(path="/chat", model_type="ollama", status="200"), before + 1)
+        self.assertIn('rag_requests_total{path="/chat",model_type="unknown",status="400"}', resp.text)
+        self.assertIn('rag_cache_hit_ratio{cache="answer"} 0.75', resp.text)
+        self.assertIn("rag_first_token_seconds_bucket", resp.text)
+
+    @patch('api.LegalRAGService')
+    def test_unknown_model_type(self, mock_service_cls):
+        mock_service_cls.return_value = MagicMock()
+
+        with TestClient(api.app) as client:
+            wait_until_ready(client)
+            resp = client.post("/chat", json={"question": "שאלה", "model_type": "nope"})
+            self.assertEqual(resp.status_code, 400)
+
+    @patch('api.LegalRAGService')
+    def test_batch_streams_results_with_index(self, mock_service_cls):
+        async def answer_many(questions, chat_model=None, concurrency=4):
+            yield {"index": 1, "answer": "שנייה", "citations": []}
+            yield {"index": 0, "error": "timeout"}
+
+        service = MagicMock()
+        service.answer_many = MagicMock(side_effect=answer_many)
+        mock_service_cls.return_value = service
+
+        with TestClient(api.app) as client:
+            wait_until_ready(client)
+            batches = api.metrics.REQUEST_SECONDS.count(path="/chat/batch", model_type="ollama")
+            chats = api.metrics.REQUEST_SECONDS.count(path="/chat", model_type="ollama")
+            with patch.object(client.app.state.model_registry, "get"):
+                resp = client.post("/chat/batch", json={"questions": ["א", "ב"], "concurrency": 3})
+                self.assertEqual(client.post("/chat/batch", json={"questions": []}).status_code, 422)
+
+        events = [json.loads(line) for line in resp.text.splitlines() if line]
+        self.assertEqual([(e["type"], e.get("index")) for e in events], [("result", 1), ("error", 0), ("done", None)])
+        self.assertEqual(events[-1]["data"]["answered"], 1)
+        self.assertEqual(service.answer_many.call_args.kwargs["concurrency"], 3)
+        self.assertEqual(api.metrics.REQUEST_SECONDS.count(path="/chat/batch", model_type="ollama"), batches + 1)
+        self.assertEqual(api.metrics.REQUEST_SECONDS.count(path="/chat", model_type="ollama"), chats)
+
+
+    @patch('api.LegalRAGService')
+    def test_saturated_backend_fails_fast_with_retry_after(self, mock_service_cls):
+        async def astream_answer(question, chat_model=None):
+            # כמו השירות האמיתי: תשובה מוכנה לא תופסת מקום, אחרת reserve לפני שה-stream מוחזר
+            if question != "מוכנה":
+                await chat_model.reserve()
+            return token_stream(["תשובה"]), []
+
+        service = MagicMock()
+        service.astream_answer = AsyncMock(side_effect=astream_answer)
+        mock_service_cls.return_value = service
+
+        with TestClient(api.app) as client:
+            wait_until_ready(client)
+            scheduler = GenerationScheduler(max_queue=0, max_queue_seconds=1)
+            scheduler.configure("ollama", 1)
+            client.app.state.scheduler = scheduler
+            with patch.object(client.app.state.model_registry, "get"):
+                self.assertEqual(client.post("/chat", json={"question": "שאלה"}).status_code, 200)
+                self.assertEqual(scheduler.limiter("ollama").active, 0)
+
+                scheduler.limiter("ollama").active = 1
+                self.assertEqual(client.post("/chat", json={"question": "מוכנה"}).status_code, 200)
+                resp = client.post("/chat", json={"question": "שאלה"})
+
+        self.assertEqual(resp.status_code, 429)
+        self.assertGreaterEqual(int(resp.headers["retry-after"]), 1)
+        self.assertEqual(service.astream_answer.await_count, 3)
+
+    @patch('api.LegalRAGService')
+    def test_batch_concurrency_bounded_by_backend(self, mock_service_cls):
+        async def answer_many(questions, chat_model=None, concurrency=4):
+            yield {"index": 0, "answer": "תשובה", "citations": []}
+
+        service = MagicMock()
+        service.answer_many = MagicMock(side_effect=answer_many)
+        mock_service_cls.return_value = service
+
+        with TestClient(api.app) as client:
+            wait_until_ready(client)
+            scheduler = GenerationScheduler(max_queue=4, max_queue_seconds=1)
+            scheduler.configure("ollama", 2)
+            client.app.state.scheduler = scheduler
+            with patch.object(client.app.state.model_registry, "get"):
+                resp = client.post("/chat/batch", json={"questions": ["א"], "concurrency": 8})
+
+        self.assertEqual(resp.status_code, 200)
+        kwargs = service.answer_many.call_args.kwargs
+        self.assertEqual(kwargs["concurrency"], 2)
+        self.assertTrue(kwargs["chat_model"].patient)
+
+
+class TestFilesAPI(unittest.TestCase):
+    @patch('api.LegalRAGService')
+    def test_serves_indexed_files_with_etag_and_range(self, mock_service_cls):
+        with tempfile.TemporaryDirectory() as tmp:
+            docs_dir = Path(tmp) / "data"
+            docs_dir.mkdir()
+            verdict = docs_dir / "verdict_1_a.pdf"
+            verdict.write_bytes(b"%PDF-" + bytes(range(256)) * 40)
+            (docs_dir / "not_indexed.pdf").write_bytes(b"%PDF-")
+            manifest = Path(tmp) / "manifest.json"
+            entry = {"sha256": "ab" * 32, "size": 10245, "mtime": verdict.stat().st_mtime}
+            manifest.write_text(json.dumps({"files": {"verdict_1_a.pdf": entry}}))
+
+            with patch.object(api, "MANIFEST_PATH", manifest), patch.object(api, "DOCS_DIR", docs_dir), \
+                    patch.object(api, "PUBLIC_BASE_URL", "https://legal.example.com"):
+                with TestClient(api.app) as client:
+                    registry = client.app.state.file_registry
+                    self.assertEqual(registry.url_for("verdict_1_a.pdf"), "https://legal.example.com/api/files/verdict_1_a.pdf")
+
+                    resp = client.get("/api/files/verdict_1_a.pdf")
+                    self.assertEqual(resp.status_code, 200)
+                    self.assertEqual(len(resp.content), 10245)
+                    etag = resp.headers["etag"]
+                    self.assertEqual(etag, '"' + "ab" * 16 + '"')
+                    self.assertEqual(resp.headers["accept-ranges"], "bytes")
+
+                    record = registry.get("verdict_1_a.pdf")
+                    self.assertEqual(client.get(f"/api/files/{record.file_id}").status_code, 200)
+                    self.assertEqual(client.get("/api/files/verdict_1_a.pdf", headers={"If-None-Match": etag}).status_code, 304)
+
+                    resp = client.get("/api/files/verdict_1_a.pdf", headers={"Range": "bytes=0-4"})
+                    self.assertEqual(resp.status_code, 206)
+                    self.assertEqual(resp.content, b"%PDF-")
+                    self.assertEqual(resp.headers["content-range"], "bytes 0-4/10245")
+
+                    # קובץ בלי רשומה ב-manifest מוגש מ-DOCS_DIR, עם ETag מהגודל והתאריך
+                    resp = client.get("/api/files/not_indexed.pdf")
+                    self.assertEqual(resp.status_code, 200)
+                    self.assertEqual(resp.content, b"%PDF-")
+                    self.assertIn("-5-", resp.headers["etag"])
+                    self.assertEqual(client.get("/api/files/missing.pdf").status_code, 404)
+                    self.assertEqual(client.get("/api/files/..%2Fmanifest.json").status_code, 404)
+                    self.assertEqual(registry.url_for("missing.pdf"), "")
+
+                    # ה-scraper החליף את הקובץ לפני הבנייה הבאה – הגודל וה-ETag לפי הקובץ החדש
+                    verdict.write_bytes(b"%PDF-new")
+                    resp = client.get("/api/files/verdict_1_a.pdf", headers={"If-None-Match": etag})
+                    self.assertEqual(resp.status_code, 200)
+                    self.assertEqual(resp.content, b"%PDF-new")
+                    self.assertEqual(resp.headers["content-length"], "8")
+                    self.assertNotEqual(resp.headers["etag"], etag)
+
+                    verdict.unlink()
+                    self.assertEqual(client.get("/api/files/verdict_1_a.pdf").status_code, 404)
+
+    def test_files_without_manifest_are_served_from_docs_dir(self):
+        from file_registry import load_file_registry
+
+        with tempfile.TemporaryDirectory() as tmp:
+            docs_dir = Path(tmp) / "data"
+            docs_dir.mkdir()
+            (docs_dir / "doc_0_3-382-2024.pdf").write_bytes(b"%PDF-1")
+            (docs_dir / "sub").mkdir()
+            registry = load_file_registry(Path(tmp) / "manifest.json", docs_dir, "https://legal.example.com")
+
+            self.assertEqual(len(registry), 0)
+            record = registry.get("doc_0_3-382-2024.pdf")
+            self.assertEqual((record.size, record.path), (6, docs_dir / "doc_0_3-382-2024.pdf"))
+            self.assertIs(registry.get(record.file_id), record)
+            self.assertEqual(
+                registry.url_for("doc_0_3-382-2024.pdf"), "https://legal.example.com/api/files/doc_0_3-382-2024.pdf"
+            )
+            self.assertIsNone(registry.get("../manifest.json"))
+            self.assertIsNone(registry.get("sub"))
+
+
+class TestModelRegistry(unittest.TestCase):
+    def test_instances_cached_per_name(self):
+        from models.registry import ModelRegistry
+
+        factory = MagicMock(side_effect=lambda name: MagicMock(model_name=name))
+        registry = ModelRegistry()
+        registry.register("fake", factory, "default")
+
+        a = registry.get("fake")
+        b = registry.get("fake", "default")
+        c = registry.get("fake", "other")
+
+        self.assertIs(a, b)
+        self.assertIsNot(a, c)
+        self.assertEqual(factory.call_count, 2)
+
+    def test_client_supplied_names_are_bounded_and_closed(self):
+        from models.registry import ModelRegistry
+
+        created = {}
+        factory = MagicMock(side_effect=lambda name: created.setdefault(name, MagicMock(model_name=name)))
+        registry = ModelRegistry(max_instances=2)
+        registry.register("fake", factory, "default")
+
+        default = registry.get("fake")
+        a = registry.get("fake", "a")
+        registry.get("fake", "b")
+        registry.get("fake", "a")
+        registry.get("fake", "c")
+
+        # "b" הוא שלא נוצל הכי הרבה זמן; ברירת המחדל נשארת גם כשהיא הישנה ביותר
+        self.assertEqual(sorted(name for _, name in registry._instances), ["a", "c", "default"])
+        self.assertIs(registry.get("fake"), default)
+        self.assertIs(registry.get("fake", "a"), a)
+        created["b"].close.assert_called_once()
+        a.close.assert_not_called()
+        default.close.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
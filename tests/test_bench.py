@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from bench.fakes import FakeChatModel, HashingEmbeddings, make_corpus, make_questions
+from bench.run_bench import QUERY_STAGES, compare, run_benchmark
+from bench.vector_bench import run_vector_benchmark
+
+class TestBenchFakes(unittest.TestCase):
+    def test_corpus_and_questions_are_deterministic(self):
+        with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b:
+            cases_a = make_corpus(Path(a), 5, seed=3)
+            cases_b = make_corpus(Path(b), 5, seed=3)
+            self.assertEqual([c["path"].name for c in cases_a], [c["path"].name for c in cases_b])
+            self.assertEqual(cases_a[0]["path"].read_bytes(), cases_b[0]["path"].read_bytes())
+
+            questions = make_questions(cases_a, 10, seed=3)
+            self.assertEqual(questions, make_questions(cases_b, 10, seed=3))
+            self.assertEqual(len(set(questions)), len(questions))
+
+    def test_hashing_embeddings_are_normalized_and_stable(self):
+        embeddings = HashingEmbeddings()
+        a, b = embeddings.embed_documents(["רבוע כחול נדל\"ן", "רבוע כחול נדל\"ן"])
+        self.assertEqual(a, b)
+        self.assertAlmostEqual(sum(x * x for x in a), 1.0, places=5)
+
+    def test_fake_model_cites_sources(self):
+        messages = [{"role": "user", "content": "שאלה\nSource: תא/1234\nContent:\nטקסט"}]
+        self.assertIn("[1] (תא/1234)", FakeChatModel().generate(messages))
+
+class TestRunBenchmark(unittest.TestCase):
+    def test_reports_percentiles_per_stage(self):
+        results = run_benchmark(docs=6, queries=8, prefill_per_token=0.00001)
+
+        self.assertEqual(results["indexing"]["files"], 6)
+        self.assertGreater(results["indexing"]["chunks"], 6)
+        for stage in QUERY_STAGES:
+            summary = results["query"][stage]
+            self.assertEqual(summary["count"], 8)
+            self.assertLessEqual(summary["p50_ms"], summary["p95_ms"])
+            self.assertLessEqual(summary["p95_ms"], summary["p99_ms"])
+        self.assertGreater(results["query"]["vector_search"]["p50_ms"], 0)
+
+        self.assertNotIn("ttft", results)
+        ttft = results["ttft_simulated"]
+        self.assertTrue(ttft["simulated"])
+        self.assertNotIn("p50_speedup", ttft)
+        self.assertEqual(ttft["with_prefix_reuse"]["count"], 8)
+        self.assertGreater(ttft["with_prefix_reuse"]["cached_tokens"], ttft["without_prefix_reuse"]["cached_tokens"])
+
+    def test_numpy_vector_backend(self):
+        results = run_benchmark(docs=4, queries=4, prefill_per_token=0.00001, vector_backend="numpy")
+        self.assertEqual(results["config"]["vector_backend"], "numpy")
+        self.assertEqual(results["query"]["vector_search"]["count"], 4)
+
+    def test_compare_flags_slowdowns(self):
+        baseline = {"query": {"total": {"p50_ms": 10.0, "p95_ms": 20.0, "p99_ms": 30.0}}, "indexing": {"chunks_per_second": 100.0}}
+        current = {"query": {"total": {"p50_ms": 10.5, "p95_ms": 30.0, "p99_ms": 30.2}}, "indexing": {"chunks_per_second": 50.0}}
+
+        regressions = compare(baseline, current, threshold=0.1)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith("total p95_ms"))
+
+class TestVectorBenchmark(unittest.TestCase):
+    def test_recall_and_latency_per_backend(self):
+        results = run_vector_benchmark(vectors=1500, dim=16, queries=20, ks=(10,), clusters=8)
+
+        numpy_report = results["backends"]["numpy"]
+        self.assertEqual(numpy_report["recall@10"], 1.0)
+        self.assertEqual(numpy_report["batch_recall@10"], 1.0)
+        self.assertEqual(numpy_report["single_query"]["count"], 20)
+        for name in ("chroma", "hnsw"):
+            report = results["backends"][name]
+            if "skipped" not in report:
+                self.assertGreaterEqual(report["recall@10"], 0.8)
+
+if __name__ == '__main__':
+    unittest.main()
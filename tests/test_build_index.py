@@ -0,0 +1,253 @@
+import json
+import tempfile
+import time
+import unittest
+import zipfile
+import numpy as np
+from pathlib import Path
+from unittest.mock import patch
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import build_index
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def embed_documents(self, texts):
+        return [[float(len(t)), float(sum(map(ord, t)) % 101), 1.0] for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class TextLoader:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        text = Path(self.path).read_text(encoding="utf-8")
+        return [Document(page_content=text, metadata={"source": self.path})]
+
+class BrokenLoader(TextLoader):
+    def load(self):
+        raise ValueError("EOF marker not found")
+
+def write_docx(path, text):
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body><w:p><w:r><w:t>{text}</w:t></w:r></w:p></w:body></w:document>'
+    )
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("word/document.xml", xml)
+
+def slow_extract(path_str):
+    if path_str.endswith("stuck.docx"):
+        time.sleep(60)
+    return build_index.extract_file(path_str)
+
+class TestParallelExtraction(unittest.TestCase):
+    def test_parallel_output_is_ordered_and_timeouts_skip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i, name in enumerate(["doc_0_a.docx", "doc_1_stuck.docx", "doc_2_c.docx", "doc_3_d.docx"]):
+                path = Path(tmp) / name
+                write_docx(path, f"פסק דין מספר {i}")
+                paths.append(path)
+
+            start = time.perf_counter()
+            results = list(build_index.iter_extracted(paths, workers=2, file_timeout=5, extract=slow_extract))
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual([p.name for p, _ in results], ["doc_0_a.docx", "doc_1_stuck.docx", "doc_2_c.docx", "doc_3_d.docx"])
+        self.assertIsNone(results[1][1])
+        self.assertEqual(results[0][1][0].page_content, "פסק דין מספר 0")
+        self.assertEqual(results[0][1][0].metadata["display_name"], "a")
+        self.assertLess(elapsed, 30)
+
+class RecordingCollection:
+    def __init__(self):
+        self.calls = []
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.calls.append((ids, embeddings))
+
+class TestEmbeddingPipeline(unittest.TestCase):
+    def test_batches_are_normalized_float32_and_ordered(self):
+        chunks = [
+            Document(page_content=f"chunk {i}", metadata={"chunk_id": f"f#{i}"})
+            for i in range(5)
+        ]
+        collection = RecordingCollection()
+
+        stats = build_index.build_vector_store(chunks, collection, FakeEmbeddings(), batch_size=2)
+
+        self.assertEqual([ids for ids, _ in collection.calls], [["f#0", "f#1"], ["f#2", "f#3"], ["f#4"]])
+        vectors = collection.calls[0][1]
+        self.assertEqual(vectors.dtype, np.float32)
+        np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.0, rtol=1e-5)
+        self.assertEqual(stats["chunks"], 5)
+
+    def test_chunks_are_consumed_lazily(self):
+        collection = RecordingCollection()
+        max_ahead = 0
+
+        def chunks():
+            nonlocal max_ahead
+            for i in range(40):
+                written = sum(len(ids) for ids, _ in collection.calls)
+                max_ahead = max(max_ahead, i - written)
+                yield Document(page_content=f"chunk {i}", metadata={"chunk_id": f"f#{i}"})
+
+        stats = build_index.build_vector_store(chunks(), collection, FakeEmbeddings(), batch_size=2, queue_size=1)
+
+        self.assertEqual(stats["chunks"], 40)
+        # batch בקידוד + batch בתור + batch בכתיבה
+        self.assertLessEqual(max_ahead, 3 * 2)
+
+class TestIncrementalBuild(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        root = Path(self._tmp.name)
+        self.docs_dir = root / "data"
+        self.docs_dir.mkdir()
+        vector_dir = root / "vectorstore"
+
+        patches = [
+            patch.object(build_index, "DOCS_DIR", self.docs_dir),
+            patch.object(build_index, "VECTOR_DB_DIR", vector_dir),
+            patch.object(build_index, "MANIFEST_PATH", vector_dir / "manifest.json"),
+            patch.object(build_index, "CATALOG_PATH", vector_dir / "catalog.json"),
+            patch.object(build_index, "EMBEDDING_CACHE_DIR", vector_dir / "embedding_cache"),
+            patch.object(build_index, "HuggingFaceEmbeddings", FakeEmbeddings),
+            patch.object(build_index, "PyPDFLoader", TextLoader),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(self._tmp.cleanup)
+
+    def write(self, name, text):
+        (self.docs_dir / name).write_text(text, encoding="utf-8")
+
+    def stored_ids(self):
+        return set(build_index.open_vector_store().get()["ids"])
+
+    def test_only_changed_files_are_reindexed(self):
+        self.write("doc_0_a.pdf", "פסק דין ראשון")
+        self.write("doc_1_b.pdf", "פסק דין שני")
+        build_index.main(workers=1)
+        self.assertEqual(self.stored_ids(), {"doc_0_a.pdf#0", "doc_1_b.pdf#0"})
+
+        with patch.object(build_index, "iter_extracted", wraps=build_index.iter_extracted) as load:
+            build_index.main(workers=1)
+            load.assert_not_called()
+
+            self.write("doc_1_b.pdf", "פסק דין שני מעודכן")
+            (self.docs_dir / "doc_0_a.pdf").unlink()
+            self.write("doc_2_c.pdf", "פסק דין שלישי")
+            build_index.main(workers=1)
+
+            loaded = [p.name for p in load.call_args.args[0]]
+            self.assertEqual(loaded, ["doc_1_b.pdf", "doc_2_c.pdf"])
+
+        self.assertEqual(self.stored_ids(), {"doc_1_b.pdf#0", "doc_2_c.pdf#0"})
+        manifest = build_index.load_manifest()
+        self.assertEqual(sorted(manifest), ["doc_1_b.pdf", "doc_2_c.pdf"])
+        self.assertEqual(manifest["doc_2_c.pdf"]["chunk_ids"], ["doc_2_c.pdf#0"])
+        self.assertEqual(manifest["doc_2_c.pdf"]["size"], (self.docs_dir / "doc_2_c.pdf").stat().st_size)
+
+        stored = build_index.open_vector_store().get(ids=["doc_2_c.pdf#0"])["metadatas"][0]
+        self.assertEqual(stored["file_id"], manifest["doc_2_c.pdf"]["file_id"])
+
+        lexicon = build_index.LexicalIndex.load(build_index.VECTOR_DB_DIR / build_index.LexicalIndex.FILENAME)
+        self.assertNotIn("doc_0_a.pdf#0", lexicon)
+        self.assertIn("doc_2_c.pdf#0", lexicon)
+
+        catalog = build_index.Catalog.load(build_index.CATALOG_PATH)
+        self.assertEqual(sorted(catalog.entries), ["doc_1_b.pdf", "doc_2_c.pdf"])
+        self.assertEqual(catalog.entries["doc_1_b.pdf"]["summary"], "פסק דין שני מעודכן")
+
+    def test_numpy_backend_and_backend_switch(self):
+        self.write("doc_0_a.pdf", "פסק דין ראשון")
+        self.write("doc_1_b.pdf", "פסק דין שני")
+        build_index.main(workers=1, vector_backend="numpy")
+        index = build_index.open_vector_index("numpy")
+        self.assertEqual(sorted(index.ids), ["doc_0_a.pdf#0", "doc_1_b.pdf#0"])
+        self.assertEqual(index.get(["doc_1_b.pdf#0"])["doc_1_b.pdf#0"].page_content, "פסק דין שני")
+
+        (self.docs_dir / "doc_0_a.pdf").unlink()
+        build_index.main(workers=1, vector_backend="numpy")
+        self.assertEqual(build_index.open_vector_index("numpy").ids, ["doc_1_b.pdf#0"])
+        self.assertEqual(self.stored_ids(), set())
+
+        # manifest של backend אחר לא נחשב – Chroma נבנה מההתחלה
+        self.assertEqual(build_index.load_manifest(), {})
+        build_index.main(workers=1)
+        self.assertEqual(self.stored_ids(), {"doc_1_b.pdf#0"})
+
+    def log_change(self, event, name):
+        sha = build_index.file_sha256(self.docs_dir / name) if event != "removed" else None
+        with open(self.docs_dir / build_index.CHANGES_FILENAME, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"event": event, "filename": name, "sha256": sha}) + "\n")
+
+    def test_change_feed_replaces_hashing(self):
+        self.write("doc_0_a.pdf", "פסק דין ראשון")
+        self.write("doc_1_b.pdf", "פסק דין שני")
+        self.log_change("added", "doc_0_a.pdf")
+        self.log_change("added", "doc_1_b.pdf")
+        build_index.main(workers=1)
+        self.assertEqual(build_index.load_changes_offset(), (self.docs_dir / build_index.CHANGES_FILENAME).stat().st_size)
+
+        # שינוי שלא נרשם ביומן לא נראה עד --scan; רק מה שביומן נקרא מחדש, ושום קובץ לא מגובב
+        self.write("doc_1_b.pdf", "פסק דין שני מעודכן")
+        self.write("doc_2_c.pdf", "פסק דין שלישי")
+        self.log_change("added", "doc_2_c.pdf")
+        (self.docs_dir / "doc_0_a.pdf").unlink()
+        self.log_change("removed", "doc_0_a.pdf")
+
+        with patch.object(build_index, "iter_extracted", wraps=build_index.iter_extracted) as load, \
+                patch.object(build_index, "file_sha256", wraps=build_index.file_sha256) as digest:
+            build_index.main(workers=1)
+            self.assertEqual([p.name for p in load.call_args.args[0]], ["doc_2_c.pdf"])
+            digest.assert_not_called()
+
+            build_index.main(workers=1, scan=True)
+            self.assertEqual([p.name for p in load.call_args.args[0]], ["doc_1_b.pdf"])
+
+        self.assertEqual(sorted(build_index.load_manifest()), ["doc_1_b.pdf", "doc_2_c.pdf"])
+        self.assertEqual(self.stored_ids(), {"doc_1_b.pdf#0", "doc_2_c.pdf#0"})
+
+    def test_failed_extraction_keeps_old_chunks_and_retries(self):
+        self.write("doc_0_a.pdf", "פסק דין ראשון")
+        self.log_change("added", "doc_0_a.pdf")
+        build_index.main(workers=1)
+        before = build_index.load_manifest()["doc_0_a.pdf"]
+
+        self.write("doc_0_a.pdf", "פסק דין ראשון מעודכן")
+        self.write("doc_1_b.pdf", "פסק דין שני")
+        self.log_change("changed", "doc_0_a.pdf")
+        self.log_change("added", "doc_1_b.pdf")
+        with patch.object(build_index, "PyPDFLoader", BrokenLoader):
+            build_index.main(workers=1)
+
+        manifest = build_index.load_manifest()
+        self.assertEqual(manifest["doc_0_a.pdf"]["sha256"], before["sha256"])
+        self.assertEqual(manifest["doc_0_a.pdf"]["chunk_ids"], ["doc_0_a.pdf#0"])
+        self.assertNotIn("sha256", manifest["doc_1_b.pdf"])
+        self.assertEqual(self.stored_ids(), {"doc_0_a.pdf#0"})
+
+        # היומן כבר נקרא, אבל שני הקבצים עדיין מסומנים לניסיון חוזר
+        with patch.object(build_index, "iter_extracted", wraps=build_index.iter_extracted) as load:
+            build_index.main(workers=1)
+            self.assertEqual([p.name for p in load.call_args.args[0]], ["doc_0_a.pdf", "doc_1_b.pdf"])
+
+        manifest = build_index.load_manifest()
+        self.assertNotIn("failed_sha256", manifest["doc_0_a.pdf"])
+        self.assertEqual(manifest["doc_1_b.pdf"]["chunk_ids"], ["doc_1_b.pdf#0"])
+        stored = build_index.open_vector_store().get(ids=["doc_0_a.pdf#0"])["documents"]
+        self.assertEqual(stored, ["פסק דין ראשון מעודכן"])
+
+if __name__ == '__main__':
+    unittest.main()
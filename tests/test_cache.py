@@ -0,0 +1,42 @@
+import unittest
+from cache import TTLCache, normalize_text
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestTTLCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_ttl_expiry_and_counters(self):
+        clock = FakeClock()
+        cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+        cache.set("q", "answer")
+        self.assertEqual(cache.get("q"), "answer")
+
+        clock.now = 6
+        self.assertIsNone(cache.get("q"))
+        self.assertEqual(len(cache), 0)
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text("  מה נפסק  בעניין?? "), normalize_text("מה נפסק בעניין"))
+        self.assertEqual(normalize_text('נדל"ן בע"מ'), "נדלן בעמ")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from langchain_core.documents import Document
+
+from catalog import Catalog, find_verdict_date, format_answer, is_catalog_question, parse_metadata_date, parse_question
+from rag_service import LegalRAGService
+
+
+def pages(display_name, text, **metadata):
+    return [Document(page_content=text, metadata={"display_name": display_name, **metadata})]
+
+
+def sample_catalog():
+    catalog = Catalog()
+    catalog.add("a.docx", pages("תא/100-01-20", "תביעה בעניין ליקויי בנייה. ניתן היום, 3.2.2020."))
+    catalog.add("b.docx", pages("עא/200-05-23", "ערעור בעניין לשון הרע. ניתן היום, 14 במאי 2023."))
+    catalog.add("c.pdf", pages("תא/300-07-21", "ליקויי בנייה בדירה", creationdate="D:20210709101500+03'00'", total_pages=12))
+    catalog.add("d.docx", pages("תא/400", "מסמך בלי תאריך"))
+    catalog.add("e.pdf", pages("8-644-2023", "התובעת ביקשה לבטל את המשכנתא. המשכנתא נרשמה על הדירה. ניתן היום, 1.3.2023."))
+    return catalog
+
+
+class TestCatalogEntries(unittest.TestCase):
+    def test_dates(self):
+        self.assertEqual(parse_metadata_date("D:20210709101500+03'00'"), "2021-07-09")
+        self.assertEqual(parse_metadata_date("2021-07-09T10:15:00+03:00"), "2021-07-09")
+        self.assertIsNone(parse_metadata_date(""))
+        # תאריך הדיון בתחילת הטקסט, תאריך מתן פסק הדין בסופו
+        self.assertEqual(find_verdict_date("דיון ביום 1.1.2019. ניתן היום, 5 במרץ 2020"), "2020-03-05")
+
+    def test_entry_fields(self):
+        entries = sample_catalog().entries
+        self.assertEqual(entries["b.docx"]["date"], "2023-05-14")
+        self.assertEqual(entries["c.pdf"]["date"], "2021-07-09")
+        self.assertEqual(entries["c.pdf"]["pages"], 12)
+        self.assertIsNone(entries["a.docx"]["pages"])
+        self.assertIsNone(entries["d.docx"]["date"])
+
+    def test_save_computes_topics(self):
+        catalog = sample_catalog()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "catalog.json"
+            catalog.save(path)
+            loaded = Catalog.load(path)
+        self.assertEqual(len(loaded), 5)
+        self.assertIn("לשון", loaded.entries["b.docx"]["topics"])
+        # הנושאים מוצגים כפי שהם כתובים בטקסט, לא בצורה אחרי הסרת אות שימוש ("שכנתא")
+        self.assertIn("המשכנתא", loaded.entries["e.pdf"]["topics"])
+        self.assertNotIn("שכנתא", loaded.entries["e.pdf"]["topics"])
+
+
+class TestCatalogQuery(unittest.TestCase):
+    def test_sorted_filtered_and_paginated(self):
+        catalog = sample_catalog()
+        total, entries = catalog.query()
+        self.assertEqual(total, 5)
+        self.assertEqual([e["filename"] for e in entries], ["b.docx", "e.pdf", "c.pdf", "a.docx", "d.docx"])
+
+        total, entries = catalog.query(newest_first=False, offset=1, limit=2)
+        self.assertEqual([e["filename"] for e in entries], ["c.pdf", "e.pdf"])
+
+        total, entries = catalog.query(terms=["ליקויי"])
+        self.assertEqual([e["filename"] for e in entries], ["c.pdf", "a.docx"])
+        self.assertEqual(catalog.query(year=2023)[0], 2)
+
+    def test_parse_question(self):
+        catalog = sample_catalog()
+        latest = parse_question("מה פסק הדין האחרון מבחינת התאריך?", catalog)
+        self.assertEqual((latest.limit, latest.newest_first, latest.terms), (1, True, []))
+
+        listing = parse_question("איזה פסקי דין יש במאגר על ליקויי בנייה? עמוד 2", catalog, page_size=10)
+        self.assertEqual(len(listing.terms), 2)
+        self.assertEqual([e["filename"] for e in catalog.query(listing.terms)[1]], ["c.pdf", "a.docx"])
+        self.assertEqual((listing.offset, listing.limit), (10, 10))
+
+        self.assertEqual(parse_question("כמה פסקי דין משנת 2023?", catalog).year, 2023)
+        self.assertEqual(parse_question("כמה פסקי דין משנת 2023?", catalog).unmatched, [])
+        self.assertEqual(parse_question("איזה פסקי דין עוסקים בגירושין?", catalog).unmatched, ["גירושין"])
+
+    def test_page_hint_leads_to_the_next_page(self):
+        catalog = sample_catalog()
+        first = parse_question("איזה פסקי דין יש במאגר?", catalog, page_size=2)
+        total, entries = catalog.query(first.terms, first.year, first.newest_first, first.offset, first.limit)
+        hint = format_answer(first, total, entries).splitlines()[-1]
+        self.assertIn("\"עמוד 2\"", hint)
+
+        follow_up = "תן לי עמוד 2"
+        self.assertTrue(is_catalog_question(follow_up))
+        second = parse_question(follow_up, catalog, page_size=2)
+        self.assertEqual((second.terms, second.offset), ([], 2))
+
+        catalog.add("f.docx", pages("תא/500-02-22", "ליקויי בנייה במרפסת. ניתן היום, 2.2.2022."))
+        filtered = parse_question("איזה פסקי דין יש במאגר על ליקויי בנייה?", catalog, page_size=2)
+        total, entries = catalog.query(filtered.terms, filtered.year, filtered.newest_first, filtered.offset, filtered.limit)
+        self.assertIn("שאל שוב", format_answer(filtered, total, entries))
+
+    def test_catalog_intent(self):
+        for question in ("איזה פסקי דין יש במאגר?", "כמה פסקי דין משנת 2023?", "מה פסק הדין האחרון מבחינת התאריך?",
+                         "תן לי רשימה של פסקי הדין", "מה יש במאגר?", "עמוד 2", "תן לי עמוד 2"):
+            self.assertTrue(is_catalog_question(question), question)
+        for question in ("מה פסק בית המשפט בעניין רבוע כחול?", "מה פסק הדין בתיק 8-644-2023 קבע לגבי המשכנתא?",
+                         "תן לי רשימה של הטענות של התובעת", "מה פסק הדין האחרון בתיק 8-644-2023?",
+                         "מה כתוב בעמוד 3 של פסק הדין?"):
+            self.assertFalse(is_catalog_question(question), question)
+
+
+class TestServiceCatalogAnswers(unittest.TestCase):
+    @patch('rag_service.chromadb')
+    @patch('rag_service.Chroma')
+    @patch('rag_service.HuggingFaceEmbeddings')
+    @patch('rag_service.VECTOR_DB_DIR')
+    def test_general_questions_skip_retrieval_and_model(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb):
+        mock_dir.exists.return_value = True
+        retriever = mock_chroma.return_value.as_retriever.return_value
+        chat = MagicMock()
+
+        service = LegalRAGService(chat_model=chat)
+        service.catalog = sample_catalog()
+
+        answer, citations = service.answer("מה פסק הדין האחרון מבחינת התאריך?")
+        self.assertIn("עא/200-05-23", answer)
+        self.assertEqual([c["filename"] for c in citations], ["עא/200-05-23"])
+
+        stream, citations = service.stream_answer("איזה פסקי דין יש במאגר?")
+        self.assertTrue("".join(stream).startswith("במאגר 5 פסקי דין"))
+        self.assertEqual(len(citations), 5)
+
+        retriever.invoke.assert_not_called()
+        chat.generate.assert_not_called()
+        chat.stream.assert_not_called()
+
+    @patch('rag_service.chromadb')
+    @patch('rag_service.Chroma')
+    @patch('rag_service.HuggingFaceEmbeddings')
+    @patch('rag_service.VECTOR_DB_DIR')
+    def test_specific_questions_go_to_rag(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb):
+        mock_dir.exists.return_value = True
+        service = LegalRAGService(chat_model=MagicMock())
+        service.catalog = sample_catalog()
+
+        for question in (
+            "מה פסק בית המשפט בעניין רבוע כחול?",
+            "מה פסק הדין בתיק 8-644-2023 קבע לגבי המשכנתא?",
+            "תן לי רשימה של הטענות של התובעת",
+            # מילה שהקטלוג לא מכיר, או סינון שלא מוצא אף פסק דין
+            "איזה פסקי דין עוסקים בגירושין?",
+            "כמה פסקי דין משנת 2019?",
+        ):
+            self.assertIsNone(service._catalog_answer(question), question)
+
+if __name__ == '__main__':
+    unittest.main()
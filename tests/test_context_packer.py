@@ -0,0 +1,84 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from langchain_core.documents import Document
+
+from build_index import assign_chunk_ids, make_text_splitter
+from context_packer import merge_chunks, pack_context, strip_overlap
+from models.base import ChatModel, estimate_tokens
+from rag_service import LegalRAGService
+
+def verdict_chunks(name, sentences=80):
+    text = " ".join(f"משפט מספר {i} בפסק הדין של {name}." for i in range(sentences))
+    chunks = make_text_splitter().split_documents([Document(page_content=text, metadata={"filename": name})])
+    assign_chunk_ids(chunks)
+    return text, chunks
+
+class TestContextPacker(unittest.TestCase):
+    def test_merging_adjacent_chunks_drops_overlap(self):
+        text, chunks = verdict_chunks("a.pdf")
+        self.assertGreater(len(chunks), 2)
+        self.assertIn(chunks[1].page_content[:50], chunks[0].page_content)
+
+        merged = merge_chunks(list(reversed(chunks)))
+        self.assertEqual(merged.page_content, text)
+        self.assertEqual(merged.metadata["chunk_ids"], [c.metadata["chunk_id"] for c in chunks])
+
+    def test_non_adjacent_chunks_are_marked_as_gap(self):
+        _, chunks = verdict_chunks("a.pdf")
+        merged = merge_chunks([chunks[0], chunks[2]])
+        self.assertIn("\n...\n", merged.page_content)
+
+    def test_strip_overlap_without_overlap(self):
+        self.assertEqual(strip_overlap("אבג", "דהו"), "דהו")
+
+    def test_packs_best_chunks_within_budget(self):
+        _, a = verdict_chunks("a.pdf")
+        _, b = verdict_chunks("b.pdf")
+        ranked = [a[0], b[0], a[1], b[1], a[2], b[2]]
+        budget = estimate_tokens(a[0].page_content) * 3
+
+        packed = pack_context(ranked, budget)
+
+        self.assertLessEqual(packed.used_tokens, budget)
+        self.assertEqual([d.metadata["filename"] for d in packed.docs], ["a.pdf", "b.pdf"])
+        self.assertEqual(packed.used_chunks + packed.dropped_chunks, len(ranked))
+        self.assertGreater(packed.dropped_tokens, 0)
+        self.assertEqual(packed.report()["documents"], 2)
+
+    def test_truncates_when_nothing_fits(self):
+        _, chunks = verdict_chunks("a.pdf")
+        packed = pack_context(chunks[:1], 100)
+        self.assertEqual(len(packed.docs), 1)
+        self.assertLess(len(packed.docs[0].page_content), len(chunks[0].page_content))
+        self.assertLessEqual(packed.used_tokens, 100)
+
+class SmallModel(ChatModel):
+    context_window = 2048
+
+    def generate(self, messages):
+        return "תשובה"
+
+class TestServicePacking(unittest.TestCase):
+    @patch('rag_service.chromadb')
+    @patch('rag_service.Chroma')
+    @patch('rag_service.HuggingFaceEmbeddings')
+    @patch('rag_service.VECTOR_DB_DIR')
+    def test_prompt_fits_model_window(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb):
+        mock_dir.exists.return_value = True
+        mock_db_instance = MagicMock()
+        mock_retriever = MagicMock()
+        _, a = verdict_chunks("a.pdf", sentences=200)
+        mock_retriever.invoke.return_value = a
+        mock_db_instance.as_retriever.return_value = mock_retriever
+        mock_chroma.return_value = mock_db_instance
+
+        model = SmallModel()
+        service = LegalRAGService(chat_model=model)
+        messages, citations = service._prepare("פסק הדין", model)
+
+        prompt_tokens = sum(model.count_tokens(m["content"]) for m in messages)
+        self.assertLessEqual(prompt_tokens + model.max_output_tokens, model.context_window)
+        self.assertEqual(len(citations), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,7 @@ def debug_all_chunks_of_doc():
     filename_target = "doc_9_eO5c8v1ktT5n9Cq8GLP6hpyZf0JZmfVsA7P5dbAKwjQ=.pdf"
     query = "test" # Dummy query just to get docs
     
-    raw_docs = service.retriever.invoke(query)
+    raw_docs = service.vector_index.search(query)
     
     print(f"Scanning {len(raw_docs)} chunks for {filename_target}...")
     
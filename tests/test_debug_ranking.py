@@ -21,7 +21,7 @@ def debug_ranking():
             print("   *** TARGET FOUND IN TOP 8! ***")
             
     print("\n--- Deep Dive into Scoring ---")
-    raw_docs = service.retriever.invoke(query)
+    raw_docs = service.vector_index.search(query)
     print(f"Raw retrieval count: {len(raw_docs)}")
     
     target_doc = None
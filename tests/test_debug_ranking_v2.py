@@ -19,7 +19,7 @@ def debug_ranking_logic():
     
     print(f"Filtered Query Words: {words}")
     
-    docs = service.retriever.invoke(query)
+    docs = service.vector_index.search(query)
     print(f"Raw docs retrieved: {len(docs)}")
     
     top_doc = docs[0]
@@ -12,7 +12,7 @@ def debug_specific_file():
     
     print(f"Checking if '{filename}' is retrieved for query: '{query}'")
     
-    service.retriever.search_kwargs['k'] = 100
+    service.vector_index.retriever.search_kwargs['k'] = 100
     docs = service.retrieve(query)
     
     found_rank = -1
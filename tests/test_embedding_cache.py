@@ -0,0 +1,108 @@
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from embedding_cache import CachedEmbeddings, DiskEmbeddingStore
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), float(sum(map(ord, t)) % 97), 1.0] for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+class TestCachedEmbeddings(unittest.TestCase):
+    def test_normalized_queries_skip_model(self):
+        base = CountingEmbeddings()
+        embeddings = CachedEmbeddings(base)
+
+        first = embeddings.embed_query("מה נפסק?")
+        second = embeddings.embed_query("  מה   נפסק ")
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(base.calls), 1)
+        self.assertEqual(embeddings.stats()["hits"], 1)
+
+    def test_batch_embeds_only_misses_once(self):
+        base = CountingEmbeddings()
+        embeddings = CachedEmbeddings(base)
+        embeddings.embed_query("א")
+
+        vectors = embeddings.embed_queries(["א", "ב", "ב", "ג"])
+
+        self.assertEqual(len(vectors), 4)
+        self.assertEqual(base.calls[-1], ["ב", "ג"])
+
+    def test_memory_is_bounded(self):
+        embeddings = CachedEmbeddings(CountingEmbeddings(), max_entries=2)
+        embeddings.embed_documents(["a", "b", "c"])
+        self.assertEqual(embeddings.stats()["memory_entries"], 2)
+
+    def test_disk_cache_survives_restart_and_grows(self):
+        with tempfile.TemporaryDirectory() as tmp, patch.object(DiskEmbeddingStore, "INITIAL_CAPACITY", 2):
+            first = CachedEmbeddings(CountingEmbeddings(), disk_dir=tmp, model_name="m")
+            expected = first.embed_documents(["a", "bb", "ccc", "dddd", "eeeee"])
+
+            base = CountingEmbeddings()
+            second = CachedEmbeddings(base, disk_dir=tmp, model_name="m")
+            self.assertEqual(second.embed_documents(["a", "bb", "ccc", "dddd", "eeeee"]), expected)
+            self.assertEqual(base.calls, [])
+
+            other_model = CachedEmbeddings(base, disk_dir=tmp, model_name="other")
+            other_model.embed_documents(["a"])
+            self.assertEqual(base.calls, [["a"]])
+
+    def test_disk_reads_while_store_grows(self):
+        with tempfile.TemporaryDirectory() as tmp, patch.object(DiskEmbeddingStore, "INITIAL_CAPACITY", 2):
+            store = DiskEmbeddingStore(tmp, dim=4)
+            store.put_many({"k0": np.zeros(4, dtype=np.float32)})
+            errors = []
+            done = threading.Event()
+
+            def read():
+                while not done.is_set():
+                    try:
+                        self.assertEqual(store.get("k0").tolist(), [0.0] * 4)
+                    except Exception as e:
+                        errors.append(e)
+                        return
+
+            readers = [threading.Thread(target=read) for _ in range(4)]
+            for reader in readers:
+                reader.start()
+            # כל הוספה כאן מכפילה את המיפוי כמה פעמים
+            for i in range(1, 300):
+                store.put_many({f"k{i}": np.full(4, i, dtype=np.float32)})
+            done.set()
+            for reader in readers:
+                reader.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(store.get("k299").tolist(), [299.0] * 4)
+
+    def test_two_writers_on_one_directory_get_distinct_rows(self):
+        # כמו ה-API ו-build_index.py עם אותו EMBEDDING_CACHE_DIR
+        with tempfile.TemporaryDirectory() as tmp, patch.object(DiskEmbeddingStore, "INITIAL_CAPACITY", 2):
+            api_store = DiskEmbeddingStore(tmp, dim=4)
+            build_store = DiskEmbeddingStore(tmp, dim=4)
+            api_store.put_many({"query-A": np.full(4, 1, dtype=np.float32)})
+            build_store.put_many({"chunk-B": np.full(4, 2, dtype=np.float32)})
+            build_store.put_many({f"chunk-{i}": np.full(4, i, dtype=np.float32) for i in range(10, 15)})
+            api_store.put_many({"query-C": np.full(4, 3, dtype=np.float32), "chunk-B": np.zeros(4, dtype=np.float32)})
+
+            self.assertEqual(build_store.get("query-A").tolist(), [1.0] * 4)
+            self.assertEqual(api_store.get("chunk-14").tolist(), [14.0] * 4)
+            fresh = DiskEmbeddingStore(tmp, dim=4)
+            self.assertEqual(len(fresh), 8)
+            self.assertEqual(fresh.get("query-A").tolist(), [1.0] * 4)
+            self.assertEqual(fresh.get("chunk-B").tolist(), [2.0] * 4)
+            self.assertEqual(fresh.get("query-C").tolist(), [3.0] * 4)
+
+if __name__ == '__main__':
+    unittest.main()
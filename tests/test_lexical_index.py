@@ -0,0 +1,143 @@
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from langchain_core.documents import Document
+from lexical_index import ChunkFeatures, HeuristicQuery, LexicalIndex, heuristic_score, query_terms
+
+
+def baseline_score(content, words, bigrams):
+    # הסריקה המקורית ב-retrieve, לפני האינדקס
+    score = 0.0
+    for word in words:
+        if word in content:
+            score += 2.0
+        if word[::-1] in content:
+            score += 2.0
+        if len(word) > 3 and word in content.replace(" ", ""):
+            score += 0.5
+    for bg in bigrams:
+        if bg in content:
+            score += 5.0
+        if bg[::-1] in content:
+            score += 5.0
+    return score
+
+
+class TestLexicalIndex(unittest.TestCase):
+    def test_query_terms_strip_prefix_and_stop_words(self):
+        self.assertEqual(query_terms("מה נפסק בעניין של רבוע כחול?"), ["נפסק", "עניין", "רבוע", "כחול"])
+
+    def test_heuristic_matches_words_bigrams_and_reversed(self):
+        features = ChunkFeatures.from_text("התובעת רבוע כחול נדל\"ן הגישה תביעה")
+        self.assertEqual(heuristic_score(features, ["רבוע", "כחול"], ["רבוע כחול"]), 2 + 2 + 0.5 + 0.5 + 5)
+
+        reversed_features = ChunkFeatures.from_text("לוחכ עובר")
+        self.assertEqual(heuristic_score(reversed_features, ["רבוע", "כחול"], ["רבוע כחול"]), 2 + 2 + 5)
+
+    def test_matches_baseline_on_reversed_prefixed_and_broken_words(self):
+        cases = [
+            ("חוזה", "םכסהה תוריכש הזוחב"),
+            ("מקרקעין", "בהתאם למקרקעין"),
+            ("הפרת חוזה", "התובעת טענה להפרת חוזה שכירות בנכס"),
+            ("מקרקעין", "בעניין המקר קעין"),
+            ("תביעה נגד החברה", "הוגשה בתביעה נגד החברה"),
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            index = LexicalIndex(Path(tmp) / LexicalIndex.FILENAME)
+            for i, (question, content) in enumerate(cases):
+                index.add(f"c{i}", content)
+            index.save()
+
+            for i, (question, content) in enumerate(cases):
+                words = query_terms(question)
+                bigrams = [" ".join(words[j:j + 2]) for j in range(len(words) - 1)]
+                query = HeuristicQuery(words, bigrams)
+                expected = baseline_score(content, words, bigrams)
+                [indexed] = index.features_many([Document(page_content="", metadata={"chunk_id": f"c{i}"})], query.terms, query.pairs)
+                self.assertEqual(query.score(indexed), expected, question)
+                self.assertEqual(query.score(ChunkFeatures.from_text(content)), expected, question)
+            index.close()
+
+        self.assertEqual(baseline_score("םכסהה תוריכש הזוחב", ["חוזה", "כירות"], ["חוזה כירות"]), 4)
+        self.assertEqual(baseline_score("בהתאם למקרקעין", ["קרקעין"], []), 2.5)
+
+    def test_set_lookup_differs_from_substring_scan(self):
+        # הסריקה המקורית מצאה גם חלק של מילה; הבדיקה בקבוצות משווה מילים שלמות (אחרי הסרת אותיות שימוש)
+        self.assertEqual(baseline_score("רבועכחול נדל\"ן", ["רבוע", "כחול"], ["רבוע כחול"]), 5)
+        self.assertEqual(heuristic_score(ChunkFeatures.from_text("רבועכחול נדל\"ן"), ["רבוע", "כחול"], ["רבוע כחול"]), 0)
+
+        # "שכירות" נחתכת ל-"כירות" בשאלה; המילה ההפוכה בטקסט נמצאת עם אות השימוש שלה, וכך גם הצמד ההפוך
+        words = query_terms("חוזה שכירות")
+        self.assertEqual(words, ["חוזה", "כירות"])
+        self.assertEqual(baseline_score("םכסהה תוריכש הזוחב", words, ["חוזה כירות"]), 4)
+        self.assertEqual(heuristic_score(ChunkFeatures.from_text("םכסהה תוריכש הזוחב"), words, ["חוזה כירות"]), 9)
+        content = "התובעת טענה להפרת חוזה שכירות בנכס"
+        self.assertEqual(baseline_score(content, ["חוזה", "כירות"], ["חוזה כירות"]), 5)
+        self.assertEqual(heuristic_score(ChunkFeatures.from_text(content), ["חוזה", "כירות"], ["חוזה כירות"]), 10)
+
+    def test_bm25_prefers_rarer_terms(self):
+        index = LexicalIndex()
+        index.add("a#0", "רבוע כחול חברה")
+        index.add("b#0", "חברה חברה אחרת")
+        index.add("c#0", "חברה שלישית")
+
+        idfs = index.idfs(["רבוע", "חברה"])
+        self.assertGreater(idfs["רבוע"], idfs["חברה"])
+        docs = [Document(page_content="", metadata={"chunk_id": chunk_id}) for chunk_id in ("a#0", "b#0")]
+        features_a, features_b = index.features_many(docs, idfs)
+        self.assertEqual(features_b.term_freqs, {"חברה": 2})
+        self.assertEqual(index.bm25(features_a, idfs), index.bm25(ChunkFeatures.from_text("רבוע כחול חברה"), idfs))
+        self.assertGreater(index.bm25(features_a, idfs), index.bm25(features_b, idfs))
+
+    def test_search_uses_postings(self):
+        index = LexicalIndex()
+        index.add("a#0", "התובעת רבוע כחול נדל\"ן בע\"מ")
+        index.add("b#0", "חברה אחרת")
+        index.add("c#0", "עוד חברה, ובכחול")
+
+        hits = index.search(query_terms('רבוע כחול נדל"ן'), k=5)
+        self.assertEqual(hits[0][0], "a#0")
+        self.assertNotIn("b#0", [chunk_id for chunk_id, _ in hits])
+
+    def test_save_load_and_remove(self):
+        index = LexicalIndex()
+        index.add("a#0", "רבוע כחול")
+        index.add("b#0", "חברה אחרת")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / LexicalIndex.FILENAME
+            index.save(path)
+            loaded = LexicalIndex.load(path)
+
+            self.assertEqual(len(loaded), 2)
+            [features] = loaded.features_many([Document(page_content="", metadata={"chunk_id": "a#0"})], ["רבוע"], ["רבוע כחול"])
+            self.assertEqual((features.length, features.pairs), (2, {"רבוע כחול"}))
+            self.assertEqual(loaded.search(["רבוע"]), index.search(["רבוע"]))
+
+            loaded.remove("a#0")
+            self.assertNotIn("a#0", loaded)
+            self.assertEqual(loaded.idf("רבוע"), loaded.idf("לא-קיים"))
+            loaded.close()
+
+        self.assertEqual(len(LexicalIndex.load(Path("does-not-exist.db"))), 0)
+
+    def test_old_format_is_not_loaded(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / LexicalIndex.FILENAME
+            conn = sqlite3.connect(str(path))
+            conn.execute("CREATE TABLE chunks (id INTEGER PRIMARY KEY, chunk_id TEXT, length INTEGER, reversed TEXT, compact TEXT)")
+            conn.execute("INSERT INTO chunks VALUES (1, 'a#0', 2, '', '')")
+            conn.commit()
+            conn.close()
+
+            self.assertFalse(LexicalIndex.is_current(path))
+            self.assertEqual(len(LexicalIndex.load(path)), 0)
+            rebuilt = LexicalIndex(path)
+            rebuilt.add("a#0", "רבוע כחול")
+            rebuilt.save()
+            rebuilt.close()
+            self.assertTrue(LexicalIndex.is_current(path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import time
+import unittest
+
+import metrics
+from metrics import MetricsRegistry, span, start_trace
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_prometheus_text_format(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("requests_total", "Requests.", ["model_type"])
+        histogram = registry.histogram("latency_seconds", "Latency.", ["stage"], buckets=(0.1, 1.0))
+
+        counter.inc(model_type="ollama")
+        counter.inc(2, model_type="ollama")
+        histogram.observe(0.05, stage="embed")
+        histogram.observe(0.5, stage="embed")
+        histogram.observe(5.0, stage="embed")
+
+        text = registry.render()
+        self.assertIn("# TYPE requests_total counter", text)
+        self.assertIn('requests_total{model_type="ollama"} 3.0', text)
+        self.assertIn('latency_seconds_bucket{stage="embed",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{stage="embed",le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{stage="embed",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count{stage="embed"} 3', text)
+
+    def test_label_names_are_enforced(self):
+        counter = MetricsRegistry().counter("c", "C.", ["a"])
+        with self.assertRaises(ValueError):
+            counter.inc(b="x")
+
+class TestSpans(unittest.TestCase):
+    def test_nested_span_is_excluded_from_parent(self):
+        trace = start_trace()
+        with span("vector_search"):
+            time.sleep(0.02)
+            with span("embed"):
+                time.sleep(0.05)
+
+        self.assertGreaterEqual(trace.stages["embed"], 0.05)
+        self.assertLess(trace.stages["vector_search"], 0.05)
+        self.assertGreater(metrics.STAGE_SECONDS.count(stage="embed"), 0)
+
+    def test_trace_dict_for_logging(self):
+        trace = start_trace(model_type="ollama")
+        trace.add("completion_tokens", 3)
+        trace.record("generation", 0.25)
+
+        data = trace.to_dict()
+        self.assertEqual(data["model_type"], "ollama")
+        self.assertEqual(data["completion_tokens"], 3)
+        self.assertEqual(data["stages_ms"], {"generation": 250.0})
+
+if __name__ == '__main__':
+    unittest.main()
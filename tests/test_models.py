@@ -1,33 +1,159 @@
+import json
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
+import httpx
+import requests
+from models import http_pool
+from models.base import ERROR_PREFIX
+from models.http_pool import LeastOutstandingBalancer
 from models.ollama_model import OllamaChatModel
 from models.openai_model import OpenAIChatModel
 
 class TestOllamaModel(unittest.TestCase):
-    @patch('models.ollama_model.requests.post')
-    def test_generate(self, mock_post):
-        mock_response = MagicMock()
-        mock_response.json.return_value = {"message": {"content": "Hello"}}
-        mock_post.return_value = mock_response
+    def _model(self, session, **kwargs):
+        model = OllamaChatModel(**kwargs)
+        model._session = lambda base_url: session
+        model._backoff_delay = lambda attempt: 0
+        return model
 
-        model = OllamaChatModel()
+    def test_generate(self):
+        session = MagicMock()
+        session.post.return_value.json.return_value = {"message": {"content": "Hello"}}
+
+        model = self._model(session)
         response = model.generate([{"role": "user", "content": "Hi"}])
         self.assertEqual(response, "Hello")
+        self.assertEqual(session.post.call_args.kwargs["timeout"], (5.0, 45.0))
 
-    @patch('models.ollama_model.requests.post')
-    def test_stream(self, mock_post):
-        mock_response = MagicMock()
+    def test_stream(self):
+        session = MagicMock()
         lines = [
             b'{"message": {"content": "He"}}',
             b'{"message": {"content": "llo"}}'
         ]
-        mock_response.iter_lines.return_value = lines
-        mock_post.return_value.__enter__.return_value = mock_response
+        session.post.return_value.iter_lines.return_value = lines
 
-        model = OllamaChatModel()
+        model = self._model(session)
         chunks = list(model.stream([{"role": "user", "content": "Hi"}]))
         self.assertEqual("".join(chunks), "Hello")
 
+    def test_payload_keeps_model_loaded_with_stable_options(self):
+        session = MagicMock()
+        model = self._model(session, keep_alive=-1)
+        model.generate([{"role": "user", "content": "א"}])
+        model.generate([{"role": "user", "content": "ב"}])
+
+        first, second = [c.kwargs["json"] for c in session.post.call_args_list]
+        self.assertEqual(first["keep_alive"], -1)
+        self.assertEqual(first["options"], second["options"])
+
+    def test_warmup_preloads_every_server_without_retries(self):
+        session = MagicMock()
+        session.post.side_effect = requests.ConnectionError("refused")
+        model = self._model(session, base_url=["http://a:1", "http://b:2"])
+
+        model.warmup([{"role": "system", "content": "הנחיה"}])
+        self.assertEqual(session.post.call_count, 2)
+        self.assertEqual(session.post.call_args.kwargs["json"]["options"]["num_predict"], 1)
+
+    def test_session_is_shared_per_base_url(self):
+        a = OllamaChatModel(model_name="llama3")
+        b = OllamaChatModel(model_name="mistral")
+        self.assertIs(a._session(a.base_url), b._session(b.base_url))
+        self.assertIs(a.balancer, b.balancer)
+
+    def test_retries_connection_errors_on_another_server(self):
+        session = MagicMock()
+        ok = MagicMock()
+        ok.json.return_value = {"message": {"content": "Hello"}}
+        session.post.side_effect = [requests.ConnectionError("refused"), ok]
+
+        model = self._model(session, base_url=["http://a:1", "http://b:2"])
+        self.assertEqual(model.generate([{"role": "user", "content": "Hi"}]), "Hello")
+
+        urls = [c.args[0] for c in session.post.call_args_list]
+        self.assertNotEqual(urls[0], urls[1])
+        self.assertEqual(model.balancer.outstanding(), {"http://a:1": 0, "http://b:2": 0})
+
+    def test_read_timeout_is_not_retried(self):
+        session = MagicMock()
+        session.post.side_effect = requests.ReadTimeout("slow")
+
+        model = self._model(session)
+        self.assertTrue(model.generate([{"role": "user", "content": "Hi"}]).startswith(ERROR_PREFIX))
+        self.assertEqual(session.post.call_count, 1)
+
+    def test_gives_up_after_retries(self):
+        session = MagicMock()
+        session.post.side_effect = requests.ConnectionError("refused")
+
+        model = self._model(session, retries=2)
+        self.assertTrue(model.generate([{"role": "user", "content": "Hi"}]).startswith(ERROR_PREFIX))
+        self.assertEqual(session.post.call_count, 3)
+
+class TestLeastOutstandingBalancer(unittest.TestCase):
+    def test_picks_least_busy_and_rotates_ties(self):
+        lb = LeastOutstandingBalancer(["http://a", "http://b", "http://c"])
+
+        with lb.acquire() as first, lb.acquire() as second:
+            self.assertNotEqual(first, second)
+            with lb.acquire() as third:
+                self.assertEqual({first, second, third}, {"http://a", "http://b", "http://c"})
+            with lb.acquire() as fourth:
+                self.assertEqual(fourth, third)
+
+        self.assertEqual(set(lb.outstanding().values()), {0})
+
+    def test_avoid_falls_back_when_all_failed(self):
+        lb = LeastOutstandingBalancer(["http://a"])
+        with lb.acquire(avoid=["http://a"]) as url:
+            self.assertEqual(url, "http://a")
+
+class TestOllamaModelAsync(unittest.IsolatedAsyncioTestCase):
+    def _model(self, handler, **kwargs):
+        model = OllamaChatModel(**kwargs)
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        model._async_client = lambda base_url: client
+        model._backoff_delay = lambda attempt: 0
+        return model
+
+    async def test_agenerate(self):
+        def handler(request):
+            self.assertFalse(json.loads(request.content)["stream"])
+            return httpx.Response(200, json={"message": {"content": "Hello"}})
+
+        response = await self._model(handler).agenerate([{"role": "user", "content": "Hi"}])
+        self.assertEqual(response, "Hello")
+
+    async def test_astream(self):
+        body = b'{"message": {"content": "He"}}\n{"message": {"content": "llo"}}\n'
+
+        def handler(request):
+            return httpx.Response(200, content=body)
+
+        chunks = [c async for c in self._model(handler).astream([{"role": "user", "content": "Hi"}])]
+        self.assertEqual("".join(chunks), "Hello")
+
+    async def test_astream_retries_connect_errors(self):
+        hosts = []
+
+        def handler(request):
+            hosts.append(request.url.host)
+            if len(hosts) == 1:
+                raise httpx.ConnectError("refused", request=request)
+            return httpx.Response(200, content=b'{"message": {"content": "Hi"}}\n')
+
+        model = self._model(handler, base_url=["http://a:1", "http://b:2"])
+        chunks = [c async for c in model.astream([{"role": "user", "content": "Hi"}])]
+        self.assertEqual(chunks, ["Hi"])
+        self.assertEqual(len(set(hosts)), 2)
+
+    async def test_shared_async_client_per_loop(self):
+        a = http_pool.async_client("http://localhost:11434")
+        self.assertIs(a, http_pool.async_client("http://localhost:11434"))
+        await http_pool.aclose_async_clients()
+        self.assertTrue(a.is_closed)
+
 class TestOpenAIModel(unittest.TestCase):
     @patch('models.openai_model.OpenAI')
     @patch.dict('os.environ', {'OPENAI_API_KEY': 'test'})
@@ -42,5 +168,15 @@ class TestOpenAIModel(unittest.TestCase):
         response = model.generate([{"role": "user", "content": "Hi"}])
         self.assertEqual(response, "GPT response")
 
+    @patch('models.openai_model.AsyncOpenAI')
+    @patch('models.openai_model.OpenAI')
+    @patch.dict('os.environ', {'OPENAI_API_KEY': 'test'})
+    def test_close_releases_both_clients(self, mock_openai, mock_async_openai):
+        mock_async_openai.return_value.close = AsyncMock()
+
+        OpenAIChatModel().close()
+        mock_openai.return_value.close.assert_called_once()
+        mock_async_openai.return_value.close.assert_awaited_once()
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,13 +1,19 @@
+import asyncio
+import time
 import unittest
+import metrics
 from unittest.mock import patch, MagicMock
-from rag_service import LegalRAGService
+from lexical_index import LexicalIndex
+from rag_service import NO_SOURCES_INSTRUCTION, AnswerCleaner, LegalRAGService, reciprocal_rank_fusion
 from langchain_core.documents import Document
+from models.base import ERROR_PREFIX, ChatModel
 
 class TestRAGService(unittest.TestCase):
+    @patch('rag_service.chromadb')
     @patch('rag_service.Chroma')
     @patch('rag_service.HuggingFaceEmbeddings')
     @patch('rag_service.VECTOR_DB_DIR')
-    def test_retrieve(self, mock_dir, mock_embeddings, mock_chroma):
+    def test_retrieve(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb):
         mock_dir.exists.return_value = True
         
         mock_db_instance = MagicMock()
@@ -27,10 +33,101 @@ class TestRAGService(unittest.TestCase):
         self.assertEqual(len(docs), 1)
         self.assertEqual(docs[0].metadata["filename"], "doc1.pdf")
 
+    @patch('rag_service.chromadb')
     @patch('rag_service.Chroma')
     @patch('rag_service.HuggingFaceEmbeddings')
     @patch('rag_service.VECTOR_DB_DIR')
-    def test_answer(self, mock_dir, mock_embeddings, mock_chroma):
+    def test_retrieve_bm25_promotes_keyword_match(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb):
+        mock_dir.exists.return_value = True
+        mock_db_instance = MagicMock()
+        mock_retriever = MagicMock()
+        mock_db_instance.as_retriever.return_value = mock_retriever
+        mock_chroma.return_value = mock_db_instance
+
+        mock_retriever.invoke.return_value = [
+            Document(page_content="חברה אחרת לגמרי", metadata={"filename": "doc1.pdf"}),
+            Document(page_content="התובעת רבוע כחול", metadata={"filename": "doc2.pdf"}),
+        ]
+
+        service = LegalRAGService(chat_model=MagicMock(), scoring="bm25")
+        docs = service.retrieve("רבוע כחול")
+        self.assertEqual(docs[0].metadata["filename"], "doc2.pdf")
+
+        with self.assertRaises(ValueError):
+            LegalRAGService(chat_model=MagicMock(), scoring="nope")
+
+    @patch('rag_service.chromadb')
+    @patch('rag_service.Chroma')
+    @patch('rag_service.HuggingFaceEmbeddings')
+    @patch('rag_service.VECTOR_DB_DIR')
+    def test_retrieve_hybrid_adds_lexical_hits(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb):
+        mock_dir.exists.return_value = True
+        mock_db_instance = MagicMock()
+        mock_retriever = MagicMock()
+        mock_db_instance.as_retriever.return_value = mock_retriever
+        mock_chroma.return_value = mock_db_instance
+
+        mock_retriever.invoke.return_value = [
+            Document(page_content="חברה אחרת לגמרי", metadata={"filename": "doc1.pdf", "chunk_id": "doc1.pdf#0"}),
+        ]
+        mock_db_instance.get.return_value = {
+            "ids": ["doc2.pdf#0"],
+            "documents": ["התובעת רבוע כחול"],
+            "metadatas": [{"filename": "doc2.pdf", "chunk_id": "doc2.pdf#0"}],
+        }
+
+        service = LegalRAGService(chat_model=MagicMock())
+        service.lexicon = LexicalIndex()
+        service.lexicon.add("doc1.pdf#0", "חברה אחרת לגמרי")
+        service.lexicon.add("doc2.pdf#0", "התובעת רבוע כחול")
+
+        docs = service.retrieve("רבוע כחול")
+        mock_db_instance.get.assert_called_once_with(ids=["doc2.pdf#0"])
+        self.assertEqual(docs[0].metadata["filename"], "doc2.pdf")
+
+    @patch('rag_service.read_index_version')
+    @patch('rag_service.chromadb')
+    @patch('rag_service.Chroma')
+    @patch('rag_service.HuggingFaceEmbeddings')
+    @patch('rag_service.VECTOR_DB_DIR')
+    def test_answer_cache_and_invalidation(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb, mock_version):
+        mock_dir.exists.return_value = True
+        mock_version.return_value = "v1"
+        mock_db_instance = MagicMock()
+        mock_retriever = MagicMock()
+        mock_retriever.invoke.return_value = [Document(page_content="Context", metadata={"filename": "doc.pdf"})]
+        mock_db_instance.as_retriever.return_value = mock_retriever
+        mock_chroma.return_value = mock_db_instance
+
+        mock_chat = MagicMock()
+        mock_chat.generate.return_value = "Answer"
+        service = LegalRAGService(chat_model=mock_chat)
+
+        service.answer("מה נפסק?")
+        service.answer("  מה   נפסק ")
+        self.assertEqual(mock_chat.generate.call_count, 1)
+        self.assertEqual(mock_retriever.invoke.call_count, 1)
+        self.assertEqual(service.cache_stats()["answer"]["hits"], 1)
+
+        service.retrieve("איזה פסקי דין יש?")
+        service.retrieve("רשימה של פסקי הדין")
+        self.assertEqual(mock_retriever.invoke.call_count, 2)
+
+        mock_version.return_value = "v2"
+        service._version_checked_at = float("-inf")
+        service.answer("מה נפסק?")
+        self.assertEqual(mock_chat.generate.call_count, 2)
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]])
+        self.assertEqual(fused[0], "c")
+        self.assertEqual(set(fused), {"a", "b", "c", "d"})
+
+    @patch('rag_service.chromadb')
+    @patch('rag_service.Chroma')
+    @patch('rag_service.HuggingFaceEmbeddings')
+    @patch('rag_service.VECTOR_DB_DIR')
+    def test_answer(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb):
         mock_dir.exists.return_value = True
         mock_db_instance = MagicMock()
         mock_retriever = MagicMock()
@@ -48,5 +145,174 @@ class TestRAGService(unittest.TestCase):
         self.assertEqual(len(citations), 1)
         self.assertEqual(citations[0]["filename"], "doc.pdf")
 
+class TestPromptLayout(unittest.TestCase):
+    def test_system_prompt_is_static_and_documents_come_last(self):
+        with_docs = LegalRAGService._build_messages(LegalRAGService.__new__(LegalRAGService), "שאלה", "--- DOCUMENT [1] ---", 1)
+        without = LegalRAGService._build_messages(LegalRAGService.__new__(LegalRAGService), "שאלה אחרת", "", 0)
+
+        self.assertEqual(with_docs[0], without[0])
+        self.assertTrue(with_docs[-1]["content"].endswith("--- DOCUMENT [1] ---"))
+        # בלי מסמכים – ההנחיה שמבטלת את חובת ציון המקורות נמצאת בהודעת המשתמש
+        self.assertTrue(without[-1]["content"].endswith(NO_SOURCES_INSTRUCTION))
+        self.assertNotIn(NO_SOURCES_INSTRUCTION, with_docs[-1]["content"])
+
+class TestAnswerCleaner(unittest.TestCase):
+    def test_incremental_matches_full_clean(self):
+        text = "Answer: שלום. שלום. Directly in Hebrew. עולם"
+        expected = LegalRAGService._clean_answer(None, text)
+
+        cleaner = AnswerCleaner()
+        parts = [cleaner.feed(text[i:i + 3]) for i in range(0, len(text), 3)]
+        parts.append(cleaner.finish())
+
+        self.assertEqual("".join(parts).strip(), expected)
+        self.assertEqual(expected, "שלום. עולם.")
+
+    def test_emits_before_stream_ends(self):
+        cleaner = AnswerCleaner()
+        first = cleaner.feed("משפט ראשון ארוך מספיק כדי לעבור את חלון ההקדמה. המשך")
+        self.assertEqual(first, "משפט ראשון ארוך מספיק כדי לעבור את חלון ההקדמה")
+        self.assertEqual(cleaner.finish(), ". המשך.")
+
+class TestRAGServiceAsync(unittest.IsolatedAsyncioTestCase):
+    @patch('rag_service.chromadb')
+    @patch('rag_service.Chroma')
+    @patch('rag_service.HuggingFaceEmbeddings')
+    @patch('rag_service.VECTOR_DB_DIR')
+    async def test_concurrent_aanswer(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb):
+        mock_dir.exists.return_value = True
+        mock_db_instance = MagicMock()
+        mock_retriever = MagicMock()
+
+        def slow_invoke(query):
+            time.sleep(0.1)
+            return [Document(page_content="Context", metadata={"filename": "doc.pdf"})]
+
+        mock_retriever.invoke.side_effect = slow_invoke
+        mock_db_instance.as_retriever.return_value = mock_retriever
+        mock_chroma.return_value = mock_db_instance
+
+        class SlowModel(ChatModel):
+            def generate(self, messages):
+                raise AssertionError("sync path must not be used")
+
+            async def agenerate(self, messages):
+                await asyncio.sleep(0.2)
+                return "Answer"
+
+        service = LegalRAGService(chat_model=SlowModel(), retrieval_workers=4)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(service.aanswer(f"Question {i}") for i in range(4)))
+        elapsed = time.perf_counter() - start
+        service.close()
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0][1][0]["filename"], "doc.pdf")
+        self.assertLess(elapsed, 0.6)
+
+    @patch('rag_service.chromadb')
+    @patch('rag_service.Chroma')
+    @patch('rag_service.HuggingFaceEmbeddings')
+    @patch('rag_service.VECTOR_DB_DIR')
+    async def test_stage_spans_reach_request_trace(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb):
+        mock_dir.exists.return_value = True
+        mock_db_instance = MagicMock()
+        mock_retriever = MagicMock()
+        mock_retriever.invoke.return_value = [Document(page_content="Context", metadata={"filename": "doc.pdf"})]
+        mock_db_instance.as_retriever.return_value = mock_retriever
+        mock_chroma.return_value = mock_db_instance
+
+        class StreamingModel(ChatModel):
+            def generate(self, messages):
+                return "תשובה ראשונה. תשובה שנייה"
+
+        service = LegalRAGService(chat_model=StreamingModel())
+        trace = metrics.start_trace()
+        stream, _ = await service.astream_answer("Question")
+        "".join([text async for text in stream])
+        service.close()
+
+        self.assertTrue({"vector_search", "rerank", "context_build", "generation"} <= set(trace.stages))
+        self.assertEqual(trace.counts["completion_tokens"], 1)
+        self.assertGreater(trace.counts["prompt_words"], 0)
+
+    @patch('rag_service.chromadb')
+    @patch('rag_service.Chroma')
+    @patch('rag_service.HuggingFaceEmbeddings')
+    @patch('rag_service.VECTOR_DB_DIR')
+    async def test_answer_many_shares_retrieval_and_limits_concurrency(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb):
+        mock_dir.exists.return_value = True
+        mock_db_instance = MagicMock()
+        mock_chroma.return_value = mock_db_instance
+        mock_embeddings.return_value.embed_documents.side_effect = lambda texts: [[1.0, 0.0]] * len(texts)
+
+        def bulk_query(query_embeddings, n_results, include):
+            n = len(query_embeddings)
+            return {"documents": [["Context"]] * n, "metadatas": [[{"filename": "doc.pdf"}]] * n}
+
+        collection = mock_chromadb.PersistentClient.return_value.get_or_create_collection.return_value
+        collection.query.side_effect = bulk_query
+        running = []
+        peak = []
+
+        class SlowModel(ChatModel):
+            def generate(self, messages):
+                raise AssertionError("sync path must not be used")
+
+            async def agenerate(self, messages):
+                running.append(1)
+                peak.append(len(running))
+                # השאלה הראשונה נמשכת הכי הרבה – ולכן מגיעה אחרונה
+                await asyncio.sleep(0.1 if "Question 0" in messages[-1]["content"] else 0.01)
+                running.pop()
+                return "Answer"
+
+        service = LegalRAGService(chat_model=SlowModel())
+        questions = ["Question 0", "Question 1", "question 1?", "Question 2", "Question 3"]
+        results = [r async for r in service.answer_many(questions, concurrency=2)]
+        service.close()
+
+        self.assertEqual(sorted(r["index"] for r in results), [0, 1, 2, 3, 4])
+        self.assertEqual(results[-1]["index"], 0)
+        self.assertTrue(all(r["answer"] == "Answer." and r["citations"] for r in results))
+        self.assertLessEqual(max(peak), 2)
+
+        # Chroma נשאל פעם אחת, עם שאלה אחת לכל מפתח אחזור ("Question 1" ו-"question 1?" זהים)
+        collection.query.assert_called_once()
+        self.assertEqual(len(collection.query.call_args.kwargs["query_embeddings"]), 4)
+        mock_db_instance.as_retriever.return_value.invoke.assert_not_called()
+
+    @patch('rag_service.chromadb')
+    @patch('rag_service.Chroma')
+    @patch('rag_service.HuggingFaceEmbeddings')
+    @patch('rag_service.VECTOR_DB_DIR')
+    async def test_answer_many_reports_backend_errors(self, mock_dir, mock_embeddings, mock_chroma, mock_chromadb):
+        mock_dir.exists.return_value = True
+        mock_embeddings.return_value.embed_documents.side_effect = lambda texts: [[1.0, 0.0]] * len(texts)
+        collection = mock_chromadb.PersistentClient.return_value.get_or_create_collection.return_value
+        collection.query.side_effect = lambda query_embeddings, n_results, include: {
+            "documents": [["Context"]] * len(query_embeddings),
+            "metadatas": [[{"filename": "doc.pdf"}]] * len(query_embeddings),
+        }
+
+        class FlakyModel(ChatModel):
+            def generate(self, messages):
+                raise AssertionError("sync path must not be used")
+
+            async def agenerate(self, messages):
+                if "Question 1" in messages[-1]["content"]:
+                    return f"{ERROR_PREFIX}: Ollama is not reachable"
+                return "Answer"
+
+        service = LegalRAGService(chat_model=FlakyModel())
+        results = {r["index"]: r async for r in service.answer_many(["Question 0", "Question 1"])}
+        service.close()
+
+        self.assertEqual(results[0]["answer"], "Answer.")
+        self.assertNotIn("answer", results[1])
+        self.assertTrue(results[1]["error"].startswith(ERROR_PREFIX))
+        # שגיאה לא נשמרת ב-cache – הניסיון הבא פונה שוב למודל
+        self.assertEqual(len(service.answer_cache), 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import metrics
+from models.base import ChatModel
+from scheduler import BackendLimiter, GenerationScheduler, Overloaded
+
+
+class TestBackendLimiter(unittest.IsolatedAsyncioTestCase):
+    async def test_limits_concurrency_and_serves_queue_in_order(self):
+        limiter = BackendLimiter("test-order", max_concurrent=2, max_queue=10, max_queue_seconds=5)
+        running = []
+        peak = []
+        order = []
+
+        async def job(i):
+            async with limiter.slot():
+                order.append(i)
+                running.append(i)
+                peak.append(len(running))
+                await asyncio.sleep(0.01)
+                running.remove(i)
+
+        await asyncio.gather(*(job(i) for i in range(6)))
+
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(order, list(range(6)))
+        self.assertEqual((limiter.active, limiter.queued), (0, 0))
+
+    async def test_rejects_when_queue_is_full(self):
+        limiter = BackendLimiter("test-full", max_concurrent=1, max_queue=1, max_queue_seconds=5)
+        first = await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        self.assertEqual(metrics.GENERATION_QUEUE_DEPTH.value(backend="test-full"), 1)
+
+        with self.assertRaises(Overloaded) as ctx:
+            await limiter.acquire()
+        self.assertEqual(ctx.exception.status_code, 429)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+        first.release()
+        first.release()
+        second = await waiting
+        self.assertEqual(limiter.active, 1)
+        second.release()
+        self.assertEqual(limiter.active, 0)
+
+    async def test_queue_timeout_and_cancellation_leave_no_waiters(self):
+        limiter = BackendLimiter("test-timeout", max_concurrent=1, max_queue=5, max_queue_seconds=0.05)
+        held = await limiter.acquire()
+
+        with self.assertRaises(Overloaded) as ctx:
+            await limiter.acquire()
+        self.assertEqual(ctx.exception.status_code, 503)
+        self.assertEqual(metrics.GENERATION_REJECTED.value(backend="test-timeout", reason="queue_timeout"), 1)
+
+        cancelled = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await cancelled
+
+        self.assertEqual(limiter.queued, 0)
+        held.release()
+        self.assertEqual(limiter.active, 0)
+
+
+class TestScheduledModel(unittest.IsolatedAsyncioTestCase):
+    async def test_wrapped_model_generates_within_limit(self):
+        running = []
+        peak = []
+
+        class SlowModel(ChatModel):
+            model_name = "slow"
+            context_window = 1024
+
+            def generate(self, messages):
+                return "sync"
+
+            async def agenerate(self, messages):
+                running.append(1)
+                peak.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+                return "async"
+
+        scheduler = GenerationScheduler(max_queue=10, max_queue_seconds=5)
+        scheduler.configure("slow", 1)
+        model = scheduler.wrap(SlowModel(), "slow")
+
+        self.assertEqual(model.context_window, 1024)
+        self.assertEqual(await asyncio.gather(*(model.agenerate([]) for _ in range(3))), ["async"] * 3)
+        self.assertEqual(max(peak), 1)
+        self.assertIsInstance(scheduler.wrap(SlowModel(), "unlimited"), SlowModel)
+
+    async def test_reservation_is_used_by_the_next_generation(self):
+        class EchoModel(ChatModel):
+            def generate(self, messages):
+                return "sync"
+
+            async def agenerate(self, messages):
+                return "async"
+
+        scheduler = GenerationScheduler(max_queue=0, max_queue_seconds=1)
+        scheduler.configure("echo", 1)
+        limiter = scheduler.limiter("echo")
+        model = scheduler.wrap(EchoModel(), "echo")
+
+        await model.reserve()
+        self.assertEqual(limiter.active, 1)
+        with self.assertRaises(Overloaded):
+            await scheduler.wrap(EchoModel(), "echo").reserve()
+
+        self.assertEqual(await model.agenerate([]), "async")
+        self.assertEqual(limiter.active, 0)
+
+        await model.reserve()
+        model.cancel_reservation()
+        model.cancel_reservation()
+        self.assertEqual(limiter.active, 0)
+
+    async def test_patient_model_waits_instead_of_failing(self):
+        class EchoModel(ChatModel):
+            def generate(self, messages):
+                return "sync"
+
+            async def agenerate(self, messages):
+                return "async"
+
+        scheduler = GenerationScheduler(max_queue=0, max_queue_seconds=1)
+        scheduler.configure("echo", 1)
+        held = await scheduler.acquire("echo")
+        model = scheduler.wrap(EchoModel(), "echo", patient=True)
+
+        with patch("scheduler.asyncio.sleep", new=AsyncMock(side_effect=lambda _: held.release())) as sleep:
+            self.assertEqual(await model.agenerate([]), "async")
+
+        sleep.assert_awaited_once()
+        self.assertEqual(scheduler.limiter("echo").active, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
+
+from scraper import verdict_scraper
+from scraper.verdict_scraper import TabuVerdictScraper, TokenBucket, canonical_filename, parse_listing
+
+# עמודי תוצאות שנכתבו ביד במבנה של ה-DOM המרונדר (מה ש-Selenium רואה), לא עמודים ששמורים מהאתר
+FIXTURES = Path(__file__).parent / "fixtures" / "listing"
+
+
+class StandInServer:
+    # שרת מקומי במקום gov.il: כל נתיב מחזיר את שמו כתוכן, '/flaky' נכשל בניסיון הראשון, '/missing' תמיד 404;
+    # contents מחליף את התוכן של נתיב (None – 404), ו-If-None-Match מול ה-ETag מחזיר 304
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.contents = {}
+        self.conditional = []
+        self.requests = []
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests.append(self.path)
+                    attempts = server.requests.count(self.path)
+                    server.active += 1
+                    server.peak = max(server.peak, server.active)
+                try:
+                    time.sleep(server.delay)
+                    if self.path.startswith("/missing") or (self.path.startswith("/flaky") and attempts == 1):
+                        self.send_response(404 if self.path.startswith("/missing") else 500)
+                        self.end_headers()
+                        return
+                    body = server.contents.get(self.path, self.path.encode("utf-8"))
+                    if body is None:
+                        self.send_response(404)
+                        self.end_headers()
+                        return
+                    etag = f'"{hashlib.sha1(body).hexdigest()[:12]}"'
+                    if self.headers.get("If-None-Match"):
+                        server.conditional.append(self.path)
+                        if self.headers["If-None-Match"] == etag:
+                            self.send_response(304)
+                            self.end_headers()
+                            return
+                    self.send_response(200)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def documents(base_url, paths):
+    return [
+        {"url": f"{base_url}/{path}", "type": doc_type, "name": path, "downloaded": False, "failed_attempts": 0}
+        for path, doc_type in paths
+    ]
+
+
+class TestConcurrentDownloads(unittest.TestCase):
+    def test_downloads_in_parallel_and_respects_targets(self):
+        with StandInServer() as server, tempfile.TemporaryDirectory() as tmp:
+            scraper = TabuVerdictScraper(output_dir=tmp, concurrency=4, rate_per_host=1000, burst=10)
+            docs = documents(server.url, [
+                ("missing-a", "pdf"), ("a", "pdf"), ("b", "pdf"), ("c", "pdf"),
+                ("flaky-w", "word"), ("w", "word"), ("x", "word"),
+            ])
+            scraper.download_all(docs, target_pdf=2, target_word=2)
+
+            downloaded = sorted(p.name for p in Path(tmp).iterdir() if p.suffix in (".pdf", ".docx"))
+            self.assertEqual(downloaded, sorted(canonical_filename(docs[i]) for i in (1, 2, 4, 5)))
+            self.assertEqual((Path(tmp) / canonical_filename(docs[4])).read_bytes(), b"/flaky-w")
+            self.assertFalse(list(Path(tmp).glob("*.part")))
+
+            # רק מה שנוסה נשמר, כל מסמך כשההורדה שלו הסתיימה
+            saved = {d["url"]: d for d in scraper.store.all()}
+            self.assertEqual([saved[d["url"]]["downloaded"] for d in docs if d["url"] in saved], [False, True, True, True, True])
+            self.assertEqual(saved[docs[0]["url"]]["failed_attempts"], 1)
+            self.assertNotIn(docs[3]["url"], saved)
+
+            self.assertGreater(server.peak, 1)
+            self.assertLessEqual(server.peak, 4)
+            self.assertNotIn("/c", server.requests)
+
+    def test_rate_limit_spaces_requests_to_one_host(self):
+        with StandInServer(delay=0) as server, tempfile.TemporaryDirectory() as tmp:
+            scraper = TabuVerdictScraper(output_dir=tmp, concurrency=4, rate_per_host=20, burst=1)
+            docs = documents(server.url, [(f"d{i}", "pdf") for i in range(5)])
+
+            started = time.perf_counter()
+            scraper.download_all(docs, target_pdf=5, target_word=0)
+            elapsed = time.perf_counter() - started
+
+        self.assertTrue(all(d["downloaded"] for d in docs))
+        # 5 בקשות ב-20 לשנייה עם burst של 1: לפחות 4 מרווחים של 50ms
+        self.assertGreaterEqual(elapsed, 0.19)
+
+
+class TestChangeTracking(unittest.TestCase):
+    def changes(self, scraper):
+        lines = scraper.changes_file.read_text(encoding="utf-8").splitlines()
+        return [(e["event"], e["filename"]) for e in map(json.loads, lines)]
+
+    def test_dedup_conditional_refresh_and_change_feed(self):
+        with StandInServer(delay=0) as server, tempfile.TemporaryDirectory() as tmp:
+            server.contents["/b"] = b"/a"
+            scraper = TabuVerdictScraper(output_dir=tmp, concurrency=1, rate_per_host=1000, burst=10)
+            docs = documents(server.url, [("a", "pdf"), ("b", "pdf"), ("c", "pdf")])
+            a, b, c = (canonical_filename(d) for d in docs)
+
+            scraper.download_all(docs, target_pdf=2, target_word=0)
+            # b זהה ל-a: לא נשמר שוב ולא נספר ביעד, ולכן c הורד
+            self.assertEqual(sorted(p.name for p in Path(tmp).glob("*.pdf")), sorted([a, c]))
+            self.assertEqual(docs[1]["duplicate_of"], a)
+            self.assertEqual(docs[0]["sha256"], hashlib.sha256(b"/a").hexdigest())
+            self.assertEqual(self.changes(scraper), [("added", a), ("added", c)])
+
+            self.assertEqual(scraper.refresh(docs), {"unchanged": 3})
+            self.assertEqual(sorted(server.conditional), ["/a", "/b", "/c"])
+
+            server.contents.update({"/a": None, "/c": b"new c"})
+            self.assertEqual(scraper.refresh(docs), {"added": 1, "changed": 1, "removed": 1})
+            self.assertEqual(sorted(p.name for p in Path(tmp).glob("*.pdf")), sorted([b, c]))
+            self.assertEqual((Path(tmp) / c).read_bytes(), b"new c")
+            self.assertEqual([d["downloaded"] for d in docs], [False, True, True])
+            self.assertEqual(self.changes(scraper)[2:], [("removed", a), ("added", b), ("changed", c)])
+
+    def test_adopts_files_named_by_list_position(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            (Path(tmp) / "doc_0_x.pdf").write_bytes(b"same")
+            (Path(tmp) / "doc_1_y.pdf").write_bytes(b"same")
+            docs = documents("https://example.org", [("x", "pdf"), ("y", "pdf"), ("z", "pdf")])
+            for doc in docs:
+                doc["downloaded"] = True
+
+            scraper = TabuVerdictScraper(output_dir=tmp)
+            scraper.document_index(docs)
+
+            self.assertEqual([p.name for p in Path(tmp).glob("*.pdf")], [canonical_filename(docs[0])])
+            self.assertEqual(docs[1]["duplicate_of"], canonical_filename(docs[0]))
+            self.assertFalse(docs[2]["downloaded"])
+
+
+class TestDocumentStore(unittest.TestCase):
+    def test_imports_json_once_and_updates_rows(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            legacy = documents("https://example.org", [("a", "pdf"), ("b", "word"), ("c", "pdf")])
+            legacy[0].update(downloaded=True, filename="doc_0_a.pdf")
+            legacy[2].update(downloaded=True, duplicate_of="doc_0_a.pdf")
+            (Path(tmp) / "documents_data.json").write_text(json.dumps(legacy), encoding="utf-8")
+
+            scraper = TabuVerdictScraper(output_dir=tmp)
+            self.assertEqual([d["name"] for d in scraper.load_data()], ["a", "b", "c"])
+            self.assertEqual(scraper.store.downloaded_counts(), {"pdf": 1, "word": 0})
+
+            doc = scraper.store.get("https://example.org/b")
+            doc.update(downloaded=True, sha256="abc")
+            scraper.store.put(doc)
+            scraper.store.add_new(documents("https://example.org", [("b", "word"), ("d", "pdf")]))
+            scraper.store.close()
+
+            # ה-JSON לא מיובא שוב כשיש כבר מצב ב-SQLite
+            reopened = TabuVerdictScraper(output_dir=tmp).store
+            self.assertEqual(len(reopened), 4)
+            self.assertEqual(reopened.get("https://example.org/b")["sha256"], "abc")
+            self.assertEqual(reopened.downloaded_counts(), {"pdf": 1, "word": 1})
+            self.assertEqual(reopened.downloaded_urls(), {f"https://example.org/{p}" for p in "abc"})
+            reopened.close()
+
+
+class TestListing(unittest.TestCase):
+    def test_parse_rendered_results_page(self):
+        html = (FIXTURES / "skip_0.html").read_text(encoding="utf-8")
+        items = parse_listing(html, "https://www.gov.il/he/Departments/DynamicCollectors/tabu_search_verdict?skip=0")
+
+        self.assertEqual([i["type"] for i in items], ["pdf", "word", "word", None, "pdf"])
+        self.assertEqual(items[0]["url"], "https://www.gov.il/BlobFolder/dynamiccollectorresultitem/3-382-2024/he/verdict.pdf")
+        self.assertEqual(items[0]["name"], "3-382-2024")
+        self.assertEqual(items[2]["name"], "8-644-2023 & נספח")
+        self.assertEqual(parse_listing('<div id="root"></div>', "https://www.gov.il/"), [])
+
+    def test_failed_page_is_skipped_not_the_whole_listing(self):
+        fetched = []
+        pages = {0: "skip_0.html", 20: None, 40: "skip_20.html"}
+
+        class FakeBrowserBackend:
+            # None – העמוד לא נטען; עמוד שלא ברשימה – נטען בלי תוצאות
+            def fetch(self, page_url):
+                fetched.append(page_url)
+                skip = int(page_url.rsplit("=", 1)[1])
+                if skip in pages and pages[skip] is None:
+                    return None
+                if skip not in pages:
+                    return []
+                return parse_listing((FIXTURES / pages[skip]).read_text(encoding="utf-8"), page_url)
+
+            def close(self):
+                pass
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.object(verdict_scraper, "SeleniumListingBackend", FakeBrowserBackend):
+            scraper = TabuVerdictScraper(output_dir=tmp, rate_per_host=1000, burst=10)
+            scraper.search_url = "https://www.gov.il/collector?skip=0"
+            docs = scraper.gather_data(target_pdf=10, target_word=10)
+
+        self.assertEqual([url.rsplit("=", 1)[1] for url in fetched], ["0", "20", "40", "60"])
+        self.assertEqual([(d["name"], d["type"]) for d in docs][:3], [
+            ("3-382-2024", "pdf"), ("3-382-2024", "word"), ("8-644-2023 & נספח", "word"),
+        ])
+        self.assertIn(("3-161-2024", "pdf"), [(d["name"], d["type"]) for d in docs])
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=50, burst=3)
+        started = time.perf_counter()
+        for _ in range(3):
+            bucket.acquire()
+        self.assertLess(time.perf_counter() - started, 0.02)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertGreaterEqual(time.perf_counter() - started, 0.055)
+
+if __name__ == '__main__':
+    unittest.main()
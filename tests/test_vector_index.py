@@ -0,0 +1,152 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+
+import vector_index
+from vector_index import ChromaVectorIndex, NumpyVectorIndex, open_local_index
+
+try:
+    import hnswlib  # noqa: F401
+    HAS_HNSWLIB = True
+except ImportError:
+    HAS_HNSWLIB = False
+
+
+def random_vectors(count, dim=16, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def fill(index, vectors):
+    ids = [f"c{i}" for i in range(len(vectors))]
+    index.upsert(ids, vectors, [f"text {i}" for i in range(len(vectors))], [{"chunk_id": i} for i in ids])
+    index.persist()
+    return ids
+
+
+class TestNumpyVectorIndex(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.directory = Path(self._tmp.name)
+
+    def test_exact_top_k_across_blocks(self):
+        vectors = random_vectors(500)
+        queries = random_vectors(7, seed=1)
+        index = open_local_index("numpy", self.directory)
+        ids = fill(index, vectors)
+
+        expected = np.argsort(-(queries @ vectors.T), axis=1)[:, :10]
+        # מטריצה שמחולקת להרבה בלוקים נותנת בדיוק אותה תוצאה
+        with patch.object(vector_index, "SEARCH_BLOCK_ROWS", 64):
+            found = index.query(queries.tolist(), 10)
+
+        self.assertEqual([[d.metadata["chunk_id"] for d in docs] for docs in found],
+                         [[ids[row] for row in rows] for rows in expected])
+        self.assertIsInstance(index._snapshot.matrix, np.memmap)
+
+    def test_upsert_delete_and_reload(self):
+        vectors = random_vectors(20)
+        index = open_local_index("numpy", self.directory)
+        fill(index, vectors)
+
+        index.delete(["c0", "c1"])
+        index.upsert(["c2"], vectors[5:6], ["moved"], [{"chunk_id": "c2"}])
+        index.persist()
+
+        reopened = NumpyVectorIndex(self.directory / NumpyVectorIndex.DIRNAME)
+        self.assertEqual(reopened.count(), 18)
+        self.assertEqual(set(reopened.get(["c0", "c2"])), {"c2"})
+        self.assertEqual(reopened.get(["c2"])["c2"].page_content, "moved")
+        top = reopened.query([vectors[5].tolist()], 2)[0]
+        self.assertEqual({d.metadata["chunk_id"] for d in top}, {"c2", "c5"})
+
+        reopened.clear()
+        reopened.persist()
+        self.assertEqual(reopened.count(), 0)
+        self.assertEqual(reopened.query([vectors[0].tolist()], 5), [[]])
+
+    def test_upserts_are_staged_on_disk_until_persist(self):
+        vectors = random_vectors(30)
+        index = open_local_index("numpy", self.directory)
+        fill(index, vectors[:10])
+
+        # כמו בבנייה: כמה batches, מזהה שנכתב פעמיים ומזהה שנמחק אחרי שנכתב
+        index.upsert(["n0", "n1"], vectors[10:12], ["a", "b"], [{"chunk_id": "n0"}, {"chunk_id": "n1"}])
+        index.upsert(["n0", "c3"], vectors[12:14], ["a2", "c3-new"], [{"chunk_id": "n0"}, {"chunk_id": "c3"}])
+        index.delete(["n1", "c4"])
+        staged = self.directory / NumpyVectorIndex.DIRNAME / (NumpyVectorIndex.VECTORS_FILENAME + NumpyVectorIndex.STAGED_SUFFIX)
+        self.assertEqual(staged.stat().st_size, 4 * 4 * 16)
+        self.assertEqual(index.count(), 10)
+        self.assertFalse(hasattr(index, "_pending"))
+
+        index.persist()
+        self.assertFalse(staged.exists())
+        self.assertEqual(index.count(), 10)
+        self.assertEqual(index.get(["n0", "n1", "c3", "c4"]).keys(), {"n0", "c3"})
+        self.assertEqual(index.get(["n0"])["n0"].page_content, "a2")
+        self.assertEqual(index.query([vectors[12].tolist()], 1)[0][0].metadata["chunk_id"], "n0")
+        self.assertEqual(index.query([vectors[13].tolist()], 1)[0][0].page_content, "c3-new")
+
+
+@unittest.skipUnless(HAS_HNSWLIB, "hnswlib is not installed")
+class TestHnswVectorIndex(unittest.TestCase):
+    def test_recall_against_exact_search(self):
+        vectors = random_vectors(2000, dim=32)
+        queries = random_vectors(50, dim=32, seed=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            index = open_local_index("hnsw", Path(tmp))
+            ids = fill(index, vectors)
+            found = index.query(queries.tolist(), 10)
+
+            reopened = open_local_index("hnsw", Path(tmp))
+            self.assertIsNotNone(reopened._snapshot.graph)
+            self.assertEqual(reopened.query(queries[:1].tolist(), 10)[0][0].metadata, found[0][0].metadata)
+
+        expected = np.argsort(-(queries @ vectors.T), axis=1)[:, :10]
+        recall = np.mean([
+            len({d.metadata["chunk_id"] for d in docs} & {ids[row] for row in rows}) / 10
+            for docs, rows in zip(found, expected)
+        ])
+        self.assertGreaterEqual(recall, 0.9)
+
+    def test_large_k_does_not_change_the_shared_ef(self):
+        vectors = random_vectors(300)
+        with tempfile.TemporaryDirectory() as tmp:
+            fill(open_local_index("hnsw", Path(tmp)), vectors)
+            index = open_local_index("hnsw", Path(tmp), top_k=5)
+            graph = index._snapshot.graph
+            ef = graph.ef
+
+            found = index.query(vectors[:2].tolist(), vector_index.HNSW_EF_SEARCH + 50)
+
+        self.assertEqual(graph.ef, ef)
+        self.assertEqual([len(docs) for docs in found], [vector_index.HNSW_EF_SEARCH + 50] * 2)
+        self.assertEqual(found[0][0].metadata["chunk_id"], "c0")
+
+
+class TestChromaVectorIndex(unittest.TestCase):
+    def test_writes_and_queries_through_the_collection(self):
+        import chromadb
+        from langchain_community.vectorstores import Chroma
+
+        with tempfile.TemporaryDirectory() as tmp:
+            client = chromadb.PersistentClient(path=tmp)
+            store = Chroma(client=client, collection_name=vector_index.CHROMA_COLLECTION)
+            index = ChromaVectorIndex(store, vector_index.chroma_collection(client))
+            vectors = random_vectors(20)
+            fill(index, vectors)
+
+            self.assertEqual(index.count(), 20)
+            found = index.query(vectors[[3, 7]].tolist(), 2)
+            self.assertEqual([docs[0].metadata["chunk_id"] for docs in found], ["c3", "c7"])
+            self.assertEqual(index.get(["c5"])["c5"].page_content, "text 5")
+
+            index.delete(["c5"])
+            self.assertEqual(index.count(), 19)
+
+if __name__ == '__main__':
+    unittest.main()
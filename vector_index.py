@@ -0,0 +1,390 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+VECTOR_BACKENDS = ("chroma", "numpy", "hnsw")
+DEFAULT_VECTOR_BACKEND = "chroma"
+CHROMA_COLLECTION = "verdicts"
+
+# כמה שורות מהמטריצה נכפלות יחד בחיפוש המדויק – חוסם את הזיכרון של מטריצת הציונים
+SEARCH_BLOCK_ROWS = 65536
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128
+
+
+def vector_backend_from_env() -> str:
+    backend = os.getenv("VECTOR_BACKEND", DEFAULT_VECTOR_BACKEND)
+    if backend not in VECTOR_BACKENDS:
+        raise ValueError(f"Unknown vector backend: {backend}")
+    return backend
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class VectorIndex(ABC):
+    # הממשק ש-build_index.py כותב דרכו ו-LegalRAGService מחפש דרכו; הכתיבה באותה חתימה כמו אוסף של Chroma
+    name = ""
+
+    def __init__(self, embeddings: Optional[Embeddings] = None, top_k: int = 20):
+        self.embeddings = embeddings
+        self.top_k = top_k
+
+    def search(self, query: str, k: Optional[int] = None) -> List[Document]:
+        return self.query([self.embeddings.embed_query(query)], k or self.top_k)[0]
+
+    @abstractmethod
+    def query(self, vectors: Sequence[Sequence[float]], k: int) -> List[List[Document]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, ids: List[str]) -> Dict[str, Document]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[dict]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, ids: List[str]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def persist(self) -> None:
+        pass
+
+    def reload(self) -> None:
+        pass
+
+    def warmup(self) -> None:
+        pass
+
+
+def chroma_collection(client):
+    # האוסף עצמו, מאותו client של chromadb שה-store של langchain פתוח עליו (בלי embedding function – הווקטורים
+    # תמיד מגיעים מוכנים)
+    return client.get_or_create_collection(CHROMA_COLLECTION, embedding_function=None)
+
+
+class ChromaVectorIndex(VectorIndex):
+    # ההתנהגות הקיימת: אוסף Chroma ב-vectorstore/, עם SQLite ו-client מאחוריו. חיפוש לפי טקסט עובר דרך
+    # ה-store של langchain; שאילתות וכתיבה של ווקטורים מוכנים – ישירות מול האוסף של chromadb
+    name = "chroma"
+
+    def __init__(self, store, collection, top_k: int = 20):
+        super().__init__(None, top_k)
+        self.store = store
+        self.collection = collection
+        self.retriever = store.as_retriever(search_kwargs={"k": top_k})
+
+    def search(self, query: str, k: Optional[int] = None) -> List[Document]:
+        if k is None or k == self.top_k:
+            return self.retriever.invoke(query)
+        return self.store.similarity_search(query, k=k)
+
+    def query(self, vectors: Sequence[Sequence[float]], k: int) -> List[List[Document]]:
+        found = self.collection.query(
+            query_embeddings=vectors, n_results=k, include=["documents", "metadatas"]
+        )
+        return [
+            [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+            for texts, metadatas in zip(found["documents"], found["metadatas"])
+        ]
+
+    def get(self, ids: List[str]) -> Dict[str, Document]:
+        found = self.store.get(ids=ids)
+        return {
+            chunk_id: Document(page_content=text, metadata=metadata or {})
+            for chunk_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+        }
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[dict]) -> None:
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids: List[str]) -> None:
+        self.store.delete(ids=ids)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def warmup(self) -> None:
+        self.store.get(limit=1)
+
+
+class Snapshot(NamedTuple):
+    # כל מה שחיפוש קורא, מוחלף בהשמה אחת ב-reload – שאילתה שרצה בזמן בנייה מחדש רואה גרסה אחת שלמה
+    dim: int
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[dict]
+    rows: Dict[str, int]
+    matrix: np.ndarray
+    graph: Any = None
+
+
+class NumpyVectorIndex(VectorIndex):
+    # חיפוש מדויק בתוך התהליך: כל הווקטורים במטריצת float32 אחת (memory-mapped) והטקסטים ב-JSON lines לידה
+    # (שורה לכל וקטור, באותו סדר). שאילתה = כפל מטריצות אחד לכל בלוק שורות, גם לכמה שאלות יחד.
+    # בבנייה, כל upsert נכתב מיד לקבצי staging; persist ממזג אותם עם השורות שנשארות ומחליף את הקבצים
+    name = "numpy"
+    DIRNAME = "numpy"
+    VECTORS_FILENAME = "vectors.f32"
+    RECORDS_FILENAME = "records.jsonl"
+    STAGED_SUFFIX = ".staged"
+
+    def __init__(self, directory: Path, embeddings: Optional[Embeddings] = None, top_k: int = 20):
+        super().__init__(embeddings, top_k)
+        self.directory = Path(directory)
+        self.reload()
+
+    @property
+    def ids(self) -> List[str]:
+        return self._snapshot.ids
+
+    def reload(self) -> None:
+        self._snapshot = self._load()
+        # שינויים שעוד לא נכתבו (רק בצד הבנייה): בזיכרון רק המזהים – הווקטורים והטקסטים כבר בקבצי ה-staging
+        self._dim = self._snapshot.dim
+        self._close_staging()
+        self._staged: Dict[str, int] = {}
+        self._staged_rows = 0
+        self._deleted: Set[str] = set()
+
+    def _load(self) -> Snapshot:
+        ids, documents, metadatas = [], [], []
+        try:
+            with open(self.directory / self.RECORDS_FILENAME, "r", encoding="utf-8") as f:
+                for line in f:
+                    chunk_id, text, metadata = json.loads(line)
+                    ids.append(chunk_id)
+                    documents.append(text)
+                    metadatas.append(metadata)
+        except FileNotFoundError:
+            pass
+
+        path = self.directory / self.VECTORS_FILENAME
+        if ids:
+            dim = path.stat().st_size // (4 * len(ids))
+            matrix = np.memmap(path, dtype=np.float32, mode="r", shape=(len(ids), dim))
+        else:
+            dim = 0
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        return Snapshot(dim, ids, documents, metadatas, rows, matrix)
+
+    def _staged_path(self, filename: str) -> Path:
+        return self.directory / (filename + self.STAGED_SUFFIX)
+
+    def _close_staging(self) -> None:
+        staging = getattr(self, "_staging", None)
+        if staging is not None:
+            for f in staging:
+                f.close()
+        self._staging = None
+
+    def count(self) -> int:
+        return len(self._snapshot.ids)
+
+    @staticmethod
+    def _document(snapshot: Snapshot, row: int) -> Document:
+        return Document(page_content=snapshot.documents[row], metadata=dict(snapshot.metadatas[row] or {}))
+
+    def get(self, ids: List[str]) -> Dict[str, Document]:
+        snapshot = self._snapshot
+        return {
+            chunk_id: self._document(snapshot, snapshot.rows[chunk_id])
+            for chunk_id in ids if chunk_id in snapshot.rows
+        }
+
+    def top_rows(self, snapshot: Snapshot, vectors: Sequence[Sequence[float]], k: int) -> np.ndarray:
+        queries = normalize_rows(vectors)
+        k = min(k, len(snapshot.ids))
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+
+        for start in range(0, len(snapshot.ids), SEARCH_BLOCK_ROWS):
+            block = np.asarray(snapshot.matrix[start:start + SEARCH_BLOCK_ROWS])
+            block_scores = queries @ block.T
+            block_rows = np.broadcast_to(np.arange(start, start + len(block)), block_scores.shape)
+            scores = np.concatenate([best_scores, block_scores], axis=1)
+            rows = np.concatenate([best_rows, block_rows], axis=1)
+            if scores.shape[1] > k:
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores, best_rows = scores, rows
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return np.take_along_axis(best_rows, order, axis=1)
+
+    def query(self, vectors: Sequence[Sequence[float]], k: int) -> List[List[Document]]:
+        snapshot = self._snapshot
+        if not snapshot.ids:
+            return [[] for _ in vectors]
+        return [[self._document(snapshot, row) for row in rows] for rows in self.top_rows(snapshot, vectors, k)]
+
+    def warmup(self) -> None:
+        # קריאת המטריצה פעם אחת מכניסה אותה ל-page cache
+        matrix = self._snapshot.matrix
+        if len(matrix):
+            float(np.asarray(matrix).sum())
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: List[dict]) -> None:
+        vectors = normalize_rows(embeddings)
+        if not self._dim:
+            self._dim = vectors.shape[1]
+        if self._staging is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._staging = (
+                open(self._staged_path(self.VECTORS_FILENAME), "wb"),
+                open(self._staged_path(self.RECORDS_FILENAME), "w", encoding="utf-8"),
+            )
+        vectors_file, records_file = self._staging
+
+        vectors_file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        for chunk_id, text, metadata in zip(ids, documents, metadatas):
+            records_file.write(json.dumps([chunk_id, text, metadata], ensure_ascii=False) + "\n")
+            # מזהה שנכתב שוב – השורה האחרונה שלו היא שנכנסת לאינדקס
+            self._staged[chunk_id] = self._staged_rows
+            self._staged_rows += 1
+            self._deleted.discard(chunk_id)
+        vectors_file.flush()
+        records_file.flush()
+
+    def delete(self, ids: List[str]) -> None:
+        for chunk_id in ids:
+            self._staged.pop(chunk_id, None)
+            self._deleted.add(chunk_id)
+
+    def clear(self) -> None:
+        self.delete(list(self.ids))
+        self._staged.clear()
+
+    def persist(self) -> None:
+        self._write()
+        self.reload()
+
+    def _write(self) -> int:
+        # השורות שנשארות מועתקות בבלוקים מהקובץ הישן, ואחריהן השורות מה-staging (רק הגרסה האחרונה של כל מזהה);
+        # הכל בזרימה, והקבצים מוחלפים בסוף
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._close_staging()
+        old = self._snapshot
+        keep = [row for row, chunk_id in enumerate(old.ids) if chunk_id not in self._deleted and chunk_id not in self._staged]
+
+        vectors_tmp = self.directory / (self.VECTORS_FILENAME + ".tmp")
+        records_tmp = self.directory / (self.RECORDS_FILENAME + ".tmp")
+        with open(vectors_tmp, "wb") as vectors_file, open(records_tmp, "w", encoding="utf-8") as records_file:
+            for start in range(0, len(keep), SEARCH_BLOCK_ROWS):
+                block = keep[start:start + SEARCH_BLOCK_ROWS]
+                vectors_file.write(np.ascontiguousarray(old.matrix[block]).tobytes())
+                for row in block:
+                    line = [old.ids[row], old.documents[row], old.metadatas[row]]
+                    records_file.write(json.dumps(line, ensure_ascii=False) + "\n")
+            rows = len(keep)
+
+            if self._staged:
+                staged = np.memmap(
+                    self._staged_path(self.VECTORS_FILENAME), dtype=np.float32, mode="r",
+                    shape=(self._staged_rows, self._dim),
+                )
+                with open(self._staged_path(self.RECORDS_FILENAME), "r", encoding="utf-8") as f:
+                    for row, line in enumerate(f):
+                        chunk_id = json.loads(line)[0]
+                        if self._staged.get(chunk_id) == row:
+                            vectors_file.write(np.ascontiguousarray(staged[row]).tobytes())
+                            records_file.write(line)
+                            rows += 1
+                del staged
+
+        vectors_tmp.replace(self.directory / self.VECTORS_FILENAME)
+        records_tmp.replace(self.directory / self.RECORDS_FILENAME)
+        for filename in (self.VECTORS_FILENAME, self.RECORDS_FILENAME):
+            self._staged_path(filename).unlink(missing_ok=True)
+        return rows
+
+
+class HnswVectorIndex(NumpyVectorIndex):
+    # חיפוש מקורב: גרף HNSW (hnswlib) מעל אותה מטריצה. הגרף נבנה מחדש מכל המטריצה בכל persist,
+    # כך שמזהי הצמתים תמיד שווים למספרי השורות
+    name = "hnsw"
+    DIRNAME = "hnsw"
+    GRAPH_FILENAME = "graph.bin"
+
+    def __init__(
+        self,
+        directory: Path,
+        embeddings: Optional[Embeddings] = None,
+        top_k: int = 20,
+        ef_search: int = HNSW_EF_SEARCH,
+    ):
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("The hnsw vector backend needs hnswlib (pip install hnswlib)") from e
+
+        self._hnswlib = hnswlib
+        self.ef_search = ef_search
+        super().__init__(directory, embeddings, top_k)
+
+    def _load(self) -> Snapshot:
+        snapshot = super()._load()
+        path = self.directory / self.GRAPH_FILENAME
+        if not snapshot.ids or not path.exists():
+            return snapshot
+        graph = self._hnswlib.Index(space="ip", dim=snapshot.dim)
+        graph.load_index(str(path), max_elements=len(snapshot.ids))
+        graph.set_ef(max(self.ef_search, self.top_k))
+        return snapshot._replace(graph=graph)
+
+    def _write(self) -> int:
+        rows = super()._write()
+        graph_path = self.directory / self.GRAPH_FILENAME
+        if not rows:
+            graph_path.unlink(missing_ok=True)
+            return rows
+
+        matrix = np.memmap(self.directory / self.VECTORS_FILENAME, dtype=np.float32, mode="r", shape=(rows, self._dim))
+        graph = self._hnswlib.Index(space="ip", dim=self._dim)
+        graph.init_index(max_elements=rows, ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M, random_seed=0)
+        for start in range(0, rows, SEARCH_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + SEARCH_BLOCK_ROWS])
+            graph.add_items(block, np.arange(start, start + len(block)))
+
+        tmp = self.directory / (self.GRAPH_FILENAME + ".tmp")
+        graph.save_index(str(tmp))
+        tmp.replace(graph_path)
+        return rows
+
+    def top_rows(self, snapshot: Snapshot, vectors: Sequence[Sequence[float]], k: int) -> np.ndarray:
+        if snapshot.graph is None:
+            return super().top_rows(snapshot, vectors, k)
+        # ef נקבע פעם אחת בטעינה ולא משתנה לכל שאילתה – הגרף משותף לכל ה-threads; hnswlib ממילא מחפש
+        # עם max(ef, k), כך ש-k גדול מ-ef לא מחזיר פחות תוצאות
+        k = min(k, len(snapshot.ids))
+        rows, _ = snapshot.graph.knn_query(normalize_rows(vectors), k=k)
+        return rows.astype(np.int64)
+
+
+def open_local_index(backend: str, directory: Path, embeddings: Optional[Embeddings] = None, top_k: int = 20) -> VectorIndex:
+    # האינדקסים שבתוך התהליך; Chroma נפתח ע"י מי שמחזיק את ה-client שלו
+    if backend == "numpy":
+        return NumpyVectorIndex(Path(directory) / NumpyVectorIndex.DIRNAME, embeddings, top_k)
+    if backend == "hnsw":
+        return HnswVectorIndex(Path(directory) / HnswVectorIndex.DIRNAME, embeddings, top_k)
+    raise ValueError(f"Unknown vector backend: {backend}")